@@ -1,9 +1,9 @@
 import matplotlib
 matplotlib.use('Agg')  # 使用非交互式後端，避免GUI問題
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 import os
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import base64
@@ -14,28 +14,123 @@ import requests
 import markdown2
 from datetime import datetime
 import subprocess
+from artifacts import load_log_columns, load_log_info, load_episode_summary, episode_totals, load_qtable_frame, replicate_curves, load_policy_index
+from artifacts import LOG_NPZ, QTABLE_NPZ, QTABLE_CSV, EPISODES_NPZ, EPISODES_CSV, replicate_dirs
+from artifact_cache import ArtifactCache, source_stamp, cache_headers, is_not_modified
+from grid_env import compile_env, DEFAULT_RULE
+from planner import plan, greedy_rollout
+from qtable import QTable
+from map_codec import load_map_grid, compact_map, expand_map
 
 app = FastAPI()
 JOBS_DIR = 'jobs'
+artifact_cache = ArtifactCache()
+
+def job_sources(job_dir, *names):
+    return [os.path.join(job_dir, name) for name in names]
+
+def qtable_sources(job_dir):
+    return job_sources(job_dir, QTABLE_NPZ, QTABLE_CSV)
+
+def job_rule(job_dir):
+    """工作訓練時使用的環境規則（config.json 的 rule 欄位）；沒有記錄的舊工作皆以預設規則訓練"""
+    try:
+        with open(os.path.join(job_dir, 'config.json'), 'r', encoding='utf-8') as f:
+            rule = json.load(f).get('rule')
+    except (OSError, ValueError):
+        rule = None
+    return {**DEFAULT_RULE, **(rule or {})}
+
+def cached_response(request, job_dir, name, sources, compute):
+    """回傳以來源檔版本為 ETag 的快取結果；瀏覽器帶相同 ETag 重新確認時回應 304，不再計算或讀取"""
+    stamp = source_stamp(name, sources)
+    if stamp is None:
+        # 來源檔不存在，由計算函數回報錯誤
+        return compute()
+    etag, modified = stamp
+    headers = cache_headers(etag, modified)
+    if is_not_modified(request.headers, etag, modified):
+        return Response(status_code=304, headers=headers)
+    value = artifact_cache.get(job_dir, name, etag, lambda: jsonable_encoder(compute()))
+    return JSONResponse(value, headers=headers)
 
 @app.get('/{job_id}/curve')
-def get_learning_curve(job_id: str):
-    log_path = os.path.join(JOBS_DIR, job_id, 'log.csv')
-    if not os.path.exists(log_path):
-        raise HTTPException(status_code=404, detail='Log not found')
-    df = pd.read_csv(log_path)
-    rewards = df.groupby('episode')['reward'].sum().tolist()
-    steps = df.groupby('episode')['step'].max().tolist()
-    return {"rewards": rewards, "steps": steps}
+def get_learning_curve(job_id: str, request: Request):
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    sources = job_sources(job_dir, EPISODES_NPZ, EPISODES_CSV, LOG_NPZ, 'log.csv', 'config.json')
+    for replicate in replicate_dirs(job_dir)[1:]:
+        sources += job_sources(replicate, EPISODES_NPZ, EPISODES_CSV)
+    return cached_response(request, job_dir, 'curve', sources, lambda: learning_curve(job_dir))
+
+def learning_curve(job_dir):
+    # 優先讀取每回合摘要；舊訓練才由逐步記錄（log.npz 或 log.csv）彙總
+    summary = load_episode_summary(job_dir)
+    if summary is not None:
+        rewards, steps = summary['total_reward'].tolist(), summary['steps'].tolist()
+        episodes = summary['episode'].tolist()
+    else:
+        columns = load_log_columns(job_dir, ['episode', 'step', 'reward'])
+        if columns is None:
+            raise HTTPException(status_code=404, detail='Log not found')
+        rewards, steps = episode_totals(columns)
+        # every_k / last_m 只有部分回合有記錄，附上回合編號供前端對齊
+        episodes = np.unique(columns['episode']).tolist()
+    curve = {"rewards": rewards, "steps": steps, "episodes": episodes, **load_log_info(job_dir)}
+    # 重複實驗另附跨份的平均與百分位數曲線（第 0 份即上方的單份曲線）
+    replicates = replicate_curves(job_dir)
+    if replicates is not None:
+        curve['replicates'] = replicates
+    return curve
+
+@app.get('/{job_id}/regret')
+def get_regret(job_id: str, request: Request):
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    sources = qtable_sources(job_dir) + job_sources(job_dir, 'map.json', 'config.json', EPISODES_NPZ, EPISODES_CSV)
+    return cached_response(request, job_dir, 'regret', sources, lambda: regret(job_dir))
+
+def regret(job_dir):
+    # 以值迭代求出的最佳解為基準：學到的貪婪策略與最佳解的差距，以及訓練過程的累積遺憾
+    map_path = os.path.join(job_dir, 'map.json')
+    df = load_qtable_frame(job_dir)
+    if df is None or not os.path.exists(map_path):
+        raise HTTPException(status_code=404, detail='Q-Table or map not found')
+    with open(map_path, 'r', encoding='utf-8') as f:
+        map_grid = load_map_grid(json.load(f))
+    # 以訓練時的規則重建環境（獎勵、步數上限都會影響最佳解）
+    env = compile_env(map_grid, job_rule(job_dir))
+    try:
+        optimal_plan = plan(env)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'Cannot plan: {e}')
+    optimal = optimal_plan.rollout()
+    # 訓練獎勵在未抵達目標時歸零，因此最佳訓練獎勵為 max(0, 抵達目標的最佳總獎勵)
+    optimal_reward = max(0, optimal['value'] or 0)
+    q_table = QTable(env)
+    q_table.load_frame(df)
+    greedy = greedy_rollout(env, q_table.values)
+    greedy_reward = greedy['value'] if greedy['success'] else 0
+    result = {
+        'optimal': {**optimal, 'elapsed_ms': round(optimal_plan.elapsed * 1000, 3)},
+        'greedy': greedy,
+        'policy_regret': optimal_reward - greedy_reward,
+    }
+    summary = load_episode_summary(job_dir)
+    if summary is not None:
+        cumulative = np.cumsum(optimal_reward - summary['reward'])
+        result.update(episodes=summary['episode'].tolist(), cumulative_regret=cumulative.tolist(),
+                      total_regret=int(cumulative[-1]) if len(cumulative) else 0)
+    return result
 
 @app.get('/{job_id}/heatmap')
-def get_qtable_heatmap(job_id: str):
-    qtable_path = os.path.join(JOBS_DIR, job_id, 'q_table.csv')
-    if not os.path.exists(qtable_path):
+def get_qtable_heatmap(job_id: str, request: Request):
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    return cached_response(request, job_dir, 'heatmap', qtable_sources(job_dir), lambda: render_heatmap(job_dir))
+
+def render_heatmap(job_dir):
+    df = load_qtable_frame(job_dir)
+    if df is None:
         raise HTTPException(status_code=404, detail='Q-Table not found')
     
-    df = pd.read_csv(qtable_path)
-    
     # 檢查 Q-Table 是否為空
     if df.empty:
         raise HTTPException(status_code=400, detail='Q-Table is empty')
@@ -82,61 +177,32 @@ def get_qtable_heatmap(job_id: str):
     
     return {"heatmap_png_base64": heatmap_png_base64}
 
-@app.get('/{job_id}/optimal-path')
-def get_optimal_path(job_id: str):
-    qtable_path = os.path.join(JOBS_DIR, job_id, 'q_table.csv')
-    map_path = os.path.join(JOBS_DIR, job_id, 'map.json')
-    if not os.path.exists(qtable_path) or not os.path.exists(map_path):
+def find_optimal_path(job_dir):
+    """依工作的 Q-Table（快取的策略索引）由起點找出貪婪路徑，回傳 (地圖網格, 路徑)"""
+    map_path = os.path.join(job_dir, 'map.json')
+    policy = load_policy_index(job_dir)
+    if policy is None or not os.path.exists(map_path):
         raise HTTPException(status_code=404, detail='Q-Table or map not found')
-    df = pd.read_csv(qtable_path)
     with open(map_path, 'r', encoding='utf-8') as f:
         map_data = json.load(f)
-    grid = map_data['map'] if 'map' in map_data else None
+    grid = load_map_grid(map_data) if 'map' in map_data or 'grid' in map_data else None
     if grid is None:
         raise HTTPException(status_code=400, detail='Map format error')
-    # 找起點
-    start = None
-    for i, row in enumerate(grid):
-        for j, cell in enumerate(row):
-            if cell == 'S':
-                start = (i, j)
-    if start is None:
+    # 找起點（有多個時取最後一個）
+    starts = np.argwhere(grid == 'S')
+    if len(starts) == 0:
         raise HTTPException(status_code=400, detail='No start point')
-    # 依 Q-Table 找最優路徑
-    state = start
-    path = [state]
-    visited = set()
-    actions = ['up', 'down', 'left', 'right']
-    for _ in range(100):
-        visited.add(state)
-        q_vals = df[df['state'] == f"{state[0]},{state[1]}"]
-        if q_vals.empty:
-            break
-        best = q_vals.loc[q_vals['value'].idxmax()]
-        action = best['action']
-        # 移動
-        i, j = state
-        if action == 'up':
-            ni, nj = i-1, j
-        elif action == 'down':
-            ni, nj = i+1, j
-        elif action == 'left':
-            ni, nj = i, j-1
-        elif action == 'right':
-            ni, nj = i, j+1
-        else:
-            break
-        if not (0 <= ni < len(grid) and 0 <= nj < len(grid[0])):
-            break
-        if grid[ni][nj] == '1':
-            break
-        state = (ni, nj)
-        path.append(state)
-        if grid[ni][nj] == 'G':
-            break
-        if state in visited:
-            break
-    
+    return grid, policy.greedy_path(grid, tuple(starts[-1].tolist()))
+
+@app.get('/{job_id}/optimal-path')
+def get_optimal_path(job_id: str, request: Request):
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    sources = qtable_sources(job_dir) + job_sources(job_dir, 'map.json')
+    return cached_response(request, job_dir, 'optimal_path', sources, lambda: render_optimal_path(job_dir))
+
+def render_optimal_path(job_dir):
+    grid, path = find_optimal_path(job_dir)
+
     # 生成最優路徑圖片
     plt.figure(figsize=(8, 6))
     plt.title('Optimal Path')
@@ -179,23 +245,31 @@ def get_optimal_path(job_id: str):
     return {"optimal_path": path, "path_png_base64": path_png_base64}
 
 def build_analysis_prompt(job_id, user_prompt):
-    log_path = os.path.join(JOBS_DIR, job_id, 'log.csv')
-    qtable_path = os.path.join(JOBS_DIR, job_id, 'q_table.csv')
-    map_path = os.path.join(JOBS_DIR, job_id, 'map.json')
-    # 學習曲線摘要
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    # 學習曲線摘要（優先讀取每回合摘要，舊訓練才彙總逐步記錄）
     rewards, steps = [], []
     training_summary = {}
-    if os.path.exists(log_path):
-        df_log = pd.read_csv(log_path)
-        rewards = df_log.groupby('episode')['reward'].sum().tolist()[:20]
-        steps = df_log.groupby('episode')['step'].max().tolist()[:20]
+    success_rate = '未知'
+    summary = load_episode_summary(job_dir)
+    if summary is not None:
+        log_columns = {'episode': summary['episode']}
+        all_rewards, all_steps = summary['total_reward'].tolist(), summary['steps'].tolist()
+        if len(summary['success']):
+            success_rate = f"{summary['success'].mean() * 100:.1f}%"
+    else:
+        log_columns = load_log_columns(job_dir, ['episode', 'step', 'reward'])
+        if log_columns is not None:
+            all_rewards, all_steps = episode_totals(log_columns)
+    if log_columns is not None:
+        rewards = all_rewards[:20]
+        steps = all_steps[:20]
         
-        # 計算訓練統計
-        total_episodes = df_log['episode'].max()
-        avg_reward = df_log.groupby('episode')['reward'].sum().mean()
-        avg_steps = df_log.groupby('episode')['step'].max().mean()
-        final_reward = df_log.groupby('episode')['reward'].sum().iloc[-1] if len(rewards) > 0 else 0
-        final_steps = df_log.groupby('episode')['step'].max().iloc[-1] if len(steps) > 0 else 0
+        # 計算訓練統計（舊訓練的 every_k / last_m 只涵蓋有記錄的回合）
+        total_episodes = int(log_columns['episode'].max()) if len(log_columns['episode']) else 0
+        avg_reward = np.mean(all_rewards)
+        avg_steps = np.mean(all_steps)
+        final_reward = all_rewards[-1] if len(rewards) > 0 else 0
+        final_steps = all_steps[-1] if len(steps) > 0 else 0
         
         training_summary = {
             'total_episodes': total_episodes,
@@ -206,59 +280,28 @@ def build_analysis_prompt(job_id, user_prompt):
             'reward_trend': '上升' if len(rewards) > 1 and rewards[-1] > rewards[0] else '下降' if len(rewards) > 1 and rewards[-1] < rewards[0] else '穩定',
             'steps_trend': '下降' if len(steps) > 1 and steps[-1] < steps[0] else '上升' if len(steps) > 1 and steps[-1] > steps[0] else '穩定'
         }
+    log_info = load_log_info(job_dir)
+    partial_note = '，統計僅涵蓋這些回合' if summary is None else ''
+    log_note = {
+        'full': '逐步記錄（所有回合）',
+        'episode': '每回合摘要（無逐步資料）',
+        'every_k': f"每第 {log_info['log_every']} 回合的逐步記錄{partial_note}",
+        'last_m': f"最後 {log_info['log_last']} 回合的逐步記錄{partial_note}",
+    }.get(log_info['log_level'], log_info['log_level'])
     # Q-Table 熱門狀態摘要
     qtable_str = ''
-    if os.path.exists(qtable_path):
-        df_q = pd.read_csv(qtable_path)
+    df_q = load_qtable_frame(job_dir)
+    if df_q is not None:
         qtable_top = df_q.sort_values('value', ascending=False).head(10)
         qtable_str = '\n'.join([f"{row['state']}, {row['action']}, {row['value']}" for _, row in qtable_top.iterrows()])
     # 最優路徑
     optimal_path = []
-    if os.path.exists(qtable_path) and os.path.exists(map_path):
-        # 直接複用 get_optimal_path 的邏輯
-        with open(map_path, 'r', encoding='utf-8') as f:
-            map_data = json.load(f)
-        grid = map_data['map'] if 'map' in map_data else None
-        if grid:
-            df = pd.read_csv(qtable_path)
-            start = None
-            for i, row in enumerate(grid):
-                for j, cell in enumerate(row):
-                    if cell == 'S':
-                        start = (i, j)
-            if start:
-                state = start
-                path = [state]
-                visited = set()
-                for _ in range(100):
-                    visited.add(state)
-                    q_vals = df[df['state'] == f"{state[0]},{state[1]}"]
-                    if q_vals.empty:
-                        break
-                    best = q_vals.loc[q_vals['value'].idxmax()]
-                    action = best['action']
-                    i, j = state
-                    if action == 'up':
-                        ni, nj = i-1, j
-                    elif action == 'down':
-                        ni, nj = i+1, j
-                    elif action == 'left':
-                        ni, nj = i, j-1
-                    elif action == 'right':
-                        ni, nj = i, j+1
-                    else:
-                        break
-                    if not (0 <= ni < len(grid) and 0 <= nj < len(grid[0])):
-                        break
-                    if grid[ni][nj] == '1':
-                        break
-                    state = (ni, nj)
-                    path.append(state)
-                    if grid[ni][nj] == 'G':
-                        break
-                    if state in visited:
-                        break
-                optimal_path = path
+    if df_q is not None:
+        # 與 get_optimal_path 共用同一份策略索引
+        try:
+            optimal_path = find_optimal_path(job_dir)[1]
+        except HTTPException:
+            pass
     # 合併 prompt
     prompt = f"""{user_prompt}
 
@@ -272,6 +315,8 @@ def build_analysis_prompt(job_id, user_prompt):
 - **最終步數**: {training_summary.get('final_steps', 0)}
 - **獎勵趨勢**: {training_summary.get('reward_trend', '未知')}
 - **步數趨勢**: {training_summary.get('steps_trend', '未知')}
+- **成功率**: {success_rate}
+- **記錄層級**: {log_note}
 
 ### 學習曲線數據（前20回合）
 - **獎勵序列**: {rewards}
@@ -534,14 +579,14 @@ def get_job_rule(job_id: str):
     return rule_data
 
 @app.get('/{job_id}/map.json')
-def get_job_map(job_id: str):
-    """返回 job 專用的 map.json"""
+def get_job_map(job_id: str, format: str = 'full'):
+    """返回 job 專用的 map.json（format=compact 時回傳精簡格式）"""
     map_path = os.path.join(JOBS_DIR, job_id, 'map.json')
     if not os.path.exists(map_path):
         raise HTTPException(status_code=404, detail='Job map not found')
     with open(map_path, 'r', encoding='utf-8') as f:
         map_data = json.load(f)
-    return map_data
+    return compact_map(map_data) if format == 'compact' else expand_map(map_data)
 
 @app.get('/{job_id}/verify')
 def verify_training_api(job_id: str):
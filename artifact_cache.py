@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+CACHE_DIR = 'cache'  # 工作目錄下存放已計算分析結果的子目錄
+CACHE_VERSION = 1  # 結果格式或算法改變時遞增，使舊快取失效
+MEMORY_CACHE_SIZE = 64  # 每個行程在記憶體中保留的結果數
+
+
+def source_stamp(name, paths):
+    """結果 name 的來源檔版本，回傳 (ETag, 最後修改時間)；來源檔都不存在時回傳 None
+
+    以各來源檔的路徑、修改時間與大小計算雜湊，任一檔案被改寫、新增或刪除時版本即改變。
+    """
+    digest = hashlib.sha1(f'v{CACHE_VERSION}\0{name}\0'.encode('utf-8'))
+    latest = None
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        digest.update(f'{path}\0{stat.st_mtime_ns}\0{stat.st_size}\0'.encode('utf-8'))
+        latest = stat.st_mtime if latest is None else max(latest, stat.st_mtime)
+    if latest is None:
+        return None
+    return f'"{digest.hexdigest()}"', latest
+
+
+def cache_headers(etag, modified):
+    """條件式請求用的回應標頭；no-cache 讓瀏覽器每次以 If-None-Match 向伺服器確認"""
+    return {'ETag': etag, 'Last-Modified': formatdate(modified, usegmt=True), 'Cache-Control': 'no-cache'}
+
+
+def is_not_modified(headers, etag, modified):
+    """依請求的 If-None-Match（優先）或 If-Modified-Since 判斷是否可回應 304"""
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # HTTP 日期只到秒
+    return int(modified) <= since
+
+
+class ArtifactCache:
+    """分析結果（圖片、曲線等 JSON 內容）的兩層快取：行程內 LRU 與工作目錄下的 cache/ 檔案
+
+    每筆結果記錄計算當時的來源版本（ETag），版本不同時重新計算並覆寫；
+    工作目錄無法寫入時只保留在記憶體中。
+    """
+
+    def __init__(self, size=MEMORY_CACHE_SIZE):
+        self.size = size
+        self._memory = OrderedDict()
+
+    def get(self, job_dir, name, etag, compute):
+        """取得 name 在來源版本 etag 下的結果，記憶體與磁碟都沒有時呼叫 compute 計算"""
+        key = (job_dir, name)
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] == etag:
+            self._memory.move_to_end(key)
+            return entry[1]
+        path = os.path.join(job_dir, CACHE_DIR, f'{name}.json')
+        value = self._read(path, etag)
+        if value is None:
+            value = compute()
+            self._write(path, etag, value)
+        self._memory[key] = (etag, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+        return value
+
+    @staticmethod
+    def _read(path, etag):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data.get('value') if data.get('etag') == etag else None
+
+    @staticmethod
+    def _write(path, etag, value):
+        # 先寫暫存檔再替換，避免同時讀取時看到寫到一半的檔案
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'etag': etag, 'value': value}, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"無法寫入分析快取 {path}: {e}")
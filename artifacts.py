@@ -0,0 +1,512 @@
+import os
+import json
+import time
+import shutil
+import zipfile
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+from grid_env import ACTIONS, ACTION_DELTAS, OBSTACLE, GOAL
+from log_writer import LogPolicy
+
+LOG_NPZ = 'log.npz'
+QTABLE_NPZ = 'q_table.npz'
+EPISODES_CSV = 'episodes.csv'
+EPISODES_NPZ = 'episodes.npz'
+RESULT_JSON = 'result.json'
+FORMAT_VERSION = 1
+EPISODE_FLUSH = 100  # episodes.csv 每累積多少回合附加寫出一次
+PROGRESS_EVENTS = 200  # 每次訓練預設送出的進度事件數
+REPLICATES_DIR = 'replicates'  # 重複實驗第 1 份起的輸出目錄（第 0 份直接寫在工作目錄）
+QTABLE_CSV = 'q_table.csv'
+POLICY_CACHE_SIZE = 32  # 每個行程保留的策略索引數
+PATH_MAX_STEPS = 100  # 最優路徑的步數上限
+CURVE_PERCENTILES = (5, 50, 95)  # 重複實驗曲線的百分位數
+SUCCESS_WINDOW = 100  # 成功率曲線的移動視窗（回合數）
+
+# log.npz 的逐步欄位型別（state/next_state 為狀態編號，對照 state_cells）
+LOG_DTYPES = {
+    'episode': np.int32,
+    'step': np.int32,
+    'state': np.int32,
+    'action': np.int8,
+    'reward': np.int32,
+    'next_state': np.int32,
+    'done': np.bool_,
+    'success': np.bool_,
+}
+
+# 每回合摘要欄位：total_reward 為原始總獎勵，reward 為歸零判斷後的獎勵，
+# terminal_state 為回合結束時的狀態編號，elapsed 為自訓練開始的秒數
+EPISODE_DTYPES = {
+    'episode': np.int32,
+    'total_reward': np.int64,
+    'reward': np.int64,
+    'steps': np.int32,
+    'success': np.bool_,
+    'terminal_state': np.int32,
+    'epsilon': np.float64,
+    'elapsed': np.float64,
+}
+
+
+def _write_npy_member(zf, name, array=None, raw_path=None, dtype=None, count=0):
+    """在 npz 中寫入一個 .npy 成員；可直接給陣列，或從原始二進位檔串流複製"""
+    with zf.open(name + '.npy', 'w', force_zip64=True) as fp:
+        if array is not None:
+            np.lib.format.write_array(fp, np.asarray(array), allow_pickle=False)
+            return
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (count,)}
+        np.lib.format.write_array_header_1_0(fp, header)
+        with open(raw_path, 'rb') as src:
+            shutil.copyfileobj(src, fp, 1 << 20)
+
+
+class NpzLogSink:
+    """將逐步記錄以欄式二進位格式寫入 log.npz
+
+    每個欄位先分塊附加到暫存的原始檔，結束時再串流封裝成未壓縮的 npz，
+    記憶體用量與記錄筆數無關。epsilon 每回合只存一次，λ 與記錄層級整次訓練只存一次。
+    """
+
+    def __init__(self, path, state_cells, lambda_value=None, log_info=None, resume=None):
+        self.path = path
+        self.state_cells = state_cells
+        self.lambda_value = lambda_value
+        self.log_info = log_info or LogPolicy().to_dict()
+        self.parts_dir = path + '.parts'
+        os.makedirs(self.parts_dir, exist_ok=True)
+        names = list(LOG_DTYPES) + ['episode_index', 'episode_epsilon']
+        self.counts = dict.fromkeys(names, 0)
+        self.last_episode = None
+        if resume is None:
+            self.files = {name: open(os.path.join(self.parts_dir, name), 'wb') for name in names}
+        else:
+            # 從 checkpoint 續跑：各欄位截斷到 checkpoint 時的筆數後繼續附加
+            self.counts.update(resume['counts'])
+            self.last_episode = resume['last_episode']
+            self.files = {}
+            for name in names:
+                f = open(os.path.join(self.parts_dir, name), 'r+b')
+                f.truncate(self.counts[name] * np.dtype(self._dtype(name)).itemsize)
+                f.seek(0, os.SEEK_END)
+                self.files[name] = f
+
+    @staticmethod
+    def _dtype(name):
+        return LOG_DTYPES.get(name, np.int32 if name == 'episode_index' else np.float64)
+
+    def state(self):
+        """目前各欄位的筆數（供 checkpoint 記錄）"""
+        for f in self.files.values():
+            f.flush()
+        last_episode = None if self.last_episode is None else int(self.last_episode)
+        return {'counts': dict(self.counts), 'last_episode': last_episode}
+
+    def _append(self, name, values, dtype):
+        values = np.ascontiguousarray(values, dtype=dtype)
+        self.files[name].write(values.tobytes())
+        self.counts[name] += len(values)
+
+    def write(self, columns):
+        for name, dtype in LOG_DTYPES.items():
+            self._append(name, columns[name], dtype)
+        # 每回合只記錄第一次出現時的 epsilon
+        episodes = columns['episode']
+        first = np.ones(len(episodes), dtype=bool)
+        first[1:] = episodes[1:] != episodes[:-1]
+        if len(episodes) and episodes[0] == self.last_episode:
+            first[0] = False
+        self._append('episode_index', episodes[first], np.int32)
+        self._append('episode_epsilon', columns['epsilon'][first], np.float64)
+        if len(episodes):
+            self.last_episode = episodes[-1]
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        tmp_path = self.path + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name, f in self.files.items():
+                _write_npy_member(zf, name, raw_path=f.name, dtype=self._dtype(name), count=self.counts[name])
+            _write_npy_member(zf, 'state_cells', array=self.state_cells)
+            _write_npy_member(zf, 'format_version', array=np.int32(FORMAT_VERSION))
+            if self.lambda_value is not None:
+                _write_npy_member(zf, 'lambda_param', array=np.float64(self.lambda_value))
+            _write_npy_member(zf, 'log_level', array=np.str_(self.log_info['log_level']))
+            _write_npy_member(zf, 'log_every', array=np.int32(self.log_info['log_every']))
+            _write_npy_member(zf, 'log_last', array=np.int32(self.log_info['log_last']))
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def abort(self):
+        """訓練失敗時只關閉暫存檔，保留 log.npz.parts 供續跑截斷後接著寫"""
+        for f in self.files.values():
+            f.close()
+
+
+class EpisodeLog:
+    """訓練中逐回合寫出的摘要（episodes.csv 與 episodes.npz）
+
+    每回合一筆，大小只與回合數有關；分析端點讀這個檔即可，不必彙總逐步記錄。
+    有 progress 回呼時，每 progress_every 回合送出一次這段期間的平均值（即時進度串流）。
+    """
+
+    def __init__(self, output_dir, env, episodes, flush_every=EPISODE_FLUSH, progress=None, progress_every=None):
+        self.csv_path = os.path.join(output_dir, EPISODES_CSV)
+        self.npz_path = os.path.join(output_dir, EPISODES_NPZ)
+        self.labels = np.asarray(env.state_labels, dtype=object)
+        self.state_cells = env.state_cells
+        self.flush_every = flush_every
+        self.columns = {name: np.zeros(episodes, dtype=dtype) for name, dtype in EPISODE_DTYPES.items()}
+        self.size = 0
+        self.written = 0
+        self.start = time.perf_counter()
+        self.episodes = episodes
+        self.progress = progress
+        self.progress_every = progress_every or max(1, episodes // PROGRESS_EVENTS)
+        self.reported = 0
+
+    def append(self, episode, total_reward, reward, steps, success, terminal_state, epsilon):
+        """附加一回合的摘要"""
+        i = self.size
+        row = (episode, total_reward, reward, steps, success, terminal_state, epsilon, time.perf_counter() - self.start)
+        for values, value in zip(self.columns.values(), row):
+            values[i] = value
+        self.size = i + 1
+        self._after_append()
+
+    def append_columns(self, columns):
+        """附加一批回合的摘要（批次訓練使用，elapsed 為該批結束的時間）"""
+        n = len(columns['episode'])
+        columns = dict(columns, elapsed=time.perf_counter() - self.start)
+        for name, values in self.columns.items():
+            values[self.size:self.size + n] = columns[name]
+        self.size += n
+        self._after_append()
+
+    def _after_append(self):
+        if self.size - self.written >= self.flush_every:
+            self._flush()
+        if self.progress is not None and self.size - self.reported >= self.progress_every:
+            self._report()
+
+    def _report(self):
+        rows = slice(self.reported, self.size)
+        last = self.size - 1
+        columns = self.columns
+        self.progress({
+            'episode': int(columns['episode'][last]),
+            'episodes': self.episodes,
+            'reward': float(columns['reward'][rows].mean()),
+            'total_reward': float(columns['total_reward'][rows].mean()),
+            'steps': float(columns['steps'][rows].mean()),
+            'success_rate': float(columns['success'][rows].mean()),
+            'epsilon': float(columns['epsilon'][last]),
+            'elapsed': round(float(columns['elapsed'][last]), 3),
+        })
+        self.reported = self.size
+
+    def state(self):
+        """寫出 episodes.csv 並回傳目前位置（各欄位陣列由 checkpoint 另外保存）"""
+        if self.size > self.written or self.written == 0:
+            self._flush()
+        return {'size': self.size, 'csv_size': os.path.getsize(self.csv_path)}
+
+    def restore(self, state, columns):
+        """從 checkpoint 還原已完成回合的摘要，並截斷 episodes.csv"""
+        size = state['size']
+        for name, values in self.columns.items():
+            values[:size] = columns[name][:size]
+        self.size = self.written = self.reported = size
+        with open(self.csv_path, 'r+b') as f:
+            f.truncate(state['csv_size'])
+        if size:
+            # elapsed 接續之前的累計時間
+            self.start = time.perf_counter() - float(self.columns['elapsed'][size - 1])
+
+    def _flush(self):
+        rows = slice(self.written, self.size)
+        frame = {name: values[rows] for name, values in self.columns.items()}
+        frame['terminal_state'] = self.labels[frame['terminal_state']]
+        header = self.written == 0
+        pd.DataFrame(frame).to_csv(self.csv_path, mode='w' if header else 'a', header=header, index=False)
+        self.written = self.size
+
+    def close(self):
+        if self.size > self.written or self.written == 0:
+            self._flush()
+        if self.progress is not None and self.size > self.reported:
+            self._report()
+        columns = {name: values[:self.size] for name, values in self.columns.items()}
+        np.savez(self.npz_path, state_cells=self.state_cells, format_version=np.int32(FORMAT_VERSION), **columns)
+
+
+def save_qtable_npz(path, q_table, env):
+    """以二進位格式輸出 Q-Table（無效動作的值為 -inf）"""
+    np.savez(path, values=q_table.values, mask=q_table.mask, state_cells=env.state_cells,
+             grid_shape=np.array([env.rows, env.cols], dtype=np.int32), format_version=np.int32(FORMAT_VERSION))
+
+
+def load_log_columns(job_dir, columns):
+    """讀取逐步記錄的指定欄位；有 log.npz 時直接讀二進位欄位，否則解析 log.csv"""
+    npz_path = os.path.join(job_dir, LOG_NPZ)
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as data:
+            return {name: data[name] for name in columns}
+    csv_path = os.path.join(job_dir, 'log.csv')
+    if not os.path.exists(csv_path):
+        return None
+    df = pd.read_csv(csv_path, usecols=columns)
+    return {name: df[name].to_numpy() for name in columns}
+
+
+def load_log_info(job_dir):
+    """讀取訓練使用的記錄層級；依序查 config.json、log.npz，舊訓練預設為 full"""
+    info = LogPolicy().to_dict()
+    config_path = os.path.join(job_dir, 'config.json')
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        if 'log_level' in config:
+            return {name: config.get(name, value) for name, value in info.items()}
+    npz_path = os.path.join(job_dir, LOG_NPZ)
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as data:
+            for name in info:
+                if name in data.files:
+                    info[name] = data[name].item()
+    return info
+
+
+def training_result(algorithm, episode_rewards, episode_log):
+    """整理訓練結果摘要（最終平均獎勵與最終成功率皆與 log 中列印的相同：最後 100 回合）"""
+    success = episode_log.columns['success'][:episode_log.size]
+    return {
+        'algorithm': algorithm,
+        'episodes': len(episode_rewards),
+        'final_avg_reward': float(np.mean(episode_rewards[-100:])) if episode_rewards else 0.0,
+        'success_rate': float(success.mean()) if len(success) else 0.0,
+        'final_success_rate': float(success[-100:].mean()) if len(success) else 0.0,
+        'elapsed': round(time.perf_counter() - episode_log.start, 3),
+    }
+
+
+def save_result(output_dir, result):
+    """將訓練結果摘要寫入 result.json"""
+    with open(os.path.join(output_dir, RESULT_JSON), 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def load_episode_summary(job_dir):
+    """讀取每回合摘要；優先 episodes.npz，其次 episodes.csv，舊訓練沒有時回傳 None"""
+    npz_path = os.path.join(job_dir, EPISODES_NPZ)
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as data:
+            return {name: data[name] for name in EPISODE_DTYPES}
+    csv_path = os.path.join(job_dir, EPISODES_CSV)
+    if not os.path.exists(csv_path):
+        return None
+    df = pd.read_csv(csv_path)
+    return {name: df[name].to_numpy() for name in EPISODE_DTYPES}
+
+
+def replicate_dir(job_dir, replicate):
+    """重複實驗第 replicate 份的輸出目錄"""
+    return job_dir if replicate == 0 else os.path.join(job_dir, REPLICATES_DIR, f'{replicate:02d}')
+
+
+def replicate_dirs(job_dir):
+    """工作的所有重複實驗目錄；沒有重複實驗時只有工作目錄本身"""
+    root = os.path.join(job_dir, REPLICATES_DIR)
+    if not os.path.isdir(root):
+        return [job_dir]
+    return [job_dir] + [os.path.join(root, name) for name in sorted(os.listdir(root))]
+
+
+def replicate_result(algorithm, results):
+    """彙總各份重複實驗的訓練結果（平均與標準差，各份結果附在 runs）"""
+    rewards = np.array([result['final_avg_reward'] for result in results])
+    success = np.array([result['success_rate'] for result in results])
+    final_success = np.array([result.get('final_success_rate', result['success_rate']) for result in results])
+    return {
+        'algorithm': algorithm,
+        'episodes': results[0]['episodes'],
+        'replicates': len(results),
+        'final_avg_reward': float(rewards.mean()),
+        'final_avg_reward_std': float(rewards.std()),
+        'success_rate': float(success.mean()),
+        'success_rate_std': float(success.std()),
+        'final_success_rate': float(final_success.mean()),
+        'final_success_rate_std': float(final_success.std()),
+        'elapsed': max(result['elapsed'] for result in results),
+        'runs': results,
+    }
+
+
+def load_replicate_summaries(job_dir, names):
+    """將各份的每回合摘要疊成 (份數 × 回合數) 的陣列；長度不一時以 NaN 補齊，沒有重複實驗時回傳 None"""
+    dirs = replicate_dirs(job_dir)
+    if len(dirs) < 2:
+        return None
+    summaries = [summary for summary in map(load_episode_summary, dirs) if summary is not None]
+    if not summaries:
+        return None
+    length = max(len(summary['episode']) for summary in summaries)
+    stacked = {}
+    for name in names:
+        array = np.full((len(summaries), length), np.nan)
+        for row, summary in zip(array, summaries):
+            row[:len(summary[name])] = summary[name]
+        stacked[name] = array
+    return stacked
+
+
+def rolling_rate(values, window):
+    """沿回合軸計算移動平均（NaN 不計入），以累積和一次算出所有份"""
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0), axis=1)
+    counts = np.cumsum(valid, axis=1)
+    sums[:, window:] -= sums[:, :-window].copy()
+    counts[:, window:] -= counts[:, :-window].copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid, sums / counts, np.nan)
+
+
+def replicate_curves(job_dir, percentiles=CURVE_PERCENTILES, window=SUCCESS_WINDOW):
+    """重複實驗的彙總曲線：每回合總獎勵與移動成功率跨份的平均與百分位數"""
+    stacked = load_replicate_summaries(job_dir, ['episode', 'total_reward', 'success'])
+    if stacked is None:
+        return None
+    curves = {'replicates': len(stacked['episode']), 'episodes': np.nanmax(stacked['episode'], axis=0).astype(int).tolist(),
+              'success_window': window}
+    for name, values in (('reward', stacked['total_reward']), ('success', rolling_rate(stacked['success'], window))):
+        bands = np.nanpercentile(values, percentiles, axis=0)
+        curves[name] = {'mean': np.nanmean(values, axis=0).tolist(),
+                        **{f'p{q}': band.tolist() for q, band in zip(percentiles, bands)}}
+    return curves
+
+
+def episode_totals(columns):
+    """由依回合排序的逐步欄位計算每回合總獎勵與步數"""
+    episodes = columns['episode']
+    if len(episodes) == 0:
+        return [], []
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(episodes)) + 1))
+    rewards = np.add.reduceat(columns['reward'], starts)
+    steps = np.maximum.reduceat(columns['step'], starts)
+    return rewards.tolist(), steps.tolist()
+
+
+def load_qtable_frame(job_dir):
+    """讀取 Q-Table 為 state/action/value DataFrame；優先使用 q_table.npz"""
+    npz_path = os.path.join(job_dir, QTABLE_NPZ)
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as data:
+            mask, values, cells = data['mask'], data['values'], data['state_cells']
+        states, actions = np.nonzero(mask)
+        labels = np.array([f"{i},{j}" for i, j in cells.tolist()], dtype=object)
+        return pd.DataFrame({
+            'state': labels[states],
+            'action': np.asarray(ACTIONS, dtype=object)[actions],
+            'value': values[states, actions]
+        })
+    csv_path = os.path.join(job_dir, QTABLE_CSV)
+    if not os.path.exists(csv_path):
+        return None
+    return pd.read_csv(csv_path)
+
+
+_policy_cache = OrderedDict()
+
+
+class PolicyIndex:
+    """以 (列, 行, 動作) 稠密陣列表示的 Q-Table 與預先算好的貪婪動作網格
+
+    Q-Table 中沒有的配對為 -inf，沒有任何配對的格子貪婪動作為 -1；
+    平手取編號最小的動作（與 Q-Table 依動作順序逐列取最大值相同）。
+    """
+
+    def __init__(self, values, known):
+        self.values = values
+        self.known = known
+        self.greedy = np.where(known, np.argmax(values, axis=2), -1).astype(np.int8)
+
+    @classmethod
+    def from_arrays(cls, shape, cells, actions, values):
+        rows, cols = (int(size) for size in shape)
+        dense = np.full((rows, cols, len(ACTIONS)), -np.inf)
+        known = np.zeros((rows, cols), dtype=bool)
+        dense[cells[:, 0], cells[:, 1], actions] = np.nan_to_num(values, nan=-np.inf)
+        known[cells[:, 0], cells[:, 1]] = True
+        return cls(dense, known)
+
+    @classmethod
+    def from_npz(cls, path):
+        with np.load(path) as data:
+            mask, values, cells = data['mask'], data['values'], data['state_cells']
+            shape = data['grid_shape'] if 'grid_shape' in data else cells.max(axis=0) + 1
+        states, actions = np.nonzero(mask)
+        return cls.from_arrays(shape, cells[states], actions, values[states, actions])
+
+    @classmethod
+    def from_frame(cls, frame):
+        actions = frame['action'].map({action: i for i, action in enumerate(ACTIONS)})
+        frame = frame[actions.notna()]
+        if frame.empty:
+            return cls(np.full((0, 0, len(ACTIONS)), -np.inf), np.zeros((0, 0), dtype=bool))
+        cells = frame['state'].str.split(',', expand=True).astype(np.int64).to_numpy()
+        return cls.from_arrays(cells.max(axis=0) + 1, cells, actions[actions.notna()].to_numpy(dtype=np.int64),
+                               frame['value'].to_numpy(dtype=np.float64))
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls.from_frame(pd.read_csv(path))
+
+    def greedy_path(self, grid, start, max_steps=PATH_MAX_STEPS):
+        """由起點依貪婪動作前進，遇到未知格、邊界、障礙、目標或重複格子時停止，回傳經過的 (列, 行)"""
+        rows, cols = len(grid), len(grid[0])
+        state = start
+        path = [state]
+        visited = set()
+        for _ in range(max_steps):
+            visited.add(state)
+            i, j = state
+            if not (i < self.known.shape[0] and j < self.known.shape[1] and self.known[i, j]):
+                break
+            di, dj = ACTION_DELTAS[self.greedy[i, j]]
+            ni, nj = i + di, j + dj
+            if not (0 <= ni < rows and 0 <= nj < cols) or grid[ni][nj] == OBSTACLE:
+                break
+            state = (ni, nj)
+            path.append(state)
+            if grid[ni][nj] == GOAL or state in visited:
+                break
+        return path
+
+
+def load_policy_index(job_dir):
+    """讀取工作的 Q-Table 為 PolicyIndex（優先 q_table.npz）；沒有 Q-Table 時回傳 None
+
+    同一行程內依工作目錄快取，來源檔的修改時間或大小改變時重新讀取。
+    """
+    for name, loader in ((QTABLE_NPZ, PolicyIndex.from_npz), (QTABLE_CSV, PolicyIndex.from_csv)):
+        path = os.path.join(job_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        cached = _policy_cache.get(job_dir)
+        if cached is not None and cached[0] == key:
+            _policy_cache.move_to_end(job_dir)
+            return cached[1]
+        index = loader(path)
+        _policy_cache[job_dir] = (key, index)
+        _policy_cache.move_to_end(job_dir)
+        if len(_policy_cache) > POLICY_CACHE_SIZE:
+            _policy_cache.popitem(last=False)
+        return index
+    _policy_cache.pop(job_dir, None)
+    return None
@@ -0,0 +1,93 @@
+import json
+import os
+import numpy as np
+
+from random_streams import EpisodeStreams
+
+CHECKPOINT_NPZ = 'checkpoint.npz'
+CHECKPOINT_EVERY = 1000  # 預設每多少回合寫一次 checkpoint（0 表示不寫）
+CHECKPOINT_VERSION = 1
+
+
+class Checkpointer:
+    """定期將訓練狀態寫入 checkpoint.npz
+
+    只在回合（批次訓練為整批）結束時寫出：此時資格跡已歸零，亂數串流只取決於種子與回合編號，
+    因此保存 Q 值、回合進度、種子與各記錄檔的寫入位置即可從中斷處逐位元相同地續跑。
+    """
+
+    def __init__(self, output_dir, algorithm, every, episodes, q_table, streams, log_writer, episode_log,
+                 episode_rewards, saved=0, early_stop=None, extra=None):
+        self.path = os.path.join(output_dir, CHECKPOINT_NPZ)
+        self.algorithm = algorithm
+        self.every = every
+        self.episodes = episodes
+        self.q_table = q_table
+        self.streams = streams
+        self.log_writer = log_writer
+        self.episode_log = episode_log
+        self.episode_rewards = episode_rewards
+        self.saved = saved
+        self.early_stop = early_stop
+        self.extra = extra  # 演算法額外的狀態（具 state() 方法，回傳要保存的陣列）
+
+    def maybe_save(self, episode):
+        """距離上次 checkpoint 已滿 every 回合時寫出"""
+        if self.every and episode - self.saved >= self.every and episode < self.episodes:
+            self.save(episode)
+
+    def save(self, episode):
+        seed_seq = self.streams.seed_seq
+        meta = {
+            'version': CHECKPOINT_VERSION,
+            'algorithm': self.algorithm,
+            'episode': int(episode),
+            'episodes': self.episodes,
+            'entropy': str(seed_seq.entropy),
+            'spawn_key': list(seed_seq.spawn_key),
+            'log_sinks': self.log_writer.sync(),
+            'episode_log': self.episode_log.state(),
+        }
+        if self.early_stop is not None:
+            meta['early_stop'] = self.early_stop.state()
+        size = self.episode_log.size
+        arrays = {f'summary_{name}': values[:size] for name, values in self.episode_log.columns.items()}
+        if self.extra is not None:
+            arrays.update({f'extra_{name}': values for name, values in self.extra.state().items()})
+        # last_m 保留中、尚未寫出的逐步記錄
+        arrays.update({f'tail_{name}': values for name, values in self.log_writer.held().items()})
+        # 先寫暫存檔再取代，訓練在寫入途中被終止也不會留下損壞的 checkpoint
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, meta=np.str_(json.dumps(meta)), values=self.q_table.values,
+                     episode_rewards=np.asarray(self.episode_rewards, dtype=np.int64), **arrays)
+        os.replace(tmp_path, self.path)
+        self.saved = episode
+
+    def remove(self):
+        """訓練完成後刪除 checkpoint"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def load_checkpoint(output_dir, algorithm):
+    """讀取 checkpoint；不存在時回傳 None"""
+    path = os.path.join(output_dir, CHECKPOINT_NPZ)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        checkpoint = json.loads(data['meta'].item())
+        checkpoint['values'] = data['values']
+        checkpoint['episode_rewards'] = data['episode_rewards'].tolist()
+        checkpoint['summary'] = {name[len('summary_'):]: data[name] for name in data.files if name.startswith('summary_')}
+        checkpoint['extra'] = {name[len('extra_'):]: data[name] for name in data.files if name.startswith('extra_')}
+        checkpoint['log_tail'] = {name[len('tail_'):]: data[name] for name in data.files if name.startswith('tail_')}
+    if checkpoint['algorithm'] != algorithm:
+        raise ValueError(f"checkpoint 屬於 {checkpoint['algorithm']}，無法以 {algorithm} 續跑")
+    return checkpoint
+
+
+def restore_streams(checkpoint, max_steps):
+    """以 checkpoint 中的種子重建亂數串流（未指定種子的訓練也能接續同一串流）"""
+    seed_seq = np.random.SeedSequence(int(checkpoint['entropy']), spawn_key=tuple(checkpoint['spawn_key']))
+    return EpisodeStreams(max_steps=max_steps, seed_seq=seed_seq)
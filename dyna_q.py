@@ -0,0 +1,216 @@
+import heapq
+import argparse
+import numpy as np
+from grid_env import compile_env, DEFAULT_RULE, ACTIONS, KIND_GOAL, is_terminal_kind
+from log_writer import LOG_LEVELS, LOG_EVERY, LOG_LAST
+from early_stop import STOP_PATIENCE
+from checkpoint import CHECKPOINT_EVERY
+from train_session import TrainSession
+from q_learning import load_map, load_rule, validate_map, get_epsilon, MAP_PATH, EPISODES, MAX_STEPS, LEARNING_RATE, DISCOUNT_FACTOR, EPSILON_START, EPSILON_END, EPSILON_DECAY
+
+# Dyna-Q 規劃設定
+PLANNING_STEPS = 10  # 每個真實步驟後的規劃更新次數
+PRIORITY_THRESHOLD = 1e-4  # |TD 誤差| 超過此值才放入優先權佇列
+
+# Q-Table 初始化設定
+OPTIMISTIC_INIT = False  # 是否使用樂觀初始化
+OPTIMISTIC_VALUE = 1.0   # 樂觀初始值
+
+
+class PrioritizedModel:
+    """Dyna-Q 學到的確定性模型與優先權掃描（prioritized sweeping）佇列
+
+    模型記錄每個 (狀態, 動作) 最近一次觀察到的下一狀態與獎勵，並維護每個狀態的前驅配對；
+    佇列依 |TD 誤差| 由大到小取出，同一配對只保留最高的優先權。
+    """
+
+    def __init__(self, n_states, n_actions, threshold=PRIORITY_THRESHOLD):
+        self.n_actions = n_actions
+        self.threshold = threshold
+        self.next_state = [-1] * (n_states * n_actions)  # 以 state * n_actions + action 為索引，-1 表示未觀察過
+        self.reward = [0] * (n_states * n_actions)
+        self.predecessors = [set() for _ in range(n_states)]
+        self._heap = []  # (-優先權, 配對)
+        self._priority = {}  # 佇列中的配對 -> 目前的優先權
+
+    def record(self, key, next_state, reward):
+        """記錄一次真實轉移"""
+        previous = self.next_state[key]
+        if previous != next_state:
+            if previous >= 0:
+                self.predecessors[previous].discard(key)
+            self.predecessors[next_state].add(key)
+            self.next_state[key] = next_state
+        self.reward[key] = reward
+
+    def push(self, key, priority):
+        if priority <= self.threshold or priority <= self._priority.get(key, 0.0):
+            return
+        self._priority[key] = priority
+        heapq.heappush(self._heap, (-priority, key))
+
+    def pop(self):
+        """取出優先權最高的配對；佇列為空時回傳 None"""
+        while self._heap:
+            priority, key = heapq.heappop(self._heap)
+            if self._priority.get(key) == -priority:
+                del self._priority[key]
+                return key
+        return None
+
+    def sweep(self, q_values, n, learning_rate, discount_factor):
+        """以模型做至多 n 次規劃更新，並把受影響的前驅配對依 |TD 誤差| 放入佇列，回傳實際更新次數"""
+        flat_q = q_values.reshape(-1)
+        next_states, rewards, predecessors, push = self.next_state, self.reward, self.predecessors, self.push
+        for done in range(n):
+            key = self.pop()
+            if key is None:
+                return done
+            flat_q[key] += learning_rate * (rewards[key] + discount_factor * q_values[next_states[key]].max() - flat_q[key])
+            state = key // self.n_actions
+            max_q = q_values[state].max()
+            for pred in predecessors[state]:
+                push(pred, abs(rewards[pred] + discount_factor * max_q - flat_q[pred]))
+        return n
+
+    def state(self):
+        """寫入 checkpoint 的模型與佇列（前驅配對可由模型重建）"""
+        keys = np.array(sorted(self._priority), dtype=np.int64)
+        return {
+            'next_state': np.array(self.next_state, dtype=np.int64),
+            'reward': np.array(self.reward, dtype=np.int64),
+            'queue_keys': keys,
+            'queue_priority': np.array([self._priority[key] for key in keys.tolist()], dtype=np.float64),
+        }
+
+    def restore(self, state):
+        self.next_state = state['next_state'].tolist()
+        self.reward = state['reward'].tolist()
+        for key, next_state in enumerate(self.next_state):
+            if next_state >= 0:
+                self.predecessors[next_state].add(key)
+        for key, priority in zip(state['queue_keys'].tolist(), state['queue_priority'].tolist()):
+            self.push(key, priority)
+
+
+def main(map_path, episodes, learning_rate, discount_factor, epsilon_start, output_dir, seed=None, strict_goal_reward_zero=True, rule_id=None, q_dtype='float64', planning_steps=PLANNING_STEPS, priority_threshold=PRIORITY_THRESHOLD, log_level='full', log_every=LOG_EVERY, log_last=LOG_LAST, optimistic=None, rule_data=None, map_grid=None, progress=None, checkpoint_every=CHECKPOINT_EVERY, resume=False, init_q=None, replicate=None, stop_delta_q=None, stop_policy=False, stop_success=None, stop_patience=STOP_PATIENCE, stop_min_episodes=0, profile=False, profile_memory=False, profile_dump=False):
+    """Dyna-Q（優先權掃描）主訓練函數，回傳訓練結果摘要（同時寫入 result.json）
+
+    真實步驟的選擇與更新與 Q-Learning 相同（planning_steps 為 0 時結果完全一致），
+    另外依學到的模型在每步後做 planning_steps 次規劃更新，讓目標的價值更快傳回起點。
+    """
+    if optimistic is None:
+        optimistic = OPTIMISTIC_INIT
+    with TrainSession(
+            'dyna_q', output_dir, episodes, seed=seed, strict_goal_reward_zero=strict_goal_reward_zero, q_dtype=q_dtype,
+            initial_value=OPTIMISTIC_VALUE if optimistic else 0.0, log_level=log_level, log_every=log_every, log_last=log_last,
+            progress=progress, checkpoint_every=checkpoint_every, resume=resume, init_q=init_q, replicate=replicate,
+            stop_delta_q=stop_delta_q, stop_policy=stop_policy, stop_success=stop_success, stop_patience=stop_patience,
+            stop_min_episodes=stop_min_episodes, profile=profile, profile_memory=profile_memory, profile_dump=profile_dump) as session:
+        # 載入規則（行程內呼叫時可直接傳入規則內容）
+        if rule_data is None:
+            rule_data = load_rule(rule_id) if rule_id else dict(DEFAULT_RULE, maxSteps=MAX_STEPS)
+
+        if map_grid is None:
+            map_grid = load_map(map_path)
+
+        env = compile_env(map_grid, rule_data, validate_map)  # 驗證地圖並預先編譯轉移與獎勵表（同地圖重複使用）
+        max_steps = rule_data['maxSteps']
+
+        # checkpoint 續跑（含學到的模型）、Q-Table、訓練記錄、提前停止與 checkpoint（見 train_session）
+        model = PrioritizedModel(env.n_states, len(ACTIONS), priority_threshold)
+        q_table = session.setup(env, extra=model)
+        q_values = q_table.values
+        episodes = session.episodes
+        streams, log_writer, log_policy = session.streams, session.log_writer, session.log_policy
+
+        print(f"開始訓練：{episodes} 回合")
+        print(f"學習率: {learning_rate}, 折扣因子: {discount_factor}")
+        print(f"探索率: {epsilon_start} → {EPSILON_END} (衰減: {EPSILON_DECAY})")
+        print(f"使用規則：{rule_data}")
+        print(f"記錄層級：{log_level}")
+        print(f"規劃更新：每步 {planning_steps} 次（優先權門檻 {priority_threshold}）")
+        env = session.instrument(env, model=model)
+
+        planning_updates = 0
+        for episode in range(session.start_episode, episodes+1):
+            # 每回合開始時重置獎勵格取用狀態
+            consumed = env.new_consumed()
+            state = env.start
+            episode_reward = 0
+            current_epsilon = get_epsilon(episode, episodes)
+            success = False
+            randoms = streams.episode_block(episode).tolist()  # 本回合預抽的亂數
+            log_steps = log_policy.logs_steps(episode)
+            for step in range(1, max_steps+1):
+                # ε-greedy 策略
+                action = q_table.select(state, env.valid_actions[state], current_epsilon, randoms[step - 1])
+
+                next_state, reward, kind = env.step(state, action, step, consumed)
+
+                episode_reward += reward
+
+                # 直接以真實經驗做 Q-Learning 更新，並記錄模型
+                td_error = reward + discount_factor * q_table.max(next_state) - q_values[state, action]
+                q_values[state, action] += learning_rate * td_error
+                key = state * len(ACTIONS) + action
+                model.record(key, next_state, reward)
+
+                # 依 |TD 誤差| 排入佇列，再以模型做規劃更新
+                if planning_steps:
+                    model.push(key, abs(td_error))
+                    planning_updates += model.sweep(q_values, planning_steps, learning_rate, discount_factor)
+
+                done = is_terminal_kind(kind)
+                if log_steps:
+                    log_writer.append(episode, step, state, action, reward, next_state, done, current_epsilon, kind == KIND_GOAL)
+
+                # 目標或陷阱都終止回合
+                if done or step == max_steps:
+                    if kind == KIND_GOAL:
+                        success = True
+                    break
+                state = next_state
+            # 回合收尾（獎勵歸零判斷、每回合摘要），提前停止時結束訓練
+            if session.end_episode(episode, step, action, episode_reward, next_state, done, current_epsilon, success):
+                break
+
+        print(f"規劃更新次數: {planning_updates}")
+        # 輸出 Q-Table、訓練記錄與 result.json
+        return session.finish(planning_updates=planning_updates)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dyna-Q（優先權掃描）強化學習演算法')
+    parser.add_argument('--map', type=str, default=MAP_PATH, help='地圖檔路徑')
+    parser.add_argument('--episodes', type=int, default=EPISODES, help='訓練回合數')
+    parser.add_argument('--learning_rate', type=float, default=LEARNING_RATE, help='學習率')
+    parser.add_argument('--discount_factor', type=float, default=DISCOUNT_FACTOR, help='折扣因子')
+    parser.add_argument('--epsilon', type=float, default=EPSILON_START, help='初始探索率')
+    parser.add_argument('--output', type=str, default='output', help='輸出目錄')
+    parser.add_argument('--seed', type=int, default=None, help='隨機種子（用於可重現性）')
+    parser.add_argument('--optimistic', action='store_true', help='使用樂觀初始化')
+    parser.add_argument('--strict_goal_reward_zero', action='store_true', default=True, help='沒到終點時分數歸零（預設開啟）')
+    parser.add_argument('--rule', type=str, default=None, help='規則ID')
+    parser.add_argument('--planning_steps', type=int, default=PLANNING_STEPS, help='每個真實步驟後的規劃更新次數（0 即為 Q-Learning）')
+    parser.add_argument('--priority_threshold', type=float, default=PRIORITY_THRESHOLD, help='|TD 誤差| 超過此值才放入優先權佇列')
+    parser.add_argument('--log_level', type=str, default='full', choices=LOG_LEVELS, help='訓練記錄粒度：逐步、每回合摘要、每第 k 回合、最後 m 回合')
+    parser.add_argument('--log_every', type=int, default=LOG_EVERY, help='every_k 層級的 k')
+    parser.add_argument('--log_last', type=int, default=LOG_LAST, help='last_m 層級的 m')
+    parser.add_argument('--checkpoint_every', type=int, default=CHECKPOINT_EVERY, help='每多少回合寫一次 checkpoint（0 表示不寫）')
+    parser.add_argument('--resume', action='store_true', help='從輸出目錄中的 checkpoint 續跑')
+    parser.add_argument('--init_q', type=str, default=None, help='以此訓練目錄的 Q-Table 暖啟動')
+    parser.add_argument('--replicate', type=int, default=None, help='重複實驗編號（使用種子衍生的第 n 個獨立亂數串流）')
+    parser.add_argument('--stop_delta_q', type=float, default=None, help='提前停止：連續 stop_patience 回合 max|ΔQ| 低於此值')
+    parser.add_argument('--stop_policy', action='store_true', help='提前停止：貪婪策略連續 stop_patience 回合未改變')
+    parser.add_argument('--stop_success', type=float, default=None, help='提前停止：最近兩個 stop_patience 視窗的成功率相差不超過此值')
+    parser.add_argument('--stop_patience', type=int, default=STOP_PATIENCE, help='提前停止條件需持續成立的回合數')
+    parser.add_argument('--stop_min_episodes', type=int, default=0, help='至少訓練多少回合才允許提前停止')
+    parser.add_argument('--profile', action='store_true', help='記錄各階段累計時間與行程 RSS 峰值至 profile.json')
+    parser.add_argument('--profile_memory', action='store_true', help='搭配 --profile 以 tracemalloc 量測記憶體峰值（計時會明顯變慢）')
+    parser.add_argument('--profile_dump', action='store_true', help='另存 cProfile 結果至 profile.prof')
+    parser.add_argument('--q_dtype', type=str, default='float64', choices=['float64', 'float32'], help='Q-Table 數值型別')
+
+    args = parser.parse_args()
+
+    main(args.map, args.episodes, args.learning_rate, args.discount_factor, args.epsilon, args.output, args.seed, args.strict_goal_reward_zero, args.rule, q_dtype=args.q_dtype, planning_steps=args.planning_steps, priority_threshold=args.priority_threshold, log_level=args.log_level, log_every=args.log_every, log_last=args.log_last, optimistic=args.optimistic, checkpoint_every=args.checkpoint_every, resume=args.resume, init_q=args.init_q, replicate=args.replicate, stop_delta_q=args.stop_delta_q, stop_policy=args.stop_policy, stop_success=args.stop_success, stop_patience=args.stop_patience, stop_min_episodes=args.stop_min_episodes, profile=args.profile, profile_memory=args.profile_memory, profile_dump=args.profile_dump)
@@ -0,0 +1,102 @@
+import numpy as np
+
+STOP_PATIENCE = 100  # 條件需持續成立的回合數（成功率比較的視窗大小）
+
+STOP_REASONS = {
+    'delta_q': 'Q 值變化量低於門檻',
+    'policy_stable': '貪婪策略未再改變',
+    'success_plateau': '成功率已持平',
+}
+
+
+def stops_early(delta_q=None, policy=False, success_plateau=None):
+    """是否指定了任何提前停止條件（訓練可能在總回合數之前結束）"""
+    return delta_q is not None or policy or success_plateau is not None
+
+
+class EarlyStopper:
+    """提前停止判斷，於每回合（批次訓練為每批）結束時呼叫 update
+
+    任一條件成立即停止：
+    - delta_q：連續 patience 回合內，每回合 Q 值的最大變化量 max|ΔQ| 都低於 delta_q
+    - policy：貪婪策略（每個狀態 Q 值最大的動作）連續 patience 回合未改變
+    - success_plateau：最近 patience 回合的成功率大於 0，且與前 patience 回合相差不超過門檻
+    每回合只找出與上次快照不同的 Q 值，變化量與貪婪動作都只在這些位置上重算。
+    """
+
+    def __init__(self, q_table, episode_log, delta_q=None, policy=False, success_plateau=None,
+                 patience=STOP_PATIENCE, min_episodes=0, start_episode=1):
+        self.q_table = q_table
+        self.episode_log = episode_log
+        self.delta_q = delta_q
+        self.policy = policy
+        self.success_plateau = success_plateau
+        self.patience = max(1, patience)
+        self.min_episodes = min_episodes
+        self.enabled = stops_early(delta_q, policy, success_plateau)
+        # 最近一次 Q 值變化量超過門檻、貪婪策略改變的回合
+        self.q_changed = start_episode - 1
+        self.policy_changed = start_episode - 1
+        self.episode = None
+        self.reason = None
+        tracks_q = delta_q is not None or policy
+        self._values = q_table.values.reshape(-1).copy() if tracks_q else None  # 上次的 Q 值快照
+        self._greedy = q_table.values.argmax(axis=1) if policy else None
+
+    def update(self, episode):
+        """回合結束時更新各條件；應停止時記錄並回傳原因，否則回傳 None"""
+        if not self.enabled:
+            return None
+        if self._values is not None:
+            self._track(episode)
+        if episode < self.min_episodes:
+            return None
+        if self.delta_q is not None and episode - self.q_changed >= self.patience:
+            self.reason = 'delta_q'
+        elif self.policy and episode - self.policy_changed >= self.patience:
+            self.reason = 'policy_stable'
+        elif self.success_plateau is not None and self._plateaued():
+            self.reason = 'success_plateau'
+        if self.reason is not None:
+            self.episode = episode
+        return self.reason
+
+    def _track(self, episode):
+        values = self.q_table.values
+        flat = values.reshape(-1)
+        changed = np.flatnonzero(flat != self._values)
+        if not changed.size:
+            return
+        if self.delta_q is not None and np.abs(flat[changed] - self._values[changed]).max() >= self.delta_q:
+            self.q_changed = episode
+        if self.policy:
+            rows = np.unique(changed // values.shape[1])
+            greedy = values[rows].argmax(axis=1)
+            if (greedy != self._greedy[rows]).any():
+                self.policy_changed = episode
+                self._greedy[rows] = greedy
+        self._values[changed] = flat[changed]
+
+    def _plateaued(self):
+        size, window = self.episode_log.size, self.patience
+        if size < 2 * window:
+            return False
+        success = self.episode_log.columns['success']
+        recent = success[size - window:size].mean()
+        previous = success[size - 2 * window:size - window].mean()
+        return recent > 0 and abs(recent - previous) <= self.success_plateau
+
+    def state(self):
+        """寫入 checkpoint 的狀態（Q 值快照與貪婪策略可由 checkpoint 的 Q 值重建）"""
+        return {'q_changed': self.q_changed, 'policy_changed': self.policy_changed}
+
+    def restore(self, state):
+        if state:
+            self.q_changed = state['q_changed']
+            self.policy_changed = state['policy_changed']
+
+    def summary(self):
+        """提前停止時寫入訓練結果的欄位"""
+        if self.reason is None:
+            return {}
+        return {'stop_episode': self.episode, 'stop_reason': self.reason}
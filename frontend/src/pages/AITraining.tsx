@@ -21,6 +21,7 @@ const AITraining: React.FC = () => {
   const [lambdaParam, setLambdaParam] = useState<number | null>(null);  // 新增 SARSA(λ) 的 λ 參數
   const [jobId, setJobId] = useState<string | null>(null);
   const [trainStatus, setTrainStatus] = useState<string | null>(null);
+  const [progress, setProgress] = useState<any>(null);  // 即時訓練進度（SSE）
   const [trainError, setTrainError] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
   const [showResult, setShowResult] = useState(false);
@@ -51,6 +52,7 @@ const AITraining: React.FC = () => {
   const handleTrain = async () => {
     setLoading(true);
     setTrainStatus(null);
+    setProgress(null);
     setTrainError(null);
     setShowResult(false);
     setResult(null);
@@ -84,28 +86,63 @@ const AITraining: React.FC = () => {
       const res = await axios.post(`${API_BASE}/train/train`, requestData);
       setJobId(res.data.job_id);
       setTrainStatus(res.data.status);
-      pollStatus(res.data.job_id);
+      watchEvents(res.data.job_id);
     } catch (e: any) {
       setTrainError(e?.response?.data?.detail || '訓練啟動失敗');
       setLoading(false);
     }
   };
 
+  // 處理訓練狀態變化，回傳是否已結束
+  const handleStatus = (jobId: string, status: string) => {
+    setTrainStatus(status);
+    if (status === 'completed') {
+      setLoading(false);
+      setShowResult(true);
+      fetchResult(jobId);
+      return true;
+    } else if (status === 'failed') {
+      setLoading(false);
+      setTrainError('訓練失敗');
+      return true;
+    } else if (status === 'cancelled') {
+      setLoading(false);
+      setTrainError('訓練已取消');
+      return true;
+    }
+    return false;
+  };
+
+  // 以 SSE 接收訓練狀態與進度；瀏覽器不支援或連線失敗時改用輪詢
+  const watchEvents = (jobId: string) => {
+    if (typeof EventSource === 'undefined') {
+      pollStatus(jobId);
+      return;
+    }
+    const source = new EventSource(`${API_BASE}/train/train/${jobId}/events`);
+    let finished = false;
+    source.addEventListener('status', (e: MessageEvent) => {
+      if (handleStatus(jobId, JSON.parse(e.data).status)) {
+        finished = true;
+        source.close();
+      }
+    });
+    source.addEventListener('progress', (e: MessageEvent) => setProgress(JSON.parse(e.data)));
+    source.onerror = () => {
+      source.close();
+      if (!finished) {
+        pollStatus(jobId);
+      }
+    };
+  };
+
   // 輪詢訓練狀態
   const pollStatus = (jobId: string) => {
     let interval: NodeJS.Timeout;
     const check = async () => {
       try {
         const res = await axios.get(`${API_BASE}/train/train/${jobId}/status`);
-        setTrainStatus(res.data.status);
-        if (res.data.status === 'completed') {
-          setLoading(false);
-          setShowResult(true);
-          fetchResult(jobId);
-          clearInterval(interval);
-        } else if (res.data.status === 'failed') {
-          setLoading(false);
-          setTrainError('訓練失敗');
+        if (handleStatus(jobId, res.data.status)) {
           clearInterval(interval);
         }
       } catch (e) {
@@ -160,6 +197,7 @@ const AITraining: React.FC = () => {
               <Select value={algorithm} label="演算法" onChange={e => setAlgorithm(e.target.value)}>
                 <MenuItem value="q_learning">Q-Learning</MenuItem>
                 <MenuItem value="sarsa">SARSA</MenuItem>
+                <MenuItem value="dyna_q">Dyna-Q</MenuItem>
               </Select>
             </FormControl>
           </Box>
@@ -203,6 +241,12 @@ const AITraining: React.FC = () => {
           </Button>
           {trainError && <Alert severity="error" sx={{ mt: 2 }}>{trainError}</Alert>}
           {loading && <Box sx={{ mt: 2, display: 'flex', alignItems: 'center', gap: 1 }}><CircularProgress size={24} /> 訓練進行中，請稍候...</Box>}
+          {loading && progress && (
+            <Typography variant="body2" sx={{ mt: 1, color: '#555' }}>
+              回合 {progress.episode}/{progress.episodes}，平均獎勵 {progress.reward.toFixed(2)}，平均步數 {progress.steps.toFixed(1)}，
+              成功率 {(progress.success_rate * 100).toFixed(1)}%，探索率 {progress.epsilon.toFixed(3)}
+            </Typography>
+          )}
           {trainStatus && !loading && <Alert severity={trainStatus === 'completed' ? 'success' : 'info'} sx={{ mt: 2 }}>訓練狀態：{trainStatus}</Alert>}
           {/* 參數說明區塊 */}
           <Box sx={{ mt: 3, p: 2, background: '#fffbe7', borderRadius: 2 }}>
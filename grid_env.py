@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+
+# 動作與位移（索引即動作編號）
+ACTIONS = ['up', 'down', 'left', 'right']
+ACTION_DELTAS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+# 地圖元素標記
+START = 'S'
+GOAL = 'G'
+REWARD = 'R'
+TRAP = 'T'
+OBSTACLE = '1'
+EMPTY = '0'
+
+# 格子種類代碼（用於獎勵表索引）
+KIND_EMPTY = 0
+KIND_REWARD = 1
+KIND_GOAL = 2
+KIND_TRAP = 3
+CELL_KINDS = {REWARD: KIND_REWARD, GOAL: KIND_GOAL, TRAP: KIND_TRAP}
+
+# 未指定規則時的預設規則
+DEFAULT_RULE = {
+    'goalReward': 100,
+    'bonusReward': 10,
+    'trapPenalty': -50,
+    'stepPenalty': -1,
+    'wallPenalty': -1,
+    'stepDecay': 1.0,
+    'maxSteps': 100
+}
+
+RULES_DIR = 'rules'
+
+ENV_CACHE_SIZE = 32  # 每個行程保留的已編譯環境數
+_env_cache = OrderedDict()
+
+
+def get_reward(cell, rule_data):
+    """獲取獎勵值（使用規則設定）"""
+    if cell == GOAL:
+        return rule_data['goalReward']
+    elif cell == REWARD:
+        return rule_data['bonusReward']
+    elif cell == TRAP:
+        return 0  # 陷阱不給予懲罰，只用於結束回合
+    else:
+        return rule_data['stepPenalty']
+
+
+def reachable_mask(passable, start, expandable=None):
+    """向量化 BFS：回傳從起點可到達的格子遮罩
+
+    passable 為可進入的格子，expandable 為可繼續往外走的格子（預設同 passable，
+    終止格可被進入但不會再擴展）。以扁平索引的 frontier 逐層展開；
+    同層重複的鄰格以「最後寫入者」標記去除，不需排序。
+    """
+    rows, cols = passable.shape
+    if expandable is None:
+        expandable = passable
+    # 外圍補一圈不可通行的邊界，鄰格即為扁平索引加減固定位移
+    width = cols + 2
+    flat_pass = np.zeros((rows + 2, width), dtype=bool)
+    flat_pass[1:-1, 1:-1] = passable
+    flat_pass = flat_pass.ravel()
+    flat_expand = np.zeros((rows + 2, width), dtype=bool)
+    flat_expand[1:-1, 1:-1] = expandable
+    flat_expand = flat_expand.ravel()
+    offsets = np.array([-width, width, -1, 1])
+
+    visited = np.zeros(flat_pass.size, dtype=bool)
+    owner = np.empty(flat_pass.size, dtype=np.int64)
+    frontier = np.array([(start[0] + 1) * width + start[1] + 1])
+    visited[frontier] = True
+    while frontier.size:
+        frontier = frontier[flat_expand[frontier]]
+        neighbors = (frontier[:, None] + offsets).ravel()
+        neighbors = neighbors[flat_pass[neighbors] & ~visited[neighbors]]
+        index = np.arange(neighbors.size)
+        owner[neighbors] = index
+        neighbors = neighbors[owner[neighbors] == index]
+        visited[neighbors] = True
+        frontier = neighbors
+    return visited.reshape(rows + 2, width)[1:-1, 1:-1]
+
+
+class GridEnv:
+    """編譯後的網格環境
+
+    每張地圖與規則只建構一次：從起點可到達的格子以整數狀態編號（列優先順序），
+    轉移、獎勵與終止資訊都預先算成陣列，訓練迴圈只需做索引。
+    """
+
+    def __init__(self, map_grid, rule_data):
+        grid = np.asarray(map_grid)
+        self.rows, self.cols = grid.shape
+        self.max_steps = rule_data['maxSteps']
+
+        starts = np.argwhere(grid == START)
+        if len(starts) == 0:
+            raise ValueError('No start point found')
+        start = tuple(starts[0])
+
+        # 只為可到達的格子編號（終止格可進入但不會穿越）
+        passable = grid != OBSTACLE
+        terminal_cells = (grid == GOAL) | (grid == TRAP)
+        reachable = reachable_mask(passable, start, passable & ~terminal_cells)
+        self.cell_state = np.full((self.rows, self.cols), -1, dtype=np.int32)
+        self.state_cells = np.argwhere(reachable).astype(np.int32)
+        self.n_states = len(self.state_cells)
+        self.cell_state[reachable] = np.arange(self.n_states, dtype=np.int32)
+        self.state_labels = [f"{i},{j}" for i, j in self.state_cells.tolist()]
+        self.start = int(self.cell_state[start])
+
+        # 轉移表：撞牆或障礙物時停在原地
+        deltas = np.array(ACTION_DELTAS, dtype=np.int32)
+        ni = self.state_cells[:, :1] + deltas[:, 0]
+        nj = self.state_cells[:, 1:] + deltas[:, 1]
+        inside = (ni >= 0) & (ni < self.rows) & (nj >= 0) & (nj < self.cols)
+        target = self.cell_state[np.clip(ni, 0, self.rows - 1), np.clip(nj, 0, self.cols - 1)]
+        self.valid_mask = inside & (target >= 0)
+        self.next_state = np.where(self.valid_mask, target,
+                                   np.arange(self.n_states, dtype=np.int32)[:, None]).astype(np.int32)
+        self.valid_actions = [np.flatnonzero(mask).tolist() for mask in self.valid_mask]
+
+        # 每格種類、終止旗標與獎勵格編號
+        state_chars = grid[self.state_cells[:, 0], self.state_cells[:, 1]]
+        self.kind = np.full(self.n_states, KIND_EMPTY, dtype=np.int8)
+        for char, kind in CELL_KINDS.items():
+            self.kind[state_chars == char] = kind
+        self.terminal = (self.kind == KIND_GOAL) | (self.kind == KIND_TRAP)
+        self.bonus_id = np.full(self.n_states, -1, dtype=np.int32)
+        bonus_states = np.flatnonzero(self.kind == KIND_REWARD)
+        self.bonus_id[bonus_states] = np.arange(len(bonus_states), dtype=np.int32)
+        self.n_bonuses = len(bonus_states)
+
+        # 步數衰減表與（種類 × 步數）的已四捨五入獎勵表
+        self.step_decay = np.array([rule_data['stepDecay'] ** step for step in range(self.max_steps + 1)])
+        base_rewards = [get_reward(EMPTY, rule_data), get_reward(REWARD, rule_data),
+                        get_reward(GOAL, rule_data), get_reward(TRAP, rule_data)]
+        self.reward_table = np.array(
+            [[round(base * decay) for decay in self.step_decay.tolist()] for base in base_rewards],
+            dtype=np.int64)
+
+        # 供逐步迴圈使用的 Python 串列版本（純量索引比 NumPy 快）
+        self._next = self.next_state.tolist()
+        self._kind = self.kind.tolist()
+        self._bonus = self.bonus_id.tolist()
+        self._rewards = self.reward_table.tolist()
+
+    def new_consumed(self):
+        """建立每回合的獎勵格取用旗標（取代整張地圖的 deepcopy）"""
+        return [False] * self.n_bonuses
+
+    def step(self, state, action, step, consumed):
+        """執行動作，回傳 (下一狀態, 衰減後獎勵, 下一格種類)"""
+        next_state = self._next[state][action]
+        kind = self._kind[next_state]
+        if kind == KIND_REWARD:
+            bonus = self._bonus[next_state]
+            if consumed[bonus]:
+                kind = KIND_EMPTY  # 已取得的獎勵格視為空格
+            else:
+                consumed[bonus] = True
+        return next_state, self._rewards[kind][step], kind
+
+
+def is_terminal_kind(kind):
+    """判斷格子種類是否為終止狀態（目標或陷阱）"""
+    return kind == KIND_GOAL or kind == KIND_TRAP
+
+
+
+def load_env_rule(rule_id=None):
+    """讀取 rules/{rule_id}.json 中影響環境的欄位（缺少的欄位與未指定規則時使用 DEFAULT_RULE）
+
+    只保留環境欄位，讓只差在學習參數的規則共用已編譯的地圖；規則不存在時拋出 FileNotFoundError。
+    """
+    rule = dict(DEFAULT_RULE)
+    if rule_id:
+        with open(os.path.join(RULES_DIR, f'{rule_id}.json'), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rule.update((key, data[key]) for key in DEFAULT_RULE if key in data)
+    return rule
+
+
+def map_key(map_grid, rule_data):
+    """地圖與規則內容的雜湊，作為已編譯環境的快取鍵（串列或 NumPy 網格皆可）"""
+    grid = np.asarray(map_grid)
+    digest = hashlib.sha1(json.dumps([grid.shape, rule_data], sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    digest.update(grid.astype('<U1').tobytes())
+    return digest.hexdigest()
+
+
+def compile_env(map_grid, rule_data, validate=None):
+    """取得編譯後的 GridEnv；同一行程內相同地圖與規則只驗證、編譯一次
+
+    GridEnv 建構後不再修改，可安全地在多次訓練間共用。
+    """
+    key = map_key(map_grid, rule_data)
+    env = _env_cache.get(key)
+    if env is not None:
+        _env_cache.move_to_end(key)
+        return env
+    if validate is not None:
+        validate(map_grid)
+    env = GridEnv(map_grid, rule_data)
+    _env_cache[key] = env
+    if len(_env_cache) > ENV_CACHE_SIZE:
+        _env_cache.popitem(last=False)
+    return env 
\ No newline at end of file
@@ -0,0 +1,271 @@
+import numpy as np
+
+from grid_env import ACTIONS, KIND_EMPTY, KIND_REWARD, KIND_GOAL, KIND_TRAP
+from log_writer import LogPolicy, STEP_COLUMNS
+from traces import TRACE_CUTOFF, PRUNE_EVERY
+
+try:
+    import numba
+except ImportError:  # 未安裝 numba 時退回 NumPy 引擎
+    numba = None
+
+ENGINES = ['numpy', 'jit']
+HAS_NUMBA = numba is not None
+JIT_CHUNK = 256  # 每次呼叫編譯核心執行的回合數
+MAX_CHUNK_STEPS = 1 << 20  # 每批逐步記錄緩衝區的列數上限
+
+
+def _jit(func):
+    return numba.njit(cache=True, nogil=True)(func) if HAS_NUMBA else func
+
+
+def resolve_engine(engine):
+    """檢查引擎名稱；要求 jit 但未安裝 numba 時改用 numpy"""
+    if engine not in ENGINES:
+        raise ValueError(f'不支援的訓練引擎: {engine}')
+    if engine == 'jit' and not HAS_NUMBA:
+        print("未安裝 numba，改用 NumPy 引擎（可執行 pip install -r requirements-jit.txt 安裝）")
+        return 'numpy'
+    return engine
+
+
+@_jit
+def _greedy(row, u):
+    # 與 QTable.greedy 相同：平手時以 u 在最大值中挑選
+    best = row[0]
+    for a in range(1, row.shape[0]):
+        if row[a] > best:
+            best = row[a]
+    count = 0
+    for a in range(row.shape[0]):
+        if row[a] == best:
+            count += 1
+    pick = int(u * count)
+    for a in range(row.shape[0]):
+        if row[a] == best:
+            if pick == 0:
+                return a
+            pick -= 1
+    return 0
+
+
+@_jit
+def _select(q, valid, n_valid, state, epsilon, u_explore, u_pick):
+    # 與 QTable.select 相同的 ε-greedy
+    if u_explore < epsilon:
+        return valid[state, int(u_pick * n_valid[state])]
+    return _greedy(q[state], u_pick)
+
+
+@_jit
+def _step(next_state, kinds, bonus_id, reward_table, consumed, state, action, step):
+    # 與 GridEnv.step 相同
+    nxt = next_state[state, action]
+    kind = kinds[nxt]
+    if kind == KIND_REWARD:
+        bonus = bonus_id[nxt]
+        if consumed[bonus]:
+            kind = KIND_EMPTY
+        else:
+            consumed[bonus] = True
+    return nxt, reward_table[kind, step], kind
+
+
+@_jit
+def _q_learning_chunk(q, next_state, kinds, bonus_id, reward_table, valid, n_valid, start, n_bonuses,
+                      first, randoms, epsilons, learning_rate, discount_factor, strict, out, log):
+    """連續執行一批 Q-Learning 回合，回傳寫入 log 緩衝區的列數"""
+    ep_total, ep_reward, ep_steps, ep_success, ep_terminal = out
+    log_episode, log_step, log_state, log_action, log_reward, log_next, log_done, log_epsilon, log_success = log
+    max_steps = randoms.shape[1] - 1
+    consumed = np.zeros(n_bonuses, dtype=np.bool_)
+    rows = 0
+    for i in range(randoms.shape[0]):
+        consumed[:] = False
+        state = start
+        epsilon = epsilons[i]
+        total = 0
+        steps = 0
+        nxt = start
+        kind = -1
+        for step in range(1, max_steps + 1):
+            action = _select(q, valid, n_valid, state, epsilon, randoms[i, step - 1, 0], randoms[i, step - 1, 1])
+            nxt, reward, kind = _step(next_state, kinds, bonus_id, reward_table, consumed, state, action, step)
+            total += reward
+            steps = step
+            row = q[nxt]
+            max_next_q = row[0]
+            for a in range(1, row.shape[0]):
+                if row[a] > max_next_q:
+                    max_next_q = row[a]
+            q[state, action] += learning_rate * (reward + discount_factor * max_next_q - q[state, action])
+            done = kind == KIND_GOAL or kind == KIND_TRAP
+            log_episode[rows] = first + i
+            log_step[rows] = step
+            log_state[rows] = state
+            log_action[rows] = action
+            log_reward[rows] = reward
+            log_next[rows] = nxt
+            log_done[rows] = done
+            log_epsilon[rows] = epsilon
+            log_success[rows] = kind == KIND_GOAL
+            rows += 1
+            if done:
+                break
+            state = nxt
+        ep_total[i] = total
+        ep_reward[i] = 0 if strict and kind != KIND_GOAL else total
+        ep_steps[i] = steps
+        ep_success[i] = kind == KIND_GOAL
+        ep_terminal[i] = nxt
+    return rows
+
+
+@_jit
+def _sarsa_chunk(q, flat_q, next_state, kinds, bonus_id, reward_table, valid, n_valid, start, n_bonuses,
+                 first, randoms, epsilons, learning_rate, discount_factor, decay, replacing, cutoff, strict, out, log):
+    """連續執行一批 SARSA(λ) 回合（資格跡與 SparseTraces 相同），回傳寫入 log 緩衝區的列數"""
+    ep_total, ep_reward, ep_steps, ep_success, ep_terminal = out
+    log_episode, log_step, log_state, log_action, log_reward, log_next, log_done, log_epsilon, log_success = log
+    max_steps = randoms.shape[1] - 1
+    n_actions = q.shape[1]
+    consumed = np.zeros(n_bonuses, dtype=np.bool_)
+    trace_keys = np.empty(max_steps, dtype=np.int64)
+    trace_values = np.empty(max_steps)
+    rows = 0
+    for i in range(randoms.shape[0]):
+        consumed[:] = False
+        active = 0
+        state = start
+        epsilon = epsilons[i]
+        total = 0
+        steps = 0
+        nxt = start
+        kind = -1
+        action = _select(q, valid, n_valid, state, epsilon, randoms[i, 0, 0], randoms[i, 0, 1])
+        next_action = action
+        for step in range(1, max_steps + 1):
+            nxt, reward, kind = _step(next_state, kinds, bonus_id, reward_table, consumed, state, action, step)
+            total += reward
+            steps = step
+            if n_valid[nxt] > 0:
+                next_action = _select(q, valid, n_valid, nxt, epsilon, randoms[i, step, 0], randoms[i, step, 1])
+                next_q = q[nxt, next_action]
+            else:
+                next_action = -1
+                next_q = 0.0
+            td_error = reward + discount_factor * next_q - q[state, action]
+
+            # 記錄目前的 (狀態, 動作)，再依資格跡更新並衰減、剪枝
+            key = state * n_actions + action
+            hit = -1
+            for j in range(active):
+                if trace_keys[j] == key:
+                    hit = j
+                    break
+            if hit >= 0:
+                trace_values[hit] = 1.0 if replacing else trace_values[hit] + 1.0
+            else:
+                trace_keys[active] = key
+                trace_values[active] = 1.0
+                active += 1
+            step_size = learning_rate * td_error
+            prune = step % PRUNE_EVERY == 0
+            kept = 0
+            for j in range(active):
+                flat_q[trace_keys[j]] += step_size * trace_values[j]
+                value = trace_values[j] * decay
+                if not prune or value > cutoff:
+                    trace_keys[kept] = trace_keys[j]
+                    trace_values[kept] = value
+                    kept += 1
+            active = kept
+
+            done = kind == KIND_GOAL or kind == KIND_TRAP
+            log_episode[rows] = first + i
+            log_step[rows] = step
+            log_state[rows] = state
+            log_action[rows] = action
+            log_reward[rows] = reward
+            log_next[rows] = nxt
+            log_done[rows] = done
+            log_epsilon[rows] = epsilon
+            log_success[rows] = kind == KIND_GOAL
+            rows += 1
+            if done:
+                break
+            state = nxt
+            action = next_action
+        ep_total[i] = total
+        ep_reward[i] = 0 if strict and kind != KIND_GOAL else total
+        ep_steps[i] = steps
+        ep_success[i] = kind == KIND_GOAL
+        ep_terminal[i] = nxt
+    return rows
+
+
+def train_jit(env, q_table, streams, log_writer, episodes, learning_rate, discount_factor, get_epsilon,
+              strict_goal_reward_zero=True, lambda_value=None, trace_mode='accumulating', trace_cutoff=TRACE_CUTOFF,
+              log_policy=None, episode_log=None, start_episode=1, episode_rewards=None, on_batch_end=None):
+    """以編譯後的核心逐回合訓練（lambda_value 為 None 時做 Q-Learning，否則做 SARSA(λ)）
+
+    每批 JIT_CHUNK 回合呼叫一次核心：亂數與探索率先在 Python 端備妥，核心內完成選擇動作、
+    移動、獎勵、TD 與資格跡更新，並把逐步記錄寫入緩衝區。每回合的亂數與逐回合訓練相同，
+    結果在浮點誤差內與 NumPy 引擎一致。記錄、摘要與 on_batch_end 的處理方式同 train_vectorized，
+    因此 checkpoint 與提前停止以批為單位判斷。
+    """
+    sarsa = lambda_value is not None
+    if log_policy is None:
+        log_policy = LogPolicy(episodes=episodes)
+    max_steps = env.max_steps
+    q_values = q_table.values
+    flat_q = q_values.reshape(-1)
+    valid = np.zeros((env.n_states, len(ACTIONS)), dtype=np.int64)
+    n_valid = env.valid_mask.sum(axis=1).astype(np.int64)
+    for state, actions in enumerate(env.valid_actions):
+        valid[state, :len(actions)] = actions
+    tables = (env.next_state.astype(np.int64), env.kind.astype(np.int64), env.bonus_id.astype(np.int64),
+              env.reward_table, valid, n_valid, env.start, env.n_bonuses)
+    chunk = max(1, min(JIT_CHUNK, MAX_CHUNK_STEPS // max_steps))
+    log = tuple(np.zeros(chunk * max_steps, dtype=dtype) for _, dtype in STEP_COLUMNS)
+    out = (np.zeros(chunk, dtype=np.int64), np.zeros(chunk, dtype=np.int64), np.zeros(chunk, dtype=np.int64),
+           np.zeros(chunk, dtype=np.bool_), np.zeros(chunk, dtype=np.int64))
+
+    if episode_rewards is None:
+        episode_rewards = []
+    for first in range(start_episode, episodes + 1, chunk):
+        n = min(chunk, episodes - first + 1)
+        episode_ids = np.arange(first, first + n)
+        epsilon = np.array([get_epsilon(episode, episodes) for episode in range(first, first + n)])
+        randoms = streams.episode_blocks(episode_ids)  # (回合數, max_steps + 1, 2)
+        chunk_out = tuple(values[:n] for values in out)
+        if sarsa:
+            rows = _sarsa_chunk(q_values, flat_q, *tables, first, randoms, epsilon, learning_rate, discount_factor,
+                                lambda_value * discount_factor, trace_mode == 'replacing', trace_cutoff,
+                                strict_goal_reward_zero, chunk_out, log)
+        else:
+            rows = _q_learning_chunk(q_values, *tables, first, randoms, epsilon, learning_rate, discount_factor,
+                                     strict_goal_reward_zero, chunk_out, log)
+
+        columns = {name: values[:rows] for (name, _), values in zip(STEP_COLUMNS, log)}
+        log_writer.append_columns(log_policy.select(columns))
+        totals, rewards, steps, success, terminal = chunk_out
+        if episode_log is not None:
+            episode_log.append_columns({
+                'episode': episode_ids,
+                'total_reward': totals,
+                'reward': rewards,
+                'steps': steps,
+                'success': success,
+                'terminal_state': terminal,
+                'epsilon': epsilon,
+            })
+        episode_rewards.extend(rewards.tolist())
+        for episode in episode_ids:
+            if episode % 50 == 0:
+                avg_reward = np.mean(episode_rewards[episode - 50:episode])
+                print(f"回合 {episode}/{episodes}, 平均獎勵: {avg_reward:.2f}, 探索率: {epsilon[episode - first]:.3f}")
+        if on_batch_end is not None and on_batch_end(int(episode_ids[-1])):
+            break
+
+    return episode_rewards
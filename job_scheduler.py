@@ -0,0 +1,232 @@
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from datetime import datetime
+
+from artifacts import replicate_result
+from trainer_pool import get_pool, TrainingCancelled
+
+# 訓練工作狀態
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+EVENT_BUFFER = 1000  # 每個工作保留的最近事件數
+FINISHED_CHANNELS = 32  # 已結束工作保留事件緩衝的數量（供稍晚連上的客戶端讀取）
+
+
+def write_status(job_dir, status, **extra):
+    """寫入 status.json（先寫暫存檔再取代，輪詢時不會讀到寫一半的檔案）"""
+    data = {'status': status, 'updated_at': datetime.now().isoformat(), **extra}
+    path = os.path.join(job_dir, 'status.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def mark_interrupted(jobs_dir):
+    """伺服器重新啟動時，將上次未完成的工作標記為失敗"""
+    if not os.path.isdir(jobs_dir):
+        return
+    for job_id in os.listdir(jobs_dir):
+        job_dir = os.path.join(jobs_dir, job_id)
+        status_path = os.path.join(job_dir, 'status.json')
+        if not os.path.exists(status_path):
+            continue
+        try:
+            with open(status_path, 'r', encoding='utf-8') as f:
+                status = json.load(f).get('status')
+        except (OSError, ValueError):
+            continue
+        if status in (QUEUED, RUNNING):
+            write_status(job_dir, FAILED, error='伺服器重新啟動，訓練中斷')
+
+
+class EventChannel:
+    """單一工作的事件環狀緩衝；事件以遞增序號標記，客戶端依最後收到的序號續讀"""
+
+    def __init__(self, maxlen=EVENT_BUFFER):
+        self.events = deque(maxlen=maxlen)
+        self.seq = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def publish(self, kind, data):
+        with self._lock:
+            self.seq += 1
+            self.events.append((self.seq, kind, data))
+
+    def since(self, seq):
+        """回傳序號大於 seq 且仍在緩衝中的事件"""
+        with self._lock:
+            if not self.events or seq >= self.seq:
+                return []
+            skip = max(0, seq - self.events[0][0] + 1)
+            return list(self.events)[skip:]
+
+
+class JobScheduler:
+    """訓練工作排程器
+
+    提交後立即回傳，工作在佇列中等待；執行緒數與訓練行程池大小相同，
+    因此同時執行的訓練數受 TRAIN_WORKERS 限制，也不會佔用 API 的執行緒池。
+    狀態變化與訓練進度會發布到各工作的 EventChannel，供事件串流端點讀取。
+    訓練參數為串列時是重複實驗，各份同時在行程池中執行。
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool or get_pool()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = {}  # job_id -> 佇列中或執行中的狀態
+        self._cancelled = set()
+        self._run_ids = {}  # job_id -> 重複實驗各份在行程池中的編號
+        self._channels = OrderedDict()  # job_id -> EventChannel
+        self._threads = [threading.Thread(target=self._run, name=f'train-runner-{i}', daemon=True)
+                         for i in range(self.pool.size)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job_id, job_dir, algorithm, kwargs):
+        """加入訓練佇列，回傳目前狀態"""
+        with self._lock:
+            self._jobs[job_id] = QUEUED
+            self._channels[job_id] = EventChannel()
+            self._set_status(job_id, job_dir, QUEUED)
+        self._queue.put((job_id, job_dir, algorithm, kwargs))
+        return QUEUED
+
+    def channel(self, job_id):
+        """工作的事件緩衝；太久以前結束或伺服器重啟前的工作回傳 None"""
+        with self._lock:
+            return self._channels.get(job_id)
+
+    def _set_status(self, job_id, job_dir, status, **extra):
+        # 呼叫時需持有 self._lock
+        write_status(job_dir, status, **extra)
+        channel = self._channels[job_id]
+        channel.publish('status', {'status': status, **extra})
+        if status in FINISHED_STATES:
+            channel.closed = True
+            self._channels.move_to_end(job_id)
+            finished = [key for key, value in self._channels.items() if value.closed]
+            for key in finished[:-FINISHED_CHANNELS]:
+                del self._channels[key]
+
+    def state(self, job_id):
+        """佇列中或執行中的工作狀態；已結束或不存在時回傳 None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id, job_dir):
+        """取消工作；佇列中直接標記取消，執行中則終止其訓練行程。回傳是否有取消"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return False
+            self._cancelled.add(job_id)
+            if state == QUEUED:
+                del self._jobs[job_id]
+                self._set_status(job_id, job_dir, CANCELLED)
+                return True
+            run_ids = self._run_ids.get(job_id, [job_id])
+        for run_id in run_ids:
+            self.pool.cancel(run_id)
+        return True
+
+    def _train(self, job_id, algorithm, kwargs, channel):
+        """執行一個工作，回傳訓練結果摘要；重複實驗的各份平行執行，只轉送第 0 份的進度事件"""
+        on_event = lambda event: channel.publish('progress', event)
+        if isinstance(kwargs, dict):
+            try:
+                return self.pool.run(algorithm, kwargs, job_id, on_event)
+            finally:
+                self.pool.forget([job_id])
+        run_ids = [f'{job_id}:{i}' for i in range(len(kwargs))]
+        with self._lock:
+            if job_id in self._cancelled:
+                raise TrainingCancelled(job_id)
+            self._run_ids[job_id] = run_ids
+        try:
+            with ThreadPoolExecutor(max_workers=len(kwargs)) as executor:
+                futures = [executor.submit(self.pool.run, algorithm, run_kwargs, run_id, on_event if i == 0 else None)
+                           for i, (run_id, run_kwargs) in enumerate(zip(run_ids, kwargs))]
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                errors = [future.exception() for future in done if future.exception() is not None]
+                if errors:
+                    # 任一份失敗時終止其餘仍在執行的各份
+                    for run_id, future in zip(run_ids, futures):
+                        if not future.done():
+                            self.pool.cancel(run_id)
+            errors = [future.exception() for future in futures if future.exception() is not None]
+            if errors:
+                raise next((e for e in errors if not isinstance(e, TrainingCancelled)), errors[0])
+            return replicate_result(algorithm, [future.result() for future in futures])
+        finally:
+            with self._lock:
+                del self._run_ids[job_id]
+            self.pool.forget(run_ids)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            job_id, job_dir, algorithm, kwargs = item
+            with self._lock:
+                if self._jobs.get(job_id) != QUEUED:
+                    self._cancelled.discard(job_id)
+                    continue
+                self._jobs[job_id] = RUNNING
+                self._set_status(job_id, job_dir, RUNNING)
+                channel = self._channels[job_id]
+            extra = {}
+            try:
+                extra['result'] = self._train(job_id, algorithm, kwargs, channel)
+                status = COMPLETED
+            except TrainingCancelled:
+                status = CANCELLED
+            except Exception as e:
+                status = FAILED
+                with open(os.path.join(job_dir, 'error.log'), 'w', encoding='utf-8') as f:
+                    f.write(str(e))
+            with self._lock:
+                if job_id in self._cancelled:
+                    status, extra = CANCELLED, {}
+                self._cancelled.discard(job_id)
+                del self._jobs[job_id]
+                self._set_status(job_id, job_dir, status, **extra)
+
+    def shutdown(self):
+        """停止排程執行緒並關閉訓練行程池"""
+        for _ in self._threads:
+            self._queue.put(None)
+        self.pool.close()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """取得（必要時建立）全域排程器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
+
+
+def shutdown_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.shutdown()
+            _scheduler = None
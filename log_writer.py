@@ -0,0 +1,344 @@
+import os
+import queue
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+
+from grid_env import ACTIONS
+
+CHUNK_ROWS = 65536  # 每個緩衝區的列數，寫滿即交給背景執行緒輸出
+QUEUE_CHUNKS = 4    # 等待寫出的緩衝區上限（超過時訓練迴圈會等待，記憶體維持固定）
+
+# 逐步記錄欄位與型別（state/next_state 為狀態編號，action 為動作編號）
+STEP_COLUMNS = [
+    ('episode', np.int32),
+    ('step', np.int32),
+    ('state', np.int32),
+    ('action', np.int8),
+    ('reward', np.int64),
+    ('next_state', np.int32),
+    ('done', np.bool_),
+    ('epsilon', np.float64),
+    ('success', np.bool_),
+]
+
+# 訓練記錄粒度：逐步、每回合摘要、每第 k 回合逐步、最後 m 回合逐步
+LOG_LEVELS = ['full', 'episode', 'every_k', 'last_m']
+LOG_EVERY = 10   # every_k 的預設 k
+LOG_LAST = 100   # last_m 的預設 m
+
+
+def summarize_episodes(columns):
+    """將依回合排序的逐步欄位彙總為每回合一筆摘要列
+
+    step 為回合步數、reward 為（歸零判斷前的）總獎勵、state 為起始狀態，
+    其餘欄位取回合最後一步，因此依回合加總 reward 仍得到相同的學習曲線。
+    """
+    episodes = columns['episode']
+    if len(episodes) == 0:
+        return columns
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(episodes)) + 1))
+    ends = np.append(starts[1:], len(episodes)) - 1
+    summary = {name: values[ends] for name, values in columns.items()}
+    summary['state'] = columns['state'][starts]
+    summary['reward'] = np.add.reduceat(columns['reward'], starts)
+    return summary
+
+
+class LogPolicy:
+    """決定每回合要寫出逐步記錄、只寫摘要列，或完全不寫
+
+    open_end 表示訓練可能提前停止：last_m 無法依總回合數預先決定最後 m 回合，
+    改為每回合都交給寫入器，由 TailLogWriter 只保留實際最後的 m 個回合。
+    """
+
+    def __init__(self, level='full', episodes=0, every=LOG_EVERY, last=LOG_LAST, open_end=False):
+        if level not in LOG_LEVELS:
+            raise ValueError(f'未知的記錄層級: {level}')
+        if every < 1 or last < 1:
+            raise ValueError('log_every 與 log_last 必須大於 0')
+        self.level = level
+        self.episodes = episodes
+        self.every = every
+        self.last = last
+        self.summary = level == 'episode'
+        self.tail = level == 'last_m' and open_end
+
+    def logs_steps(self, episode):
+        """該回合是否寫出逐步記錄"""
+        if self.level == 'full':
+            return True
+        if self.level == 'every_k':
+            return episode % self.every == 0
+        if self.level == 'last_m':
+            return self.tail or episode > self.episodes - self.last
+        return False
+
+    def select(self, columns):
+        """依記錄層級過濾（或彙總）依回合排序的欄位，供批次訓練使用"""
+        if self.level == 'full' or self.tail:
+            return columns
+        if self.summary:
+            return summarize_episodes(columns)
+        episodes = columns['episode']
+        if self.level == 'every_k':
+            keep = episodes % self.every == 0
+        else:
+            keep = episodes > self.episodes - self.last
+        return {name: values[keep] for name, values in columns.items()}
+
+    def to_dict(self):
+        return {'log_level': self.level, 'log_every': self.every, 'log_last': self.last}
+
+
+class CsvLogSink:
+    """將記錄區塊附加寫入 log.csv（欄位格式與原本一次性 to_csv 相同）"""
+
+    def __init__(self, path, state_labels, lambda_value=None, resume=None):
+        self.path = path
+        self.labels = np.asarray(state_labels, dtype=object)
+        self.actions = np.asarray(ACTIONS, dtype=object)
+        self.lambda_value = lambda_value
+        self.header = True
+        if resume is not None and resume['size']:
+            # 從 checkpoint 續跑：丟掉 checkpoint 之後寫入的記錄
+            with open(path, 'r+b') as f:
+                f.truncate(resume['size'])
+            self.header = False
+
+    def state(self):
+        """目前寫入位置（供 checkpoint 記錄）"""
+        return {'size': os.path.getsize(self.path) if not self.header else 0}
+
+    def write(self, columns):
+        frame = {
+            'episode': columns['episode'],
+            'step': columns['step'],
+            'state': self.labels[columns['state']],
+            'action': self.actions[columns['action']],
+            'reward': columns['reward'],
+            'next_state': self.labels[columns['next_state']],
+            'done': columns['done'],
+            'epsilon': columns['epsilon'],
+        }
+        if self.lambda_value is not None:
+            frame['lambda_param'] = self.lambda_value
+        frame['success'] = columns['success']
+        pd.DataFrame(frame).to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        if self.header:
+            # 沒有任何記錄時仍輸出表頭
+            self.write({name: np.empty(0, dtype=dtype) for name, dtype in STEP_COLUMNS})
+
+    def abort(self):
+        # 每次寫入都已完成，沒有需要釋放的資源
+        pass
+
+
+class StepLogWriter:
+    """串流式逐步訓練記錄寫入器
+
+    以固定大小的型別欄位緩衝區收集記錄，寫滿後交由背景執行緒寫到各個 sink，
+    記憶體用量與回合數無關。訓練成功時呼叫 close 寫出全部記錄；失敗時呼叫 abort，
+    不再寫出任何內容（續跑時由 checkpoint 記錄的位置截斷）。
+    """
+
+    def __init__(self, sinks, chunk_rows=CHUNK_ROWS):
+        self.sinks = sinks
+        self.chunk_rows = chunk_rows
+        self._queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self._error = None
+        self._closed = False
+        self._aborted = False
+        self._new_buffer()
+        self._thread = threading.Thread(target=self._drain, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def _new_buffer(self):
+        self._buffer = {name: np.empty(self.chunk_rows, dtype=dtype) for name, dtype in STEP_COLUMNS}
+        self._columns = [self._buffer[name] for name, _ in STEP_COLUMNS]
+        self._size = 0
+
+    def _drain(self):
+        while True:
+            columns = self._queue.get()
+            if columns is None:
+                self._queue.task_done()
+                break
+            try:
+                if self._error is None and not self._aborted:
+                    for sink in self.sinks:
+                        sink.write(columns)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _flush(self):
+        if self._error is not None:
+            raise ValueError(f'寫入訓練記錄時發生錯誤: {self._error}')
+        if self._size:
+            self._queue.put({name: values[:self._size] for name, values in self._buffer.items()})
+            self._new_buffer()
+
+    def append(self, *row):
+        """附加一筆記錄（順序同 STEP_COLUMNS）"""
+        i = self._size
+        for column, value in zip(self._columns, row):
+            column[i] = value
+        self._size = i + 1
+        if self._size == self.chunk_rows:
+            self._flush()
+
+    def append_columns(self, columns):
+        """附加一批欄位陣列（批次訓練使用）"""
+        total = len(columns['episode'])
+        start = 0
+        while start < total:
+            n = min(total - start, self.chunk_rows - self._size)
+            for name, values in self._buffer.items():
+                values[self._size:self._size + n] = columns[name][start:start + n]
+            self._size += n
+            start += n
+            if self._size == self.chunk_rows:
+                self._flush()
+
+    def sync(self):
+        """寫出目前所有記錄並等待背景執行緒寫完，回傳各 sink 的寫入位置（供 checkpoint 使用）"""
+        self._flush()
+        self._queue.join()
+        if self._error is not None:
+            raise ValueError(f'寫入訓練記錄時發生錯誤: {self._error}')
+        return [sink.state() for sink in self.sinks]
+
+    def held(self):
+        """尚未交給 sink、需隨 checkpoint 保存的記錄（此寫入器沒有）"""
+        return {}
+
+    def close(self):
+        """寫出剩餘記錄並等待背景執行緒結束"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+        if self._error is not None:
+            raise ValueError(f'寫入訓練記錄時發生錯誤: {self._error}')
+
+    def abort(self):
+        """訓練失敗時停止背景執行緒，丟棄尚未寫出的記錄，也不產生最終的輸出檔"""
+        if self._closed:
+            return
+        self._closed = True
+        self._aborted = True
+        self._queue.put(None)
+        self._thread.join()
+        for sink in self.sinks:
+            sink.abort()
+
+
+class TailLogWriter:
+    """last_m 層級且可能提前停止時的寫入器：只保留最近 last 個回合的逐步記錄，close 時才交給 writer 寫出
+
+    保留中的記錄由 held 取出隨 checkpoint 保存，續跑時以 restore 放回，輸出與不中斷時相同。
+    """
+
+    def __init__(self, writer, last, chunk_rows=CHUNK_ROWS):
+        self.writer = writer
+        self.last = last
+        self._buffer = {name: np.empty(chunk_rows, dtype=dtype) for name, dtype in STEP_COLUMNS}
+        self._columns = [self._buffer[name] for name, _ in STEP_COLUMNS]
+        self._capacity = chunk_rows
+        self._head = 0          # 最舊保留回合的第一列
+        self._size = 0
+        self._starts = deque()  # 各保留回合第一列的位置
+        self._episode = None
+
+    def _begin(self, episode, position):
+        """回合從 position 列開始；保留的回合超過 last 個時捨棄最舊的一個"""
+        self._episode = episode
+        if len(self._starts) == self.last:
+            self._starts.popleft()
+            self._head = self._starts[0] if self._starts else position
+        self._starts.append(position)
+
+    def _reserve(self, n):
+        """確保尾端還有 n 列空間：移除已捨棄的列，剩餘空間不到一半時容量加倍"""
+        if self._size + n <= self._capacity:
+            return
+        head, kept = self._head, self._size - self._head
+        if (kept + n) * 2 > self._capacity:
+            self._capacity = max(self._capacity, kept + n) * 2
+        buffer = {}
+        for name, values in self._buffer.items():
+            buffer[name] = np.empty(self._capacity, dtype=values.dtype)
+            buffer[name][:kept] = values[head:self._size]
+        self._buffer = buffer
+        self._columns = [buffer[name] for name, _ in STEP_COLUMNS]
+        self._starts = deque(start - head for start in self._starts)
+        self._head, self._size = 0, kept
+
+    def append(self, *row):
+        """附加一筆記錄（順序同 STEP_COLUMNS）"""
+        if row[0] != self._episode:
+            self._begin(row[0], self._size)
+        if self._size == self._capacity:
+            self._reserve(1)
+        i = self._size
+        for column, value in zip(self._columns, row):
+            column[i] = value
+        self._size = i + 1
+
+    def append_columns(self, columns):
+        """附加一批依回合排序的欄位陣列（批次訓練使用）"""
+        episodes = columns['episode']
+        total = len(episodes)
+        if not total:
+            return
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(episodes)) + 1))
+        if episodes[0] == self._episode:
+            starts = starts[1:]  # 第一段接續目前的回合
+        first = 0
+        if len(starts) >= self.last:
+            # 這批已含 last 個新回合，之前保留的記錄都會被捨棄
+            starts = starts[-self.last:]
+            first = starts[0]
+            self._starts.clear()
+            self._head = self._size = 0
+        self._reserve(total - first)
+        base = self._size - first
+        for start in starts:
+            self._begin(episodes[start], base + start)
+        for name, values in self._buffer.items():
+            values[self._size:base + total] = columns[name][first:]
+        self._size = base + total
+
+    def held(self):
+        """保留中的記錄（供 checkpoint 保存）"""
+        return {name: values[self._head:self._size] for name, values in self._buffer.items()}
+
+    def restore(self, columns):
+        """放回 checkpoint 保存的記錄"""
+        if columns:
+            self.append_columns(columns)
+
+    def sync(self):
+        return self.writer.sync()
+
+    def close(self):
+        """寫出保留的最後 last 個回合並關閉 writer"""
+        self.writer.append_columns(self.held())
+        self._starts.clear()
+        self._head = self._size
+        self.writer.close()
+
+    def abort(self):
+        self.writer.abort()
@@ -10,6 +10,8 @@ from train_api import app as train_app
 from analysis_api import app as analysis_app
 from settings_api import app as settings_app
 from rules_api import app as rules_app
+from job_scheduler import get_scheduler, shutdown_scheduler, mark_interrupted
+from sweep import shutdown_sweeps
 
 app = FastAPI()
 
@@ -21,6 +23,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event('startup')
+def warm_trainers():
+    # 啟動時先處理上次中斷的工作，並建立排程器與訓練行程池，第一個訓練工作不必等待行程啟動
+    mark_interrupted('jobs')
+    get_scheduler()
+
+@app.on_event('shutdown')
+def stop_trainers():
+    shutdown_sweeps()
+    shutdown_scheduler()
+
 # 將各 app 的路由掛載到主 app
 app.mount('/maps', map_app)
 app.mount('/train', train_app)
@@ -3,13 +3,26 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import os
 import json
+import time
 import uuid
-from typing import List
+from typing import List, Optional
+from grid_env import compile_env, load_env_rule
+from planner import plan
+from map_codec import load_map_grid, compact_map, expand_map
+from map_gen import generate_map
 
 app = FastAPI()
 MAPS_DIR = 'maps'
 os.makedirs(MAPS_DIR, exist_ok=True)
 
+class GenerateRequest(BaseModel):
+    size: List[int]  # [列數, 行數]，只給一個值時為正方形
+    obstacle_density: float = 0.2  # 障礙佔整張地圖的比例
+    bonuses: int = 0  # 獎勵格數量
+    traps: int = 0  # 陷阱數量
+    seed: Optional[int] = None
+    name: Optional[str] = None
+
 class MapMeta(BaseModel):
     id: str
     name: str
@@ -34,25 +47,47 @@ def list_maps():
                 ))
     return maps
 
-# 取得單一地圖內容
+def save_map(data):
+    """以精簡格式儲存地圖，回傳地圖 ID；格式錯誤時拋出例外"""
+    compact = compact_map(data)
+    map_id = str(uuid.uuid4())
+    path = os.path.join(MAPS_DIR, f'{map_id}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(compact, f, ensure_ascii=False, separators=(',', ':'))
+    return map_id
+
+# 取得單一地圖內容（預設為含 map 網格的格式，format=compact 時回傳精簡格式）
 @app.get('/maps/{map_id}')
-def get_map(map_id: str):
+def get_map(map_id: str, format: str = 'full'):
+    path = os.path.join(MAPS_DIR, f'{map_id}.json')
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail='Map not found')
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return compact_map(data) if format == 'compact' else expand_map(data)
+
+# 以值迭代求最佳路徑（不需訓練）
+@app.get('/maps/{map_id}/plan')
+def plan_map(map_id: str, rule_id: Optional[str] = None, require_goal: bool = True):
     path = os.path.join(MAPS_DIR, f'{map_id}.json')
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail='Map not found')
     with open(path, 'r', encoding='utf-8') as f:
         data = json.load(f)
-    return data
+    try:
+        env = compile_env(load_map_grid(data), load_env_rule(rule_id))
+        result = plan(env, require_goal)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail='Rule not found')
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f'Cannot plan: {e}')
+    return {**result.rollout(), 'elapsed_ms': round(result.elapsed * 1000, 3)}
 
 # 上傳/建立新地圖
 @app.post('/maps')
 def create_map(file: UploadFile = File(...)):
     try:
-        data = json.load(file.file)
-        map_id = str(uuid.uuid4())
-        path = os.path.join(MAPS_DIR, f'{map_id}.json')
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        map_id = save_map(json.load(file.file))
         return {"id": map_id, "message": "Map created"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f'Invalid map file: {e}')
@@ -69,10 +104,28 @@ def delete_map(map_id: str):
 @app.post('/maps/json')
 def create_map_json(data: dict = Body(...)):
     try:
-        map_id = str(uuid.uuid4())
-        path = os.path.join(MAPS_DIR, f'{map_id}.json')
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        map_id = save_map(data)
         return {"id": map_id, "message": "Map created"}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f'Invalid map data: {e}') 
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=f'Invalid map data: {e}') 
+
+# 生成保證可從起點到達目標的隨機地圖（以精簡格式儲存）
+@app.post('/maps/generate')
+def create_generated_map(req: GenerateRequest):
+    if len(req.size) not in (1, 2):
+        raise HTTPException(status_code=400, detail='size must be [rows, cols] or [side]')
+    start_time = time.perf_counter()
+    try:
+        data = generate_map(req.size[0], req.size[-1], req.obstacle_density, req.bonuses, req.traps, req.seed, req.name, compact=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    map_id = save_map(data)
+    return {
+        "id": map_id,
+        "message": "Map generated",
+        "name": data['name'],
+        "size": data['size'],
+        "start": data['start'],
+        "goal": data['goal'],
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 3),
+    }
\ No newline at end of file
@@ -0,0 +1,74 @@
+import base64
+import zlib
+import numpy as np
+
+from grid_env import OBSTACLE
+
+# 精簡地圖格式：grid 欄位存放以 uint8 編碼、zlib 壓縮後 base64 的網格，
+# codes 的第 n 個字元即編碼 n 代表的格子
+GRID_ENCODING = 'uint8+zlib+base64'
+CELL_CODES = '01SGRT'
+DERIVED_FIELDS = ('map', 'obstacles')  # 可由網格還原、精簡格式不保存的欄位
+
+
+def encode_grid(grid):
+    """將字元網格編碼為精簡格式"""
+    grid = np.asarray(grid)
+    if grid.ndim != 2:
+        raise ValueError('地圖網格必須是二維')
+    codes = np.full(grid.shape, 255, dtype=np.uint8)
+    for code, char in enumerate(CELL_CODES):
+        codes[grid == char] = code
+    if (codes == 255).any():
+        raise ValueError(f'地圖含有未知的格子: {sorted(set(grid[codes == 255].tolist()))}')
+    return {
+        'encoding': GRID_ENCODING,
+        'shape': list(grid.shape),
+        'codes': CELL_CODES,
+        'data': base64.b64encode(zlib.compress(codes.tobytes())).decode('ascii'),
+    }
+
+
+def decode_grid(packed):
+    """將精簡格式還原為 NumPy 字元網格（dtype '<U1'）"""
+    if packed.get('encoding') != GRID_ENCODING:
+        raise ValueError(f"不支援的地圖編碼: {packed.get('encoding')}")
+    rows, cols = packed['shape']
+    codes = np.frombuffer(zlib.decompress(base64.b64decode(packed['data'])), dtype=np.uint8)
+    if codes.size != rows * cols:
+        raise ValueError('地圖資料長度與 shape 不符')
+    table = np.array(list(packed.get('codes', CELL_CODES)))
+    if codes.max(initial=0) >= len(table):
+        raise ValueError('地圖資料含有未知的編碼')
+    return table[codes].reshape(rows, cols)
+
+
+def load_map_grid(data):
+    """由地圖內容取得 NumPy 字元網格；支援精簡格式（grid）與舊格式（map）"""
+    if 'grid' in data:
+        return decode_grid(data['grid'])
+    return np.asarray(data['map'])
+
+
+def compact_map(data):
+    """轉為儲存用的精簡格式：網格改為 grid 欄位，並省略可還原的 map 與 obstacles
+
+    已是標準編碼的精簡格式時只解碼檢查、沿用原本的 grid（不必重新壓縮）。
+    """
+    grid = load_map_grid(data)
+    compact = {key: value for key, value in data.items() if key not in DERIVED_FIELDS}
+    packed = data.get('grid')
+    compact['grid'] = packed if packed is not None and packed.get('codes') == CELL_CODES else encode_grid(grid)
+    compact.setdefault('size', list(grid.shape))
+    return compact
+
+
+def expand_map(data):
+    """轉為舊格式（含 map 與 obstacles），供前端與既有的讀取方式使用"""
+    if 'grid' not in data:
+        return data
+    grid = decode_grid(data['grid'])
+    expanded = {key: value for key, value in data.items() if key != 'grid'}
+    expanded['obstacles'] = np.argwhere(grid == OBSTACLE).tolist()
+    expanded['map'] = grid.tolist()
+    return expanded
@@ -0,0 +1,113 @@
+import argparse
+import json
+import time
+import numpy as np
+
+from grid_env import START, GOAL, REWARD, TRAP, OBSTACLE, EMPTY, reachable_mask
+from map_codec import encode_grid
+
+MAX_MAP_SIDE = 1000  # 生成地圖的邊長上限
+BONUS_VALUE = 20  # 與地圖編輯器相同的獎勵格、陷阱格預設值
+TRAP_VALUE = -20
+
+
+def carve_path(rng, start, goal):
+    """由起點到目標的隨機單調路徑（打亂向下與向右的移動順序），回傳路徑上各格的 (列, 行)"""
+    (r0, c0), (r1, c1) = start, goal
+    moves = np.array([0] * (r1 - r0) + [1] * (c1 - c0), dtype=np.int64)
+    rng.shuffle(moves)
+    rows = r0 + np.concatenate([[0], np.cumsum(moves == 0)])
+    cols = c0 + np.concatenate([[0], np.cumsum(moves == 1)])
+    return rows, cols
+
+
+def generate_grid(rows, cols, obstacle_density=0.2, bonuses=0, traps=0, seed=None):
+    """生成保證可從起點走到目標的網格，回傳 (網格, 起點, 目標)
+
+    起點在左上四分之一、目標在右下四分之一隨機選取，先挖出一條連接兩者的隨機路徑並保留，
+    其餘格子依 obstacle_density 隨機放置障礙，再於空格放置獎勵格與陷阱（陷阱不放在路徑上）。
+    最後以向量化 BFS（grid_env.reachable_mask）確認目標可到達。
+    """
+    if not (2 <= rows <= MAX_MAP_SIDE and 2 <= cols <= MAX_MAP_SIDE):
+        raise ValueError(f'地圖邊長必須介於 2 與 {MAX_MAP_SIDE} 之間')
+    if not 0 <= obstacle_density < 1:
+        raise ValueError('障礙密度必須介於 0 與 1 之間')
+    if bonuses < 0 or traps < 0:
+        raise ValueError('獎勵格與陷阱數量不可為負')
+    rng = np.random.default_rng(seed)
+    start = (int(rng.integers(0, (rows + 1) // 2)), int(rng.integers(0, (cols + 1) // 2)))
+    goal = (int(rng.integers(rows // 2, rows)), int(rng.integers(cols // 2, cols)))
+    if start == goal:
+        goal = (rows - 1, cols - 1)
+
+    grid = np.full((rows, cols), EMPTY, dtype='<U1')
+    on_path = np.zeros((rows, cols), dtype=bool)
+    on_path[carve_path(rng, start, goal)] = True
+
+    # 障礙只放在路徑以外，數量依整張地圖的密度計算
+    free = np.flatnonzero(~on_path.ravel())
+    n_obstacles = min(int(round(obstacle_density * rows * cols)), free.size)
+    grid.ravel()[rng.choice(free, n_obstacles, replace=False)] = OBSTACLE
+
+    # 陷阱放在路徑以外的空格，獎勵格放在起點、目標以外的空格
+    empty = grid.ravel() == EMPTY
+    trap_cells = np.flatnonzero(empty & ~on_path.ravel())
+    if traps > trap_cells.size:
+        raise ValueError(f'空格不足以放置 {traps} 個陷阱')
+    grid.ravel()[rng.choice(trap_cells, traps, replace=False)] = TRAP
+    empty = grid.ravel() == EMPTY
+    empty[start[0] * cols + start[1]] = empty[goal[0] * cols + goal[1]] = False
+    bonus_cells = np.flatnonzero(empty)
+    if bonuses > bonus_cells.size:
+        raise ValueError(f'空格不足以放置 {bonuses} 個獎勵格')
+    grid.ravel()[rng.choice(bonus_cells, bonuses, replace=False)] = REWARD
+    grid[start] = START
+    grid[goal] = GOAL
+
+    passable = grid != OBSTACLE
+    if not reachable_mask(passable, start, passable & (grid != TRAP) & (grid != GOAL))[goal]:
+        raise RuntimeError('生成的地圖無法從起點到達目標')
+    return grid, start, goal
+
+
+def generate_map(rows, cols=None, obstacle_density=0.2, bonuses=0, traps=0, seed=None, name=None, compact=False):
+    """生成地圖內容（與地圖編輯器相同的 map.json 格式；compact 時為精簡格式，見 map_codec）"""
+    cols = rows if cols is None else cols
+    grid, start, goal = generate_grid(rows, cols, obstacle_density, bonuses, traps, seed)
+    cells = lambda char: [f'{i},{j}' for i, j in np.argwhere(grid == char).tolist()]
+    data = {
+        'name': name or f'generated {rows}x{cols}' + (f' #{seed}' if seed is not None else ''),
+        'size': [rows, cols],
+        'start': list(start),
+        'goal': list(goal),
+        'bonuses': {key: BONUS_VALUE for key in cells(REWARD)},
+        'traps': {key: TRAP_VALUE for key in cells(TRAP)},
+    }
+    if compact:
+        data['grid'] = encode_grid(grid)
+    else:
+        data['obstacles'] = np.argwhere(grid == OBSTACLE).tolist()
+        data['map'] = grid.tolist()
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成保證可解的隨機地圖')
+    parser.add_argument('--size', type=int, nargs='+', required=True, help='邊長（一個值為正方形，兩個值為列數與行數）')
+    parser.add_argument('--density', type=float, default=0.2, help='障礙密度（佔整張地圖的比例）')
+    parser.add_argument('--bonuses', type=int, default=0, help='獎勵格數量')
+    parser.add_argument('--traps', type=int, default=0, help='陷阱數量')
+    parser.add_argument('--seed', type=int, default=None, help='隨機種子')
+    parser.add_argument('--name', type=str, default=None, help='地圖名稱')
+    parser.add_argument('--compact', action='store_true', help='以精簡格式（grid 欄位）輸出')
+    parser.add_argument('--output', type=str, required=True, help='輸出檔路徑')
+    args = parser.parse_args()
+    if len(args.size) > 2:
+        parser.error('--size 最多兩個值')
+
+    start_time = time.perf_counter()
+    data = generate_map(args.size[0], args.size[-1], args.density, args.bonuses, args.traps, args.seed, args.name, args.compact)
+    elapsed = time.perf_counter() - start_time
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"已生成 {data['size'][0]}x{data['size'][1]} 地圖（{elapsed * 1000:.0f} ms）：起點 {data['start']}，目標 {data['goal']}，輸出至 {args.output}")
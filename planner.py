@@ -0,0 +1,128 @@
+import time
+import numpy as np
+
+from grid_env import ACTIONS, KIND_EMPTY, KIND_GOAL, is_terminal_kind
+
+MAX_PLAN_BONUSES = 16  # 獎勵格遮罩最多 2^16 種
+MAX_PLAN_SIZE = 1 << 27  # 狀態 × 動作 × 遮罩（以及各步策略表）的元素數上限
+
+
+class Plan:
+    """有限時域值迭代的結果
+
+    values 為第 1 步時各 (狀態, 已取得獎勵格遮罩) 的最佳總獎勵；策略依步數而異（獎勵隨步數衰減），
+    第 stationary 步以前的策略與第 stationary 步相同，只保存一份。
+    """
+
+    def __init__(self, env, values, policies, stationary, require_goal, elapsed):
+        self.env = env
+        self.values = values
+        self.policies = policies  # policies[t - stationary] 為第 t 步的 (狀態, 遮罩) -> 動作
+        self.stationary = stationary
+        self.require_goal = require_goal
+        self.elapsed = elapsed
+
+    @property
+    def value(self):
+        """從起點出發的最佳總獎勵（require_goal 時到不了目標為 -inf）"""
+        return float(self.values[self.env.start, 0])
+
+    def action(self, step, state, mask):
+        return int(self.policies[max(step, self.stationary) - self.stationary][state, mask])
+
+    def rollout(self):
+        """依最佳策略從起點走一遍，回傳路徑與獎勵"""
+        env = self.env
+        if not np.isfinite(self.value):
+            return {'value': None, 'path': [], 'actions': [], 'steps': 0, 'success': False}
+        state, mask = env.start, 0
+        consumed = env.new_consumed()
+        path = [env.state_cells[state].tolist()]
+        actions = []
+        total = 0
+        kind = None
+        for step in range(1, env.max_steps + 1):
+            action = self.action(step, state, mask)
+            state, reward, kind = env.step(state, action, step, consumed)
+            bonus = env.bonus_id[state]
+            if bonus >= 0:
+                mask |= 1 << bonus
+            total += reward
+            actions.append(ACTIONS[action])
+            path.append(env.state_cells[state].tolist())
+            if is_terminal_kind(kind):
+                break
+        return {'value': total, 'path': path, 'actions': actions, 'steps': len(actions), 'success': kind == KIND_GOAL}
+
+
+def plan(env, require_goal=True):
+    """在 (位置, 已取得獎勵格遮罩) 的擴增狀態上做有限時域值迭代
+
+    獎勵與 GridEnv.step 相同（依步數衰減、已取得的獎勵格視為空格），回合在終止格或第 max_steps 步結束。
+    require_goal 時只計入抵達目標的路徑（陷阱與步數用盡的價值為 -inf），與 strict_goal_reward_zero 的
+    訓練獎勵一致：最佳訓練獎勵為 max(0, value)。
+    所有 (狀態, 動作, 遮罩) 一次以陣列計算；獎勵不再隨步數改變且價值已收斂時提前結束。
+    """
+    start_time = time.perf_counter()
+    if env.n_bonuses > MAX_PLAN_BONUSES:
+        raise ValueError(f'獎勵格過多（{env.n_bonuses} 個），無法精確規劃')
+    n_masks = 1 << env.n_bonuses
+    if env.n_states * len(ACTIONS) * n_masks > MAX_PLAN_SIZE:
+        raise ValueError('地圖過大，無法精確規劃')
+    fail_value = -np.inf if require_goal else 0.0
+
+    # 每個 (狀態, 動作, 遮罩) 的下一格實際種類與下一個遮罩
+    next_state = env.next_state.astype(np.int64)
+    bonus = env.bonus_id[next_state]
+    bit = np.where(bonus >= 0, np.left_shift(1, np.maximum(bonus, 0)), 0).astype(np.int64)
+    masks = np.arange(n_masks, dtype=np.int64)
+    taken = (masks & bit[:, :, None]) != 0
+    kinds = np.where(taken, KIND_EMPTY, env.kind[next_state][:, :, None]).astype(np.int8)
+    next_index = next_state[:, :, None] * n_masks + (masks | bit[:, :, None])
+    # 終止格與無效動作不接續下一步：指向價值表末端固定為 0 的位置，價值改由 offset 決定
+    # （目標為 0，陷阱依 require_goal，無效動作為 -inf）
+    terminal = env.terminal[next_state]
+    sentinel = env.n_states * n_masks
+    next_index[terminal] = sentinel
+    offset = np.where(terminal & (env.kind[next_state] != KIND_GOAL), fail_value, 0.0)
+    offset[~env.valid_mask] = -np.inf
+    offset = np.broadcast_to(offset[:, :, None], kinds.shape)
+
+    rewards = env.reward_table.astype(np.float64)
+    extended = np.zeros(sentinel + 1)
+    extended[:sentinel] = fail_value  # 第 max_steps + 1 步：步數用盡
+    values = extended[:sentinel].reshape(env.n_states, n_masks).copy()
+    policies = []
+    stationary = 1
+    for step in range(env.max_steps, 0, -1):
+        q = rewards[:, step][kinds] + offset + extended[next_index]
+        policy = q.argmax(axis=1)
+        new_values = np.take_along_axis(q, policy[:, None, :], axis=1)[:, 0]
+        policies.append(policy.astype(np.int8))
+        converged = np.array_equal(new_values, values)
+        values = new_values
+        extended[:sentinel] = values.reshape(-1)
+        if converged and (rewards[:, 1:step + 1] == rewards[:, step:step + 1]).all():
+            stationary = step
+            break
+        if len(policies) * env.n_states * n_masks > MAX_PLAN_SIZE:
+            raise ValueError('規劃的策略表過大')
+    policies.reverse()
+    return Plan(env, values, policies, stationary, require_goal, time.perf_counter() - start_time)
+
+
+def greedy_rollout(env, q_values):
+    """依學到的 Q 值（平手取編號最小的動作）從起點走一遍，回傳路徑與獎勵"""
+    state = env.start
+    consumed = env.new_consumed()
+    path = [env.state_cells[state].tolist()]
+    total = 0
+    kind = None
+    for step in range(1, env.max_steps + 1):
+        action = int(np.argmax(q_values[state]))
+        state, reward, kind = env.step(state, action, step, consumed)
+        total += reward
+        path.append(env.state_cells[state].tolist())
+        if is_terminal_kind(kind):
+            break
+    return {'value': total, 'path': path, 'steps': len(path) - 1, 'success': kind == KIND_GOAL}
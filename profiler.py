@@ -0,0 +1,150 @@
+import copy
+import cProfile
+import json
+import os
+import time
+import sys
+import tracemalloc
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組，不記錄 RSS 峰值
+    resource = None
+
+PROFILE_JSON = 'profile.json'
+PROFILE_DUMP = 'profile.prof'  # cProfile 輸出，可用 python -m pstats 或 snakeviz 檢視
+
+# 各階段的說明（寫入 profile.json）
+PHASES = {
+    'setup': '載入與編譯地圖、建立 Q-Table 與記錄檔',
+    'select': 'ε-greedy 動作選擇',
+    'env_step': '環境轉移與獎勵',
+    'q_max': '下一狀態的最大 Q 值（Q-Learning / Dyna-Q 的 TD 目標）',
+    'traces': '資格跡記錄與更新（SARSA(λ)）',
+    'planning': '模型規劃更新（Dyna-Q）',
+    'logging': '逐步記錄與每回合摘要',
+    'checkpoint': '提前停止判斷與 checkpoint',
+    'loop_other': '訓練迴圈的其餘部分（TD 更新算式、迴圈本身、批次訓練的向量運算）',
+    'output': '寫出 Q-Table、訓練記錄與結果',
+}
+
+
+def peak_rss_mb():
+    """行程至今的 RSS 峰值（MB），在常駐訓練行程中涵蓋之前執行過的工作；無法取得時回傳 None"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+    return round(rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+class Profiler:
+    """訓練各階段的累計計時與記憶體量測（TrainRequest.profile）
+
+    只在建立時啟用：訓練迴圈用到的方法以計時包裝取代（僅限本次訓練的物件），
+    setup / train_loop / output 以 mark 分段；未啟用時訓練器不建立此物件，每步沒有額外成本。
+    行程的 RSS 峰值（process_peak_rss_mb）一律記錄，但它是整個行程至今的峰值，不只本次訓練；
+    本次訓練的配置峰值需另開 memory，以 tracemalloc 追蹤。tracemalloc 會追蹤每次配置（NumPy 純量運算也算），
+    訓練迴圈會慢一個數量級，計時只適合看相對比例，因此不隨 profile 預設開啟。
+    訓練失敗時也要呼叫 stop（見 TrainSession），避免 tracemalloc 與 cProfile 留在常駐訓練行程中。
+    """
+
+    def __init__(self, memory=False, dump=False):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.memory = memory
+        if memory:
+            tracemalloc.start()
+        self._cprofile = cProfile.Profile() if dump else None
+        if self._cprofile is not None:
+            self._cprofile.enable()
+        self.start = self._last = time.perf_counter()
+
+    def timed(self, func, name):
+        """回傳把執行時間累計到 name 的包裝函數"""
+        seconds, calls = self.seconds, self.calls
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds[name] += clock() - start
+                calls[name] += 1
+        return wrapper
+
+    def wrap(self, obj, method, name):
+        """以計時包裝取代 obj 的方法（設為實例屬性，只影響此物件）"""
+        setattr(obj, method, self.timed(getattr(obj, method), name))
+
+    def instrument(self, env, q_table, log_writer, episode_log, traces=None, model=None):
+        """包裝訓練迴圈用到的方法，回傳訓練應使用的環境
+
+        編譯後的環境在行程內共用快取，因此包裝在淺複本上（轉移與獎勵表仍共用）。
+        """
+        env = copy.copy(env)
+        self.wrap(env, 'step', 'env_step')
+        self.wrap(q_table, 'select', 'select')
+        self.wrap(q_table, 'max', 'q_max')
+        for obj in (log_writer, episode_log):
+            self.wrap(obj, 'append', 'logging')
+            self.wrap(obj, 'append_columns', 'logging')
+        if traces is not None:
+            self.wrap(traces, 'visit', 'traces')
+            self.wrap(traces, 'apply', 'traces')
+        if model is not None:
+            self.wrap(model, 'sweep', 'planning')
+        return env
+
+    def mark(self, name):
+        """把上次 mark（或建立）以來的時間記為一個階段"""
+        now = time.perf_counter()
+        self.seconds[name] += now - self._last
+        self.calls[name] += 1
+        self._last = now
+
+    def stop(self):
+        """停止 cProfile 與 tracemalloc（可重複呼叫），回傳 tracemalloc 的配置峰值（未啟用時為 None）"""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        peak = None
+        if self.memory and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return peak
+
+    def finish(self, output_dir, **info):
+        """結束量測並寫出 profile.json（啟用 dump 時另寫 cProfile 檔），回傳報告內容"""
+        peak = self.stop()
+        total = time.perf_counter() - self.start
+        seconds = dict(self.seconds)
+        # 迴圈內各階段的時間從 train_loop 扣除，剩下的記為 loop_other
+        inner = sum(value for name, value in seconds.items() if name not in ('setup', 'train_loop', 'output'))
+        if 'train_loop' in seconds:
+            seconds['loop_other'] = max(0.0, seconds.pop('train_loop') - inner)
+            self.calls['loop_other'] = self.calls.pop('train_loop')
+        phases = {
+            name: {
+                'seconds': round(seconds[name], 6),
+                'calls': self.calls[name],
+                'share': round(seconds[name] / total, 4) if total else 0.0,
+                'description': PHASES.get(name, ''),
+            }
+            for name in sorted(seconds, key=seconds.get, reverse=True)
+        }
+        report = {
+            **info,
+            'total_seconds': round(total, 6),
+            'phases': phases,
+            'process_peak_rss_mb': peak_rss_mb(),  # 整個行程的峰值，常駐行程中包含先前的工作
+            'tracemalloc_peak_bytes': peak,
+            'cprofile': None,
+        }
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.join(output_dir, PROFILE_DUMP))
+            report['cprofile'] = PROFILE_DUMP
+        with open(os.path.join(output_dir, PROFILE_JSON), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
@@ -1,9 +1,14 @@
 import json
 import numpy as np
-import pandas as pd
-import os
 import argparse
-import copy  # 新增 copy 模組
+from grid_env import compile_env, DEFAULT_RULE, KIND_GOAL, is_terminal_kind
+from map_codec import load_map_grid
+from log_writer import LOG_LEVELS, LOG_EVERY, LOG_LAST
+from early_stop import STOP_PATIENCE
+from checkpoint import CHECKPOINT_EVERY
+from train_session import TrainSession
+from vec_env import train_vectorized
+from jit_engine import train_jit, resolve_engine, ENGINES
 
 # 參數設定
 MAP_PATH = 'maps/example_map.json'
@@ -14,7 +19,6 @@ DISCOUNT_FACTOR = 0.95
 EPSILON_START = 1.0  # 初始探索率
 EPSILON_END = 0.01   # 最終探索率
 EPSILON_DECAY = 0.995  # 探索率衰減因子
-ACTIONS = ['up', 'down', 'left', 'right']
 
 # 地圖元素標記
 START = 'S'
@@ -31,9 +35,10 @@ STRICT_GOAL_REWARD_ZERO = True  # 預設開啟 reward 歸零
 
 
 def load_map(path):
+    """載入地圖檔案為 NumPy 網格（支援精簡格式）"""
     with open(path, 'r', encoding='utf-8') as f:
         data = json.load(f)
-    return data['map']
+    return load_map_grid(data)
 
 
 def load_rule(rule_id):
@@ -51,18 +56,10 @@ def load_rule(rule_id):
 
 def validate_map(map_grid):
     """驗證地圖的有效性"""
-    has_start = False
-    has_goal = False
-    has_trap = False
-    
-    for i, row in enumerate(map_grid):
-        for j, cell in enumerate(row):
-            if cell == START:
-                has_start = True
-            elif cell == GOAL:
-                has_goal = True
-            elif cell == TRAP:
-                has_trap = True
+    grid = np.asarray(map_grid)
+    has_start = bool((grid == START).any())
+    has_goal = bool((grid == GOAL).any())
+    has_trap = bool((grid == TRAP).any())
     
     if not has_start:
         raise ValueError('地圖中沒有起點 (S)')
@@ -73,61 +70,6 @@ def validate_map(map_grid):
     return True
 
 
-def find_start(map_grid):
-    for i, row in enumerate(map_grid):
-        for j, cell in enumerate(row):
-            if cell == START:
-                return (i, j)
-    raise ValueError('No start point found')
-
-
-def is_terminal(cell):
-    """判斷是否為終止狀態（目標或陷阱）"""
-    return cell in [GOAL, TRAP]
-
-
-def get_valid_actions(map_grid, pos):
-    actions = []
-    rows, cols = len(map_grid), len(map_grid[0])
-    i, j = pos
-    for idx, (di, dj) in enumerate([(-1,0),(1,0),(0,-1),(0,1)]):
-        ni, nj = i+di, j+dj
-        if 0 <= ni < rows and 0 <= nj < cols:
-            if map_grid[ni][nj] != OBSTACLE:
-                actions.append(ACTIONS[idx])
-    return actions
-
-
-def move(map_grid, pos, action):
-    i, j = pos
-    if action == 'up':
-        ni, nj = i-1, j
-    elif action == 'down':
-        ni, nj = i+1, j
-    elif action == 'left':
-        ni, nj = i, j-1
-    elif action == 'right':
-        ni, nj = i, j+1
-    else:
-        raise ValueError('Invalid action')
-    rows, cols = len(map_grid), len(map_grid[0])
-    if 0 <= ni < rows and 0 <= nj < cols and map_grid[ni][nj] != OBSTACLE:
-        return (ni, nj)
-    return pos  # 撞牆或障礙物不動
-
-
-def get_reward(cell, rule_data):
-    """獲取獎勵值（使用規則設定）"""
-    if cell == GOAL:
-        return rule_data['goalReward']
-    elif cell == REWARD:
-        return rule_data['bonusReward']
-    elif cell == TRAP:
-        return 0  # 陷阱不給予懲罰，只用於結束回合
-    else:
-        return rule_data['stepPenalty']
-
-
 def state_to_str(pos):
     return f"{pos[0]},{pos[1]}"
 
@@ -143,136 +85,89 @@ def get_epsilon(episode, total_episodes):
     return max(epsilon, EPSILON_END)
 
 
-def main(map_path, episodes, learning_rate, discount_factor, epsilon_start, output_dir, seed=None, strict_goal_reward_zero=True, rule_id=None):
-    # 設定隨機種子以提高可重現性
-    if seed is not None:
-        np.random.seed(seed)
-        print(f"隨機種子設定為: {seed}")
-    
-    # 載入規則
-    rule_data = load_rule(rule_id) if rule_id else {
-        'goalReward': 100,
-        'bonusReward': 10,
-        'trapPenalty': -50,
-        'stepPenalty': -1,
-        'wallPenalty': -1,
-        'stepDecay': 1.0,
-        'maxSteps': MAX_STEPS
-    }
-    
-    map_grid = load_map(map_path)
-    validate_map(map_grid)  # 驗證地圖有效性
-    
-    rows, cols = len(map_grid), len(map_grid[0])
-    
-    # 初始化 Q-Table
-    q_table = {}
-    initial_value = OPTIMISTIC_VALUE if OPTIMISTIC_INIT else 0.0
-    
-    for i in range(rows):
-        for j in range(cols):
-            if map_grid[i][j] != OBSTACLE:
-                for action in get_valid_actions(map_grid, (i, j)):
-                    q_table[(i, j, action)] = initial_value
-    
-    log_records = []
-    episode_rewards = []  # 記錄每回合的總獎勵
-    
-    print(f"開始訓練：{episodes} 回合")
-    print(f"學習率: {learning_rate}, 折扣因子: {discount_factor}")
-    print(f"探索率: {epsilon_start} → {EPSILON_END} (衰減: {EPSILON_DECAY})")
-    print(f"使用規則：{rule_data}")
-    
-    for episode in range(1, episodes+1):
-        # 每回合開始時重置地圖
-        current_map = copy.deepcopy(map_grid)
-        pos = find_start(current_map)
-        episode_reward = 0
-        current_epsilon = get_epsilon(episode, episodes)
-        success = False
-        last_cell = None
-        for step in range(1, rule_data['maxSteps']+1):
-            state = pos
-            valid_actions = get_valid_actions(current_map, state)
-            
-            # ε-greedy 策略
-            if np.random.rand() < current_epsilon:
-                action = np.random.choice(valid_actions)
-            else:
-                q_vals = [q_table.get((state[0], state[1], a), -np.inf) for a in valid_actions]
-                max_q = np.max(q_vals)
-                best_actions = [a for a, q in zip(valid_actions, q_vals) if q == max_q]
-                action = np.random.choice(best_actions)
-            
-            next_pos = move(current_map, state, action)
-            cell = current_map[next_pos[0]][next_pos[1]]
-            reward = get_reward(cell, rule_data)
-            
-            # 如果是獎勵格，取得後變為空格
-            if cell == REWARD:
-                current_map[next_pos[0]][next_pos[1]] = EMPTY
-            
-            # 應用步數衰減
-            reward = round(reward * (rule_data['stepDecay'] ** step))
-            
-            episode_reward += reward
-            last_cell = cell
-            
-            next_valid_actions = get_valid_actions(current_map, next_pos)
-            next_qs = [q_table.get((next_pos[0], next_pos[1], a), 0.0) for a in next_valid_actions]
-            max_next_q = max(next_qs) if next_qs else 0.0
-            
-            # Q-Learning 更新
-            q_key = (state[0], state[1], action)
-            q_table[q_key] = q_table.get(q_key, 0.0) + learning_rate * (reward + discount_factor * max_next_q - q_table.get(q_key, 0.0))
-            
-            log_records.append({
-                'episode': episode,
-                'step': step,
-                'state': state_to_str(state),
-                'action': action,
-                'reward': reward,
-                'next_state': state_to_str(next_pos),
-                'done': is_terminal(cell),
-                'epsilon': current_epsilon,
-                'success': cell == GOAL
-            })
-            
-            # 修正終止條件：目標或陷阱都終止回合
-            if is_terminal(cell) or step == rule_data['maxSteps']:
-                if cell == GOAL:
-                    success = True
-                break
-            pos = next_pos
-        # 最終 reward 歸零判斷
-        if strict_goal_reward_zero and last_cell != GOAL:
-            episode_reward = 0
-        episode_rewards.append(episode_reward)
-        
-        # 每 50 回合顯示進度
-        if episode % 50 == 0:
-            avg_reward = np.mean(episode_rewards[-50:])
-            print(f"回合 {episode}/{episodes}, 平均獎勵: {avg_reward:.2f}, 探索率: {current_epsilon:.3f}")
-    
-    # 輸出 Q-Table
-    os.makedirs(output_dir, exist_ok=True)
-    qtable_rows = []
-    for (i, j, action), value in q_table.items():
-        qtable_rows.append({'state': state_to_str((i, j)), 'action': action, 'value': value})
-    
-    qtable_output = os.path.join(output_dir, 'q_table.csv')
-    log_output = os.path.join(output_dir, 'log.csv')
-    
-    pd.DataFrame(qtable_rows).to_csv(qtable_output, index=False)
-    pd.DataFrame(log_records).to_csv(log_output, index=False)
-    
-    # 輸出訓練統計
-    final_avg_reward = np.mean(episode_rewards[-100:]) if len(episode_rewards) >= 100 else np.mean(episode_rewards)
-    print(f"\n訓練完成！")
-    print(f"Q-Table 已儲存至: {qtable_output}")
-    print(f"訓練記錄已儲存至: {log_output}")
-    print(f"最終 100 回合平均獎勵: {final_avg_reward:.2f}")
-    print(f"總回合數: {len(episode_rewards)}")
+def main(map_path, episodes, learning_rate, discount_factor, epsilon_start, output_dir, seed=None, strict_goal_reward_zero=True, rule_id=None, q_dtype='float64', num_envs=1, log_level='full', log_every=LOG_EVERY, log_last=LOG_LAST, optimistic=None, rule_data=None, map_grid=None, progress=None, checkpoint_every=CHECKPOINT_EVERY, resume=False, init_q=None, replicate=None, stop_delta_q=None, stop_policy=False, stop_success=None, stop_patience=STOP_PATIENCE, stop_min_episodes=0, engine='numpy', profile=False, profile_memory=False, profile_dump=False):
+    """Q-Learning 主訓練函數，回傳訓練結果摘要（同時寫入 result.json）"""
+    if optimistic is None:
+        optimistic = OPTIMISTIC_INIT
+    with TrainSession(
+            'q_learning', output_dir, episodes, seed=seed, strict_goal_reward_zero=strict_goal_reward_zero, q_dtype=q_dtype,
+            initial_value=OPTIMISTIC_VALUE if optimistic else 0.0, log_level=log_level, log_every=log_every, log_last=log_last,
+            progress=progress, checkpoint_every=checkpoint_every, resume=resume, init_q=init_q, replicate=replicate,
+            stop_delta_q=stop_delta_q, stop_policy=stop_policy, stop_success=stop_success, stop_patience=stop_patience,
+            stop_min_episodes=stop_min_episodes, profile=profile, profile_memory=profile_memory, profile_dump=profile_dump) as session:
+        # 載入規則（行程內呼叫時可直接傳入規則內容）
+        if rule_data is None:
+            rule_data = load_rule(rule_id) if rule_id else dict(DEFAULT_RULE, maxSteps=MAX_STEPS)
+
+        if map_grid is None:
+            map_grid = load_map(map_path)
+
+        env = compile_env(map_grid, rule_data, validate_map)  # 驗證地圖並預先編譯轉移與獎勵表（同地圖重複使用）
+        max_steps = rule_data['maxSteps']
+
+        # checkpoint 續跑、Q-Table、訓練記錄、提前停止與 checkpoint（見 train_session）
+        q_table = session.setup(env)
+        q_values = q_table.values
+        episodes = session.episodes
+        streams, log_writer, log_policy = session.streams, session.log_writer, session.log_policy
+
+        print(f"開始訓練：{episodes} 回合")
+        print(f"學習率: {learning_rate}, 折扣因子: {discount_factor}")
+        print(f"探索率: {epsilon_start} → {EPSILON_END} (衰減: {EPSILON_DECAY})")
+        print(f"使用規則：{rule_data}")
+        print(f"記錄層級：{log_level}")
+        engine = resolve_engine(engine) if num_envs <= 1 else 'vectorized'  # 實際使用的引擎，記錄於 result.json
+        env = session.instrument(env)
+
+        if num_envs > 1:
+            # 多環境同步批次訓練
+            print(f"使用 {num_envs} 個環境同步訓練")
+            train_vectorized(env, q_table, streams, log_writer, episodes, num_envs, learning_rate, discount_factor, get_epsilon, strict_goal_reward_zero, log_policy=log_policy, episode_log=session.episode_log,
+                             start_episode=session.start_episode, episode_rewards=session.episode_rewards, on_batch_end=session.on_batch_end)
+        elif engine == 'jit':
+            # 編譯後的逐回合核心
+            print("使用 JIT 編譯核心訓練")
+            train_jit(env, q_table, streams, log_writer, episodes, learning_rate, discount_factor, get_epsilon, strict_goal_reward_zero, log_policy=log_policy, episode_log=session.episode_log,
+                      start_episode=session.start_episode, episode_rewards=session.episode_rewards, on_batch_end=session.on_batch_end)
+        else:
+            for episode in range(session.start_episode, episodes+1):
+                # 每回合開始時重置獎勵格取用狀態
+                consumed = env.new_consumed()
+                state = env.start
+                episode_reward = 0
+                current_epsilon = get_epsilon(episode, episodes)
+                success = False
+                randoms = streams.episode_block(episode).tolist()  # 本回合預抽的亂數
+                log_steps = log_policy.logs_steps(episode)
+                for step in range(1, max_steps+1):
+                    # ε-greedy 策略
+                    action = q_table.select(state, env.valid_actions[state], current_epsilon, randoms[step - 1])
+
+                    next_state, reward, kind = env.step(state, action, step, consumed)
+
+                    episode_reward += reward
+
+                    max_next_q = q_table.max(next_state)
+
+                    # Q-Learning 更新
+                    q_values[state, action] += learning_rate * (reward + discount_factor * max_next_q - q_values[state, action])
+
+                    done = is_terminal_kind(kind)
+                    if log_steps:
+                        log_writer.append(episode, step, state, action, reward, next_state, done, current_epsilon, kind == KIND_GOAL)
+
+                    # 修正終止條件：目標或陷阱都終止回合
+                    if done or step == max_steps:
+                        if kind == KIND_GOAL:
+                            success = True
+                        break
+                    state = next_state
+                # 回合收尾（獎勵歸零判斷、每回合摘要），提前停止時結束訓練
+                if session.end_episode(episode, step, action, episode_reward, next_state, done, current_epsilon, success):
+                    break
+
+        # 輸出 Q-Table、訓練記錄與 result.json
+        return session.finish(engine=engine)
 
 
 if __name__ == '__main__':
@@ -287,6 +182,24 @@ if __name__ == '__main__':
     parser.add_argument('--optimistic', action='store_true', help='使用樂觀初始化')
     parser.add_argument('--strict_goal_reward_zero', action='store_true', default=True, help='沒到終點時分數歸零（預設開啟）')
     parser.add_argument('--rule', type=str, default=None, help='規則ID')
+    parser.add_argument('--num_envs', '--num-envs', type=int, default=1, help='同步執行的環境數（大於 1 時使用批次訓練；逐步記錄不會加速，建議搭配 --log_level episode）')
+    parser.add_argument('--log_level', type=str, default='full', choices=LOG_LEVELS, help='訓練記錄粒度：逐步、每回合摘要、每第 k 回合、最後 m 回合')
+    parser.add_argument('--log_every', type=int, default=LOG_EVERY, help='every_k 層級的 k')
+    parser.add_argument('--log_last', type=int, default=LOG_LAST, help='last_m 層級的 m')
+    parser.add_argument('--checkpoint_every', type=int, default=CHECKPOINT_EVERY, help='每多少回合寫一次 checkpoint（0 表示不寫）')
+    parser.add_argument('--resume', action='store_true', help='從輸出目錄中的 checkpoint 續跑')
+    parser.add_argument('--init_q', type=str, default=None, help='以此訓練目錄的 Q-Table 暖啟動')
+    parser.add_argument('--replicate', type=int, default=None, help='重複實驗編號（使用種子衍生的第 n 個獨立亂數串流）')
+    parser.add_argument('--stop_delta_q', type=float, default=None, help='提前停止：連續 stop_patience 回合 max|ΔQ| 低於此值')
+    parser.add_argument('--stop_policy', action='store_true', help='提前停止：貪婪策略連續 stop_patience 回合未改變')
+    parser.add_argument('--stop_success', type=float, default=None, help='提前停止：最近兩個 stop_patience 視窗的成功率相差不超過此值')
+    parser.add_argument('--stop_patience', type=int, default=STOP_PATIENCE, help='提前停止條件需持續成立的回合數')
+    parser.add_argument('--stop_min_episodes', type=int, default=0, help='至少訓練多少回合才允許提前停止')
+    parser.add_argument('--engine', type=str, default='numpy', choices=ENGINES, help='逐回合訓練引擎：NumPy 或 numba 編譯核心（未安裝 numba 時改用 NumPy）')
+    parser.add_argument('--profile', action='store_true', help='記錄各階段累計時間與行程 RSS 峰值至 profile.json')
+    parser.add_argument('--profile_memory', action='store_true', help='搭配 --profile 以 tracemalloc 量測記憶體峰值（計時會明顯變慢）')
+    parser.add_argument('--profile_dump', action='store_true', help='另存 cProfile 結果至 profile.prof')
+    parser.add_argument('--q_dtype', type=str, default='float64', choices=['float64', 'float32'], help='Q-Table 數值型別')
     
     args = parser.parse_args()
     
@@ -295,4 +208,4 @@ if __name__ == '__main__':
         OPTIMISTIC_INIT = True
         print("使用樂觀初始化")
     
-    main(args.map, args.episodes, args.learning_rate, args.discount_factor, args.epsilon, args.output, args.seed, args.strict_goal_reward_zero, args.rule) 
\ No newline at end of file
+    main(args.map, args.episodes, args.learning_rate, args.discount_factor, args.epsilon, args.output, args.seed, args.strict_goal_reward_zero, args.rule, q_dtype=args.q_dtype, num_envs=args.num_envs, log_level=args.log_level, log_every=args.log_every, log_last=args.log_last, checkpoint_every=args.checkpoint_every, resume=args.resume, init_q=args.init_q, replicate=args.replicate, stop_delta_q=args.stop_delta_q, stop_policy=args.stop_policy, stop_success=args.stop_success, stop_patience=args.stop_patience, stop_min_episodes=args.stop_min_episodes, profile=args.profile, profile_memory=args.profile_memory, profile_dump=args.profile_dump, engine=args.engine) 
\ No newline at end of file
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from grid_env import ACTIONS
+
+Q_DTYPES = {'float64': np.float64, 'float32': np.float32}
+
+
+def pick_among(candidates, u):
+    """向量化挑選：每列在為 True 的欄位中，依 [0, 1) 均勻亂數 u 均勻選出一欄"""
+    pick = (u * candidates.sum(axis=1)).astype(np.int64)
+    return np.argmax(np.cumsum(candidates, axis=1) > pick[:, None], axis=1)
+
+
+class QTable:
+    """以 (狀態編號, 動作編號) 索引的連續 Q 值陣列
+
+    只涵蓋環境中可到達的狀態；無效動作的位置填入 -inf，
+    因此每列直接取 max/argmax 即為遮罩後的結果。
+    """
+
+    def __init__(self, env, initial_value=0.0, dtype='float64'):
+        if dtype not in Q_DTYPES:
+            raise ValueError(f'不支援的 Q-Table 型別: {dtype}')
+        self.mask = env.valid_mask
+        self.labels = env.state_labels
+        self.values = np.full(self.mask.shape, -np.inf, dtype=Q_DTYPES[dtype])
+        self.values[self.mask] = initial_value
+
+    def max(self, state):
+        """狀態的最大 Q 值（僅考慮有效動作）"""
+        return self.values[state].max()
+
+    def greedy(self, state, u):
+        """貪婪動作，平手時以 [0, 1) 均勻亂數 u 在最大值中挑選"""
+        row = self.values[state]
+        best = np.flatnonzero(row == row.max())
+        if len(best) == 1:
+            return int(best[0])
+        return int(best[int(u * len(best))])
+
+    def select(self, state, valid_actions, epsilon, randoms):
+        """ε-greedy 動作選擇；randoms 為預抽的 (探索判斷, 動作挑選) 亂數"""
+        u_explore, u_pick = randoms
+        if u_explore < epsilon:
+            return valid_actions[int(u_pick * len(valid_actions))]
+        return self.greedy(state, u_pick)
+
+    def greedy_batch(self, states, u):
+        """批次貪婪動作：以 [0, 1) 均勻亂數 u 在平手的最大值中挑選"""
+        rows = self.values[states]
+        return pick_among(rows == rows.max(axis=1, keepdims=True), u)
+
+    def load_frame(self, frame):
+        """以 state/action/value 表格（例如先前訓練的 Q-Table）設定 Q 值，只套用本環境中有效的配對"""
+        states = frame['state'].map({label: i for i, label in enumerate(self.labels)})
+        actions = frame['action'].map({action: i for i, action in enumerate(ACTIONS)})
+        keep = (states.notna() & actions.notna()).to_numpy()
+        states = states[keep].to_numpy(dtype=np.int64)
+        actions = actions[keep].to_numpy(dtype=np.int64)
+        values = frame['value'].to_numpy()[keep]
+        valid = self.mask[states, actions]
+        self.values[states[valid], actions[valid]] = values[valid]
+        return int(valid.sum())
+
+    def to_frame(self):
+        """轉為 q_table.csv 的 state/action/value 格式（列優先、動作依序）"""
+        states, actions = np.nonzero(self.mask)
+        return pd.DataFrame({
+            'state': np.asarray(self.labels, dtype=object)[states],
+            'action': np.asarray(ACTIONS, dtype=object)[actions],
+            'value': self.values[states, actions]
+        })
@@ -0,0 +1,47 @@
+import numpy as np
+
+# 衍生子序列時 spawn_key 的命名空間，避免回合串流與子串流撞號
+_EPISODE_KEY = 0
+_CHILD_KEY = 1
+
+
+class EpisodeStreams:
+    """由 --seed 經 SeedSequence 衍生的亂數串流
+
+    每一回合都有獨立的子串流，開始時一次抽出整塊 (max_steps + 1) × 2 的 [0, 1) 亂數：
+    第 0 欄決定是否探索，第 1 欄用於挑選動作（隨機探索或平手時的最大值）。
+    回合的亂數只取決於種子與回合編號，與先前回合用了多少亂數無關，
+    因此同一種子的結果可逐位元重現，也能切分給平行的工作程序。
+    """
+
+    def __init__(self, seed=None, max_steps=0, seed_seq=None):
+        self.seed_seq = seed_seq if seed_seq is not None else np.random.SeedSequence(seed)
+        self.max_steps = max_steps
+
+    @property
+    def entropy(self):
+        """根種子的熵（未指定種子時可用來重現本次訓練）"""
+        return self.seed_seq.entropy
+
+    def _child_seq(self, *key):
+        return np.random.SeedSequence(self.seed_seq.entropy, spawn_key=self.seed_seq.spawn_key + key)
+
+    def generator(self, episode):
+        """回合專屬的 numpy Generator"""
+        return np.random.default_rng(self._child_seq(_EPISODE_KEY, episode))
+
+    def episode_block(self, episode):
+        """回合的預抽亂數區塊，形狀為 (max_steps + 1, 2)"""
+        return self.generator(episode).random((self.max_steps + 1, 2))
+
+    def episode_blocks(self, episodes):
+        """多個回合的預抽亂數區塊，形狀為 (回合數, max_steps + 1, 2)"""
+        return np.stack([self.episode_block(episode) for episode in episodes])
+
+    def child(self, index):
+        """第 index 個子串流（各子串流互相獨立，可單獨重建）"""
+        return EpisodeStreams(max_steps=self.max_steps, seed_seq=self._child_seq(_CHILD_KEY, index))
+
+    def spawn(self, n):
+        """衍生 n 個互相獨立的子串流（供平行工作程序或重複實驗使用）"""
+        return [self.child(i) for i in range(n)]
@@ -1,9 +1,15 @@
 import json
 import numpy as np
-import pandas as pd
-import os
 import argparse
-import copy  # 新增 copy 模組
+from grid_env import compile_env, DEFAULT_RULE, ACTIONS, KIND_GOAL, is_terminal_kind
+from map_codec import load_map_grid
+from log_writer import LOG_LEVELS, LOG_EVERY, LOG_LAST
+from early_stop import STOP_PATIENCE
+from checkpoint import CHECKPOINT_EVERY
+from train_session import TrainSession
+from vec_env import train_vectorized
+from jit_engine import train_jit, resolve_engine, ENGINES
+from traces import make_traces, TRACE_CUTOFF, WINDOW_CUTOFF
 
 # 參數設定
 MAP_PATH = 'maps/example_map.json'
@@ -15,7 +21,6 @@ EPSILON_START = 1.0  # 初始探索率
 EPSILON_END = 0.01   # 最終探索率
 EPSILON_DECAY = 0.995  # 探索率衰減因子
 LAMBDA = 0.9  # SARSA(λ) 的 λ 參數，控制資格跡的衰減
-ACTIONS = ['up', 'down', 'left', 'right']
 
 # 地圖元素標記
 START = 'S'
@@ -37,11 +42,11 @@ STRICT_GOAL_REWARD_ZERO = True  # 預設開啟 reward 歸零
 
 
 def load_map(path):
-    """載入地圖檔案"""
+    """載入地圖檔案為 NumPy 網格（支援精簡格式）"""
     try:
         with open(path, 'r', encoding='utf-8') as f:
             data = json.load(f)
-        return data['map']
+        return load_map_grid(data)
     except FileNotFoundError:
         raise ValueError(f'地圖檔案不存在: {path}')
     except json.JSONDecodeError:
@@ -52,18 +57,10 @@ def load_map(path):
 
 def validate_map(map_grid):
     """驗證地圖的有效性"""
-    has_start = False
-    has_goal = False
-    has_trap = False
-    
-    for i, row in enumerate(map_grid):
-        for j, cell in enumerate(row):
-            if cell == START:
-                has_start = True
-            elif cell == GOAL:
-                has_goal = True
-            elif cell == TRAP:
-                has_trap = True
+    grid = np.asarray(map_grid)
+    has_start = bool((grid == START).any())
+    has_goal = bool((grid == GOAL).any())
+    has_trap = bool((grid == TRAP).any())
     
     if not has_start:
         raise ValueError('地圖中沒有起點 (S)')
@@ -74,52 +71,6 @@ def validate_map(map_grid):
     return True
 
 
-def find_start(map_grid):
-    """尋找起點位置"""
-    for i, row in enumerate(map_grid):
-        for j, cell in enumerate(row):
-            if cell == START:
-                return (i, j)
-    raise ValueError('No start point found')
-
-
-def is_terminal(cell):
-    """判斷是否為終止狀態（目標或陷阱）"""
-    return cell in [GOAL, TRAP]
-
-
-def get_valid_actions(map_grid, pos):
-    """獲取有效動作"""
-    actions = []
-    rows, cols = len(map_grid), len(map_grid[0])
-    i, j = pos
-    for idx, (di, dj) in enumerate([(-1,0),(1,0),(0,-1),(0,1)]):
-        ni, nj = i+di, j+dj
-        if 0 <= ni < rows and 0 <= nj < cols:
-            if map_grid[ni][nj] != OBSTACLE:
-                actions.append(ACTIONS[idx])
-    return actions
-
-
-def move(map_grid, pos, action):
-    """執行動作並返回新位置"""
-    i, j = pos
-    if action == 'up':
-        ni, nj = i-1, j
-    elif action == 'down':
-        ni, nj = i+1, j
-    elif action == 'left':
-        ni, nj = i, j-1
-    elif action == 'right':
-        ni, nj = i, j+1
-    else:
-        raise ValueError('Invalid action')
-    rows, cols = len(map_grid), len(map_grid[0])
-    if 0 <= ni < rows and 0 <= nj < cols and map_grid[ni][nj] != OBSTACLE:
-        return (ni, nj)
-    return pos  # 撞牆或障礙物不動
-
-
 def get_epsilon(episode, total_episodes):
     """計算當前探索率（指數衰減）"""
     if EPSILON_DECAY == 1.0:
@@ -131,26 +82,6 @@ def get_epsilon(episode, total_episodes):
     return max(epsilon, EPSILON_END)
 
 
-def save_results(qtable_rows, log_records, output_dir):
-    """儲存訓練結果"""
-    try:
-        os.makedirs(output_dir, exist_ok=True)
-        
-        qtable_output = os.path.join(output_dir, 'q_table.csv')
-        log_output = os.path.join(output_dir, 'log.csv')
-        
-        pd.DataFrame(qtable_rows).to_csv(qtable_output, index=False)
-        pd.DataFrame(log_records).to_csv(log_output, index=False)
-        
-        print(f"SARSA Q-Table 已儲存至: {qtable_output}")
-        print(f"SARSA 訓練記錄已儲存至: {log_output}")
-        
-    except PermissionError:
-        raise ValueError(f'沒有權限寫入目錄: {output_dir}')
-    except Exception as e:
-        raise ValueError(f'儲存結果時發生錯誤: {str(e)}')
-
-
 def load_rule(rule_id):
     """載入規則設定"""
     try:
@@ -163,178 +94,129 @@ def load_rule(rule_id):
         print(f"載入規則失敗: {str(e)}")
         return None
 
-def get_reward(cell, rule_data):
-    """獲取獎勵值（使用規則設定）"""
-    if cell == GOAL:
-        return rule_data['goalReward']
-    elif cell == REWARD:
-        return rule_data['bonusReward']
-    elif cell == TRAP:
-        return 0  # 陷阱不給予懲罰，只用於結束回合
-    else:
-        return rule_data['stepPenalty']
-
-def main(map_path, episodes, learning_rate, discount_factor, epsilon_start, output_dir, seed=None, strict_goal_reward_zero=True, rule_id=None, lambda_param=None):
-    """SARSA(λ) 主訓練函數"""
-    # 設定隨機種子以提高可重現性
-    if seed is not None:
-        np.random.seed(seed)
-        print(f"隨機種子設定為: {seed}")
-    
-    # 使用傳入的 lambda 參數或預設值
-    lambda_value = lambda_param if lambda_param is not None else LAMBDA
-    print(f"使用 SARSA(λ) 算法，λ = {lambda_value}")
-    
-    # 載入規則
-    rule_data = load_rule(rule_id) if rule_id else {
-        'goalReward': 100,
-        'bonusReward': 10,
-        'trapPenalty': -50,
-        'stepPenalty': -1,
-        'wallPenalty': -1,
-        'stepDecay': 1.0,
-        'maxSteps': MAX_STEPS
-    }
-    
-    # 載入並驗證地圖
-    map_grid = load_map(map_path)
-    validate_map(map_grid)
-    
-    rows, cols = len(map_grid), len(map_grid[0])
-    
-    # 初始化 Q-Table
-    q_table = {}
-    initial_value = OPTIMISTIC_VALUE if OPTIMISTIC_INIT else 0.0
-    
-    for i in range(rows):
-        for j in range(cols):
-            if map_grid[i][j] != OBSTACLE:
-                for action in get_valid_actions(map_grid, (i, j)):
-                    q_table[(i, j, action)] = initial_value
-    
-    log_records = []
-    episode_rewards = []  # 記錄每回合的總獎勵
-    
-    print(f"開始 SARSA(λ) 訓練：{episodes} 回合")
-    print(f"學習率: {learning_rate}, 折扣因子: {discount_factor}")
-    print(f"探索率: {epsilon_start} → {EPSILON_END} (衰減: {EPSILON_DECAY})")
-    print(f"λ 參數: {lambda_value}")
-    print(f"使用規則：{rule_data}")
-    
-    for episode in range(1, episodes+1):
-        # 每回合開始時重置地圖和資格跡
-        current_map = copy.deepcopy(map_grid)
-        pos = find_start(current_map)
-        state = pos
-        episode_reward = 0
-        current_epsilon = get_epsilon(episode, episodes)
-        success = False
-        last_cell = None
-        
-        # 初始化資格跡 (eligibility traces)
-        eligibility_traces = {}
-        
-        valid_actions = get_valid_actions(current_map, state)
-        # 初始動作選擇
-        if np.random.rand() < current_epsilon:
-            action = np.random.choice(valid_actions)
+def main(map_path, episodes, learning_rate, discount_factor, epsilon_start, output_dir, seed=None, strict_goal_reward_zero=True, rule_id=None, lambda_param=None, q_dtype='float64', num_envs=1, trace_engine=None, trace_mode='accumulating', trace_cutoff=None, log_level='full', log_every=LOG_EVERY, log_last=LOG_LAST, optimistic=None, rule_data=None, map_grid=None, progress=None, checkpoint_every=CHECKPOINT_EVERY, resume=False, init_q=None, replicate=None, stop_delta_q=None, stop_policy=False, stop_success=None, stop_patience=STOP_PATIENCE, stop_min_episodes=0, engine='numpy', profile=False, profile_memory=False, profile_dump=False):
+    """SARSA(λ) 主訓練函數，回傳訓練結果摘要（同時寫入 result.json）"""
+    if optimistic is None:
+        optimistic = OPTIMISTIC_INIT
+    with TrainSession(
+            'sarsa', output_dir, episodes, seed=seed, strict_goal_reward_zero=strict_goal_reward_zero, q_dtype=q_dtype,
+            initial_value=OPTIMISTIC_VALUE if optimistic else 0.0, log_level=log_level, log_every=log_every, log_last=log_last,
+            progress=progress, checkpoint_every=checkpoint_every, resume=resume, init_q=init_q, replicate=replicate,
+            stop_delta_q=stop_delta_q, stop_policy=stop_policy, stop_success=stop_success, stop_patience=stop_patience,
+            stop_min_episodes=stop_min_episodes, profile=profile, profile_memory=profile_memory, profile_dump=profile_dump) as session:
+        # 使用傳入的 lambda 參數或預設值
+        lambda_value = lambda_param if lambda_param is not None else LAMBDA
+        print(f"使用 SARSA(λ) 算法，λ = {lambda_value}")
+
+        # 載入規則（行程內呼叫時可直接傳入規則內容）
+        if rule_data is None:
+            rule_data = load_rule(rule_id) if rule_id else dict(DEFAULT_RULE, maxSteps=MAX_STEPS)
+
+        # 載入並驗證地圖（同地圖與規則在同一行程內只編譯一次）
+        if map_grid is None:
+            map_grid = load_map(map_path)
+
+        env = compile_env(map_grid, rule_data, validate_map)  # 預先編譯轉移與獎勵表
+        max_steps = rule_data['maxSteps']
+
+        # checkpoint 續跑、Q-Table、訓練記錄、提前停止與 checkpoint（見 train_session）
+        q_table = session.setup(env, lambda_value)
+        q_values = q_table.values
+        flat_q = q_values.reshape(-1)
+        episodes = session.episodes
+        streams, log_writer, log_policy = session.streams, session.log_writer, session.log_policy
+
+        # 資格跡引擎（每步衰減 γλ）；多環境批次訓練固定以步數視窗實作，不使用引擎設定
+        if num_envs > 1 and trace_engine is not None:
+            print(f"多環境批次訓練以步數視窗近似資格跡，忽略 trace_engine={trace_engine}")
+        trace_engine = trace_engine or 'sparse'
+        # 未指定剪枝門檻時逐回合訓練不剪枝（精確），批次訓練使用資格跡視窗的預設門檻
+        if trace_cutoff is None:
+            trace_cutoff = WINDOW_CUTOFF if num_envs > 1 else TRACE_CUTOFF
+        traces = make_traces(trace_engine, q_values.shape, lambda_value * discount_factor, trace_mode, trace_cutoff)
+
+        print(f"開始 SARSA(λ) 訓練：{episodes} 回合")
+        print(f"學習率: {learning_rate}, 折扣因子: {discount_factor}")
+        print(f"探索率: {epsilon_start} → {EPSILON_END} (衰減: {EPSILON_DECAY})")
+        print(f"λ 參數: {lambda_value}")
+        print(f"資格跡: {trace_engine} / {trace_mode}" + (f" (cutoff {trace_cutoff})" if trace_engine == 'sparse' else ''))
+        print(f"使用規則：{rule_data}")
+        print(f"記錄層級：{log_level}")
+        engine = resolve_engine(engine) if num_envs <= 1 else 'vectorized'  # 實際使用的引擎，記錄於 result.json
+        env = session.instrument(env, traces)
+
+        if num_envs > 1:
+            # 多環境同步批次訓練
+            print(f"使用 {num_envs} 個環境同步訓練")
+            train_vectorized(env, q_table, streams, log_writer, episodes, num_envs, learning_rate, discount_factor, get_epsilon, strict_goal_reward_zero, lambda_value, trace_mode, trace_cutoff, log_policy, session.episode_log,
+                             session.start_episode, session.episode_rewards, session.on_batch_end)
+        elif engine == 'jit':
+            # 編譯後的逐回合核心（稠密資格跡等同不剪枝）
+            print("使用 JIT 編譯核心訓練")
+            train_jit(env, q_table, streams, log_writer, episodes, learning_rate, discount_factor, get_epsilon, strict_goal_reward_zero, lambda_value, trace_mode,
+                      trace_cutoff if trace_engine == 'sparse' else 0, log_policy, session.episode_log, session.start_episode, session.episode_rewards, session.on_batch_end)
         else:
-            q_vals = [q_table.get((state[0], state[1], a), -np.inf) for a in valid_actions]
-            max_q = np.max(q_vals)
-            best_actions = [a for a, q in zip(valid_actions, q_vals) if q == max_q]
-            action = np.random.choice(best_actions)
-        
-        for step in range(1, rule_data['maxSteps']+1):
-            next_pos = move(current_map, state, action)
-            cell = current_map[next_pos[0]][next_pos[1]]
-            reward = get_reward(cell, rule_data)
-            
-            # 如果是獎勵格，取得後變為空格
-            if cell == REWARD:
-                current_map[next_pos[0]][next_pos[1]] = EMPTY
-            
-            # 應用步數衰減
-            reward = round(reward * (rule_data['stepDecay'] ** step))
-            
-            episode_reward += reward
-            last_cell = cell
-            
-            next_valid_actions = get_valid_actions(current_map, next_pos)
-            
-            # 下一動作選擇（SARSA 特性）
-            if next_valid_actions:
-                if np.random.rand() < current_epsilon:
-                    next_action = np.random.choice(next_valid_actions)
-                else:
-                    next_q_vals = [q_table.get((next_pos[0], next_pos[1], a), -np.inf) for a in next_valid_actions]
-                    max_next_q = np.max(next_q_vals)
-                    best_next_actions = [a for a, q in zip(next_valid_actions, next_q_vals) if q == max_next_q]
-                    next_action = np.random.choice(best_next_actions)
-                next_q = q_table.get((next_pos[0], next_pos[1], next_action), 0.0)
-            else:
-                next_action = None
-                next_q = 0.0
-            
-            # SARSA(λ) 更新公式
-            current_q = q_table.get((state[0], state[1], action), 0.0)
-            td_error = reward + discount_factor * next_q - current_q
-            
-            # 更新當前狀態-動作對的資格跡
-            q_key = (state[0], state[1], action)
-            eligibility_traces[q_key] = eligibility_traces.get(q_key, 0.0) + 1.0
-            
-            # 更新所有狀態-動作對的 Q 值和資格跡
-            for (s_i, s_j, a), trace in eligibility_traces.items():
-                if trace > 0:
-                    q_table[(s_i, s_j, a)] = q_table.get((s_i, s_j, a), 0.0) + learning_rate * td_error * trace
-                    # 衰減資格跡
-                    eligibility_traces[(s_i, s_j, a)] = lambda_value * discount_factor * trace
-            
-            log_records.append({
-                'episode': episode,
-                'step': step,
-                'state': state_to_str(state),
-                'action': action,
-                'reward': reward,
-                'next_state': state_to_str(next_pos),
-                'done': is_terminal(cell),
-                'epsilon': current_epsilon,
-                'lambda_param': lambda_value,
-                'success': cell == GOAL
-            })
-            
-            # 修正終止條件：目標或陷阱都終止回合
-            if is_terminal(cell) or step == rule_data['maxSteps']:
-                if cell == GOAL:
-                    success = True
-                break
-            
-            state = next_pos
-            action = next_action
-        
-        # 最終 reward 歸零判斷
-        if strict_goal_reward_zero and last_cell != GOAL:
-            episode_reward = 0
-        episode_rewards.append(episode_reward)
-        
-        # 每 50 回合顯示進度
-        if episode % 50 == 0:
-            avg_reward = np.mean(episode_rewards[-50:])
-            print(f"回合 {episode}/{episodes}, 平均獎勵: {avg_reward:.2f}, 探索率: {current_epsilon:.3f}")
-    
-    # 準備輸出資料
-    qtable_rows = []
-    for (i, j, action), value in q_table.items():
-        qtable_rows.append({'state': state_to_str((i, j)), 'action': action, 'value': value})
-    
-    # 儲存結果
-    save_results(qtable_rows, log_records, output_dir)
-    
-    # 輸出訓練統計
-    final_avg_reward = np.mean(episode_rewards[-100:]) if len(episode_rewards) >= 100 else np.mean(episode_rewards)
-    print(f"\nSARSA(λ) 訓練完成！")
-    print(f"最終 100 回合平均獎勵: {final_avg_reward:.2f}")
-    print(f"總回合數: {len(episode_rewards)}")
+            for episode in range(session.start_episode, episodes+1):
+                # 每回合開始時重置獎勵格取用狀態和資格跡
+                consumed = env.new_consumed()
+                state = env.start
+                episode_reward = 0
+                current_epsilon = get_epsilon(episode, episodes)
+                success = False
+
+                # 初始化資格跡 (eligibility traces)
+                traces.reset()
+
+                randoms = streams.episode_block(episode).tolist()  # 本回合預抽的亂數
+                log_steps = log_policy.logs_steps(episode)
+                # 初始動作選擇
+                action = q_table.select(state, env.valid_actions[state], current_epsilon, randoms[0])
+
+                for step in range(1, max_steps+1):
+                    next_state, reward, kind = env.step(state, action, step, consumed)
+
+                    episode_reward += reward
+
+                    next_valid_actions = env.valid_actions[next_state]
+
+                    # 下一動作選擇（SARSA 特性）
+                    if next_valid_actions:
+                        next_action = q_table.select(next_state, next_valid_actions, current_epsilon, randoms[step])
+                        next_q = q_values[next_state, next_action]
+                    else:
+                        next_action = None
+                        next_q = 0.0
+
+                    # SARSA(λ) 更新公式
+                    q_key = (state, action)
+                    current_q = q_values[q_key]
+                    td_error = reward + discount_factor * next_q - current_q
+
+                    # 更新當前狀態-動作對的資格跡
+                    traces.visit(state * len(ACTIONS) + action)
+
+                    # 依資格跡更新所有活躍狀態-動作對的 Q 值，並衰減資格跡
+                    traces.apply(flat_q, learning_rate * td_error)
+
+                    done = is_terminal_kind(kind)
+                    if log_steps:
+                        log_writer.append(episode, step, state, action, reward, next_state, done, current_epsilon, kind == KIND_GOAL)
+
+                    # 修正終止條件：目標或陷阱都終止回合
+                    if done or step == max_steps:
+                        if kind == KIND_GOAL:
+                            success = True
+                        break
+
+                    state = next_state
+                    action = next_action
+
+                # 回合收尾（獎勵歸零判斷、每回合摘要），提前停止時結束訓練
+                if session.end_episode(episode, step, action, episode_reward, next_state, done, current_epsilon, success):
+                    break
+
+        # 輸出 Q-Table、訓練記錄與 result.json
+        return session.finish(engine=engine)
 
 
 if __name__ == '__main__':
@@ -349,7 +231,28 @@ if __name__ == '__main__':
     parser.add_argument('--optimistic', action='store_true', help='使用樂觀初始化')
     parser.add_argument('--strict_goal_reward_zero', action='store_true', default=True, help='沒到終點時分數歸零（預設開啟）')
     parser.add_argument('--rule', type=str, default=None, help='規則ID')
+    parser.add_argument('--num_envs', '--num-envs', type=int, default=1, help='同步執行的環境數（大於 1 時使用批次訓練；逐步記錄不會加速，建議搭配 --log_level episode）')
+    parser.add_argument('--engine', type=str, default='numpy', choices=ENGINES, help='逐回合訓練引擎：NumPy 或 numba 編譯核心（未安裝 numba 時改用 NumPy）')
+    parser.add_argument('--profile', action='store_true', help='記錄各階段累計時間與行程 RSS 峰值至 profile.json')
+    parser.add_argument('--profile_memory', action='store_true', help='搭配 --profile 以 tracemalloc 量測記憶體峰值（計時會明顯變慢）')
+    parser.add_argument('--profile_dump', action='store_true', help='另存 cProfile 結果至 profile.prof')
+    parser.add_argument('--q_dtype', type=str, default='float64', choices=['float64', 'float32'], help='Q-Table 數值型別')
+    parser.add_argument('--log_level', type=str, default='full', choices=LOG_LEVELS, help='訓練記錄粒度：逐步、每回合摘要、每第 k 回合、最後 m 回合')
+    parser.add_argument('--log_every', type=int, default=LOG_EVERY, help='every_k 層級的 k')
+    parser.add_argument('--log_last', type=int, default=LOG_LAST, help='last_m 層級的 m')
+    parser.add_argument('--checkpoint_every', type=int, default=CHECKPOINT_EVERY, help='每多少回合寫一次 checkpoint（0 表示不寫）')
+    parser.add_argument('--resume', action='store_true', help='從輸出目錄中的 checkpoint 續跑')
+    parser.add_argument('--init_q', type=str, default=None, help='以此訓練目錄的 Q-Table 暖啟動')
+    parser.add_argument('--replicate', type=int, default=None, help='重複實驗編號（使用種子衍生的第 n 個獨立亂數串流）')
+    parser.add_argument('--stop_delta_q', type=float, default=None, help='提前停止：連續 stop_patience 回合 max|ΔQ| 低於此值')
+    parser.add_argument('--stop_policy', action='store_true', help='提前停止：貪婪策略連續 stop_patience 回合未改變')
+    parser.add_argument('--stop_success', type=float, default=None, help='提前停止：最近兩個 stop_patience 視窗的成功率相差不超過此值')
+    parser.add_argument('--stop_patience', type=int, default=STOP_PATIENCE, help='提前停止條件需持續成立的回合數')
+    parser.add_argument('--stop_min_episodes', type=int, default=0, help='至少訓練多少回合才允許提前停止')
     parser.add_argument('--lambda_param', type=float, default=LAMBDA, help='SARSA(λ) 的 λ 參數')
+    parser.add_argument('--trace_engine', type=str, default=None, choices=['sparse', 'dense'], help='資格跡引擎：稀疏活躍集合（預設）或稠密陣列；--num_envs 大於 1 時不適用')
+    parser.add_argument('--trace_mode', type=str, default='accumulating', choices=['accumulating', 'replacing'], help='資格跡模式：累積或取代')
+    parser.add_argument('--trace_cutoff', type=float, default=None, help='稀疏資格跡的剪枝門檻（預設接近機器精度，誤差只在捨入等級；0 表示不剪枝，與稠密資格跡逐位元相同）')
     
     args = parser.parse_args()
     
@@ -359,7 +262,7 @@ if __name__ == '__main__':
         print("使用樂觀初始化")
     
     try:
-        main(args.map, args.episodes, args.learning_rate, args.discount_factor, args.epsilon, args.output, args.seed, args.strict_goal_reward_zero, args.rule, args.lambda_param)
+        main(args.map, args.episodes, args.learning_rate, args.discount_factor, args.epsilon, args.output, args.seed, args.strict_goal_reward_zero, args.rule, args.lambda_param, q_dtype=args.q_dtype, num_envs=args.num_envs, trace_engine=args.trace_engine, trace_mode=args.trace_mode, trace_cutoff=args.trace_cutoff, log_level=args.log_level, log_every=args.log_every, log_last=args.log_last, checkpoint_every=args.checkpoint_every, resume=args.resume, init_q=args.init_q, replicate=args.replicate, stop_delta_q=args.stop_delta_q, stop_policy=args.stop_policy, stop_success=args.stop_success, stop_patience=args.stop_patience, stop_min_episodes=args.stop_min_episodes, profile=args.profile, profile_memory=args.profile_memory, profile_dump=args.profile_dump, engine=args.engine)
     except Exception as e:
         print(f"訓練過程中發生錯誤: {str(e)}")
         exit(1) 
\ No newline at end of file
@@ -0,0 +1,223 @@
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import threading
+from datetime import datetime
+
+from grid_env import DEFAULT_RULE
+from job_scheduler import write_status, RUNNING, COMPLETED, FAILED, CANCELLED
+from trainer_pool import get_pool, TrainingCancelled
+
+MAX_SWEEP_RUNS = 1000  # 單次搜尋的組合數上限
+RULE_PREFIX = 'rule.'  # 以 'rule.stepDecay' 形式指定規則欄位
+LEADERBOARD_JSON = 'leaderboard.json'
+SWEEP_JSON = 'sweep.json'
+
+
+def sample_value(spec, rng):
+    """依分佈設定抽一個值：串列為均勻選一個，{'low', 'high', 'log', 'int'} 為區間內均勻（或對數均勻）抽樣"""
+    if isinstance(spec, list):
+        if not spec:
+            raise ValueError('候選值不可為空')
+        return rng.choice(spec)
+    if not isinstance(spec, dict) or 'low' not in spec or 'high' not in spec:
+        raise ValueError(f'無法解析的分佈設定: {spec}')
+    low, high = float(spec['low']), float(spec['high'])
+    if low > high:
+        raise ValueError(f'low 不可大於 high: {spec}')
+    if spec.get('log'):
+        if low <= 0:
+            raise ValueError(f'對數抽樣的區間必須為正: {spec}')
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return int(round(value)) if spec.get('int') else value
+
+
+def expand_sweep(grid=None, space=None, samples=None, seed=None):
+    """展開搜尋設定，回傳參數組合串列
+
+    未指定 samples 時為網格搜尋（grid 各欄位候選值的笛卡兒積）；
+    指定 samples 時為隨機搜尋，每組從 space 的分佈抽樣，grid 欄位則視為均勻選擇的候選值。
+    """
+    grid = grid or {}
+    space = space or {}
+    overlap = set(grid) & set(space)
+    if overlap:
+        raise ValueError(f'欄位不可同時出現在 grid 與 random: {sorted(overlap)}')
+    if not samples:
+        if space:
+            raise ValueError('隨機搜尋需指定 samples')
+        for key, values in grid.items():
+            if not isinstance(values, list) or not values:
+                raise ValueError(f'{key} 的候選值必須為非空串列')
+        total = math.prod(len(values) for values in grid.values())
+        if total > MAX_SWEEP_RUNS:
+            raise ValueError(f'組合數 {total} 超過上限 {MAX_SWEEP_RUNS}')
+        keys = list(grid)
+        return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+    if samples > MAX_SWEEP_RUNS:
+        raise ValueError(f'組合數 {samples} 超過上限 {MAX_SWEEP_RUNS}')
+    rng = random.Random(seed)
+    specs = {**grid, **space}
+    return [{key: sample_value(spec, rng) for key, spec in specs.items()} for _ in range(samples)]
+
+
+def split_params(params):
+    """將參數組合分成訓練設定與規則覆寫兩部分"""
+    train, rule = {}, {}
+    for key, value in params.items():
+        if key.startswith(RULE_PREFIX):
+            name = key[len(RULE_PREFIX):]
+            if name not in DEFAULT_RULE:
+                raise ValueError(f'未知的規則欄位: {name}')
+            rule[name] = value
+        else:
+            train[key] = value
+    return train, rule
+
+
+def rank_key(entry):
+    """排行榜排序：最終成功率優先，其次最終平均獎勵（皆為最後 100 回合，由高到低）
+
+    不用全部回合的成功率：收斂較慢、探索期較長的組合不應因早期失敗而排在後面。
+    """
+    return (-entry.get('final_success_rate', entry['success_rate']), -entry['final_avg_reward'], entry['run'])
+
+
+class Sweep:
+    """超參數搜尋
+
+    在與一般訓練工作共用的訓練行程池中平行執行所有組合，每個搜尋最多同時執行 workers 組
+    （預設與行程池大小相同），因此不論同時有幾個搜尋，訓練行程總數都不超過 TRAIN_WORKERS。
+    地圖在每個行程內只編譯一次（見 grid_env.compile_env），同規則的組合共用。
+    每完成一組即更新排行榜並寫入 leaderboard.json。
+    """
+
+    def __init__(self, sweep_id, sweep_dir, runs, workers=None, pool=None):
+        """runs 為 (參數組合, 演算法, 訓練參數) 串列"""
+        self.sweep_id = sweep_id
+        self.sweep_dir = sweep_dir
+        self.total = len(runs)
+        self.status = RUNNING
+        self.leaderboard = []
+        self.failed = []
+        self.running = set()
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        for run, item in enumerate(runs):
+            self._queue.put((run, *item))
+        self.pool = pool or get_pool()
+        self.workers = max(1, min(workers or self.pool.size, self.pool.size, self.total))
+        self._write()
+        self._threads = [threading.Thread(target=self._run, name=f'sweep-runner-{i}', daemon=True)
+                         for i in range(self.workers)]
+        self._remaining = len(self._threads)
+        for thread in self._threads:
+            thread.start()
+
+    def job_id(self, run):
+        return f'{self.sweep_id}:{run}'
+
+    def _run(self):
+        while not self.cancelled:
+            try:
+                run, params, algorithm, kwargs = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                if self.cancelled:
+                    break
+                self.running.add(run)
+            try:
+                result = self.pool.run(algorithm, kwargs, self.job_id(run))
+                entry = {'run': run, 'params': params, **result}
+            except TrainingCancelled:
+                entry = None
+            except Exception as e:
+                entry = {'run': run, 'params': params, 'error': str(e).strip().splitlines()[-1]}
+            with self._lock:
+                self.running.discard(run)
+                if entry is not None and 'error' in entry:
+                    self.failed.append(entry)
+                elif entry is not None:
+                    self.leaderboard.append(entry)
+                    self.leaderboard.sort(key=rank_key)
+                self._write()
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining:
+                return
+            self.status = CANCELLED if self.cancelled else (FAILED if self.failed and not self.leaderboard else COMPLETED)
+            self._write()
+        # 行程池與其他工作共用，只清除晚於組合結束才送達的取消標記
+        self.pool.forget([self.job_id(run) for run in range(self.total)])
+
+    def snapshot(self):
+        """目前的排行榜與進度"""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        # 呼叫時需持有 self._lock
+        return {
+            'sweep_id': self.sweep_id,
+            'status': self.status,
+            'total': self.total,
+            'finished': len(self.leaderboard) + len(self.failed),
+            'running': len(self.running),
+            'leaderboard': list(self.leaderboard),
+            'failed': list(self.failed),
+            'updated_at': datetime.now().isoformat(),
+        }
+
+    def _write(self):
+        # 呼叫時需持有 self._lock；先寫暫存檔再取代，輪詢時不會讀到寫一半的檔案
+        path = os.path.join(self.sweep_dir, LEADERBOARD_JSON)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        write_status(self.sweep_dir, self.status, total=self.total,
+                     finished=len(self.leaderboard) + len(self.failed))
+
+    def cancel(self):
+        """取消搜尋：尚未開始的組合不再執行，執行中的組合終止其行程。回傳是否有取消"""
+        with self._lock:
+            if self.status != RUNNING:
+                return False
+            self.cancelled = True
+            running = list(self.running)
+        for run in running:
+            self.pool.cancel(self.job_id(run))
+        return True
+
+
+_sweeps = {}
+_sweeps_lock = threading.Lock()
+
+
+def start_sweep(sweep_id, sweep_dir, runs, workers=None):
+    """建立並啟動超參數搜尋"""
+    sweep = Sweep(sweep_id, sweep_dir, runs, workers)
+    with _sweeps_lock:
+        _sweeps[sweep_id] = sweep
+    return sweep
+
+
+def get_sweep(sweep_id):
+    """本次伺服器執行期間建立的搜尋；不存在時回傳 None"""
+    with _sweeps_lock:
+        return _sweeps.get(sweep_id)
+
+
+def shutdown_sweeps():
+    """取消所有執行中的搜尋"""
+    with _sweeps_lock:
+        sweeps = list(_sweeps.values())
+    for sweep in sweeps:
+        sweep.cancel()
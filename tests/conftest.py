@@ -0,0 +1,19 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from map_codec import load_map_grid  # noqa: E402
+
+SAMPLE_MAP = os.path.join(ROOT, 'maps', '3cca661b-6fd1-4bce-9d36-e6941304498a.json')
+
+
+@pytest.fixture
+def map_grid():
+    """專案附帶的 6x6 範例地圖"""
+    with open(SAMPLE_MAP, 'r', encoding='utf-8') as f:
+        return load_map_grid(json.load(f))
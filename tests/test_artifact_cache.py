@@ -0,0 +1,78 @@
+import os
+from email.utils import formatdate
+
+import pytest
+from fastapi.testclient import TestClient
+
+import analysis_api
+import q_learning
+from artifact_cache import ArtifactCache, CACHE_DIR
+from artifacts import EPISODES_NPZ
+
+
+@pytest.fixture
+def job(tmp_path, map_grid, monkeypatch):
+    """一個已完成訓練的工作，並計算學習曲線的次數"""
+    q_learning.main(None, 100, 0.1, 0.95, 1.0, str(tmp_path / 'job'), seed=1, map_grid=map_grid, log_level='episode')
+    monkeypatch.setattr(analysis_api, 'JOBS_DIR', str(tmp_path))
+    monkeypatch.setattr(analysis_api, 'artifact_cache', ArtifactCache())
+    calls = []
+    compute = analysis_api.learning_curve
+
+    def learning_curve(job_dir):
+        calls.append(job_dir)
+        return compute(job_dir)
+
+    monkeypatch.setattr(analysis_api, 'learning_curve', learning_curve)
+    return tmp_path / 'job', calls
+
+
+def test_matching_etag_gets_304_without_computing(job):
+    job_dir, calls = job
+    client = TestClient(analysis_api.app)
+    response = client.get('/job/curve')
+    assert response.status_code == 200
+    assert len(response.json()['rewards']) == 100
+    etag = response.headers['etag']
+    assert response.headers['cache-control'] == 'no-cache' and 'last-modified' in response.headers
+    assert len(calls) == 1
+
+    for if_none_match in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+        response = client.get('/job/curve', headers={'If-None-Match': if_none_match})
+        assert response.status_code == 304, if_none_match
+        assert response.content == b''
+        assert response.headers['etag'] == etag
+    assert client.get('/job/curve', headers={'If-None-Match': '"other"'}).status_code == 200
+    # 來源未變：不帶條件的請求也直接使用快取結果
+    assert len(calls) == 1
+
+    # If-None-Match 優先於 If-Modified-Since
+    last_modified = response.headers['last-modified']
+    assert client.get('/job/curve', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get('/job/curve', headers={'If-Modified-Since': formatdate(0, usegmt=True)}).status_code == 200
+    assert client.get('/job/curve', headers={'If-None-Match': '"other"',
+                                             'If-Modified-Since': last_modified}).status_code == 200
+
+
+def test_source_change_invalidates_etag(job):
+    job_dir, calls = job
+    client = TestClient(analysis_api.app)
+    etag = client.get('/job/curve').headers['etag']
+    source = job_dir / EPISODES_NPZ
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    response = client.get('/job/curve', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert len(calls) == 2
+
+
+def test_disk_cache_survives_restart(job, monkeypatch):
+    job_dir, calls = job
+    client = TestClient(analysis_api.app)
+    expected = client.get('/job/curve').json()
+    assert (job_dir / CACHE_DIR / 'curve.json').exists()
+    # 新行程的記憶體快取是空的，仍由 cache/ 下的檔案取得結果
+    monkeypatch.setattr(analysis_api, 'artifact_cache', ArtifactCache())
+    assert client.get('/job/curve').json() == expected
+    assert len(calls) == 1
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+from tools import benchmark
+
+BASELINE = {
+    'sample/q_learning': {'steps_per_sec': 1000.0, 'episodes_per_sec': 50.0, 'peak_rss_mb': 100.0,
+                          'output_bytes': 2000, 'time_to_first_success': 1.0},
+    'sample/sarsa': {'steps_per_sec': 800.0, 'episodes_per_sec': 40.0, 'peak_rss_mb': 100.0,
+                     'output_bytes': 2000, 'time_to_first_success': 2.0},
+    '50/q_learning': {'steps_per_sec': 500.0, 'episodes_per_sec': 5.0, 'peak_rss_mb': 150.0,
+                      'output_bytes': 9000, 'time_to_first_success': 3.0},
+}
+
+
+def write_report(path, cases):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'cases': cases}, f)
+    return str(path)
+
+
+def changed(case, **metrics):
+    return {**BASELINE[case], **metrics}
+
+
+def test_compare_flags_metrics_beyond_threshold(tmp_path, capsys):
+    current = {
+        # 步數/秒下降 5%、峰值記憶體增加 5%：在 10% 門檻內
+        'sample/q_learning': changed('sample/q_learning', steps_per_sec=950.0, peak_rss_mb=105.0),
+        # 步數/秒下降 15%、輸出大小增加 30%（越小越好）、不再成功
+        'sample/sarsa': changed('sample/sarsa', steps_per_sec=680.0, output_bytes=2600, time_to_first_success=None),
+        # 本次執行失敗
+        '50/q_learning': {'error': 'MemoryError'},
+    }
+    baseline = write_report(tmp_path / 'baseline.json', BASELINE)
+    current = write_report(tmp_path / 'current.json', current)
+    assert sorted(benchmark.compare(baseline, current)) == [
+        ('50/q_learning', 'error'),
+        ('sample/sarsa', 'output_bytes'),
+        ('sample/sarsa', 'steps_per_sec'),
+        ('sample/sarsa', 'time_to_first_success'),
+    ]
+    assert '4 項指標退步超過 10%' in capsys.readouterr().out
+    # 放寬門檻後只剩超過 20% 的退步
+    assert sorted(benchmark.compare(baseline, current, threshold=0.2)) == [
+        ('50/q_learning', 'error'),
+        ('sample/sarsa', 'output_bytes'),
+        ('sample/sarsa', 'time_to_first_success'),
+    ]
+
+
+def test_improvements_and_missing_cases_do_not_fail(tmp_path):
+    current = {
+        'sample/q_learning': changed('sample/q_learning', steps_per_sec=2000.0, time_to_first_success=0.5),
+        'sample/dyna_q': changed('sample/q_learning'),  # 基準中沒有此案例
+    }
+    baseline = write_report(tmp_path / 'baseline.json', BASELINE)
+    assert benchmark.compare(baseline, write_report(tmp_path / 'current.json', current)) == []
+
+
+def test_compare_command_exit_status(tmp_path):
+    script = os.path.join(benchmark.ROOT, 'tools', 'benchmark.py')
+    baseline = write_report(tmp_path / 'baseline.json', BASELINE)
+    slower = write_report(tmp_path / 'slower.json', {'sample/q_learning': changed('sample/q_learning', steps_per_sec=800.0)})
+    same = write_report(tmp_path / 'same.json', BASELINE)
+
+    def run(current, *extra):
+        return subprocess.run([sys.executable, script, 'compare', baseline, current, *extra], capture_output=True).returncode
+
+    assert run(same) == 0
+    assert run(slower) == 1
+    assert run(slower, '--threshold', '0.25') == 0
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import dyna_q
+import q_learning
+import sarsa
+from checkpoint import CHECKPOINT_NPZ
+
+EPISODES = 600
+FAIL_AT = 350
+OUTPUTS = ('log.csv', 'q_table.csv')
+TIMING = 'elapsed'  # 每回合摘要中的經過時間，每次執行都不同
+
+
+def train(module, output_dir, map_grid, **kwargs):
+    return module.main(None, EPISODES, 0.1, 0.95, 1.0, str(output_dir), seed=3, map_grid=map_grid, **kwargs)
+
+
+@pytest.mark.parametrize('module, kwargs', [
+    (q_learning, {}),
+    (sarsa, {}),
+    (dyna_q, {}),
+    (q_learning, {'num_envs': 4}),
+    (sarsa, {'log_level': 'every_k'}),
+])
+def test_resume_is_byte_identical(tmp_path, map_grid, module, kwargs):
+    """訓練在 checkpoint 之後失敗，續跑的輸出與不中斷的訓練逐位元組相同"""
+    reference, resumed = tmp_path / 'reference', tmp_path / 'resumed'
+    train(module, reference, map_grid, **kwargs)
+
+    def fail(event):
+        if event['episode'] >= FAIL_AT:
+            raise RuntimeError('中斷')
+
+    with pytest.raises(RuntimeError):
+        train(module, resumed, map_grid, checkpoint_every=100, progress=fail, **kwargs)
+    assert (resumed / CHECKPOINT_NPZ).exists()
+    assert not (resumed / 'log.npz').exists()
+    train(module, resumed, map_grid, resume=True, **kwargs)
+    assert not (resumed / CHECKPOINT_NPZ).exists()
+    for name in OUTPUTS:
+        assert (resumed / name).read_bytes() == (reference / name).read_bytes(), name
+    expected = pd.read_csv(reference / 'episodes.csv').drop(columns=TIMING)
+    pd.testing.assert_frame_equal(pd.read_csv(resumed / 'episodes.csv').drop(columns=TIMING), expected)
+    for name in ('log.npz', 'q_table.npz', 'episodes.npz'):
+        with np.load(reference / name) as expected, np.load(resumed / name) as actual:
+            assert expected.files == actual.files
+            for key in set(expected.files) - {TIMING}:
+                assert np.array_equal(expected[key], actual[key]), f'{name}:{key}'
+
+
+def test_resume_without_checkpoint_fails(tmp_path, map_grid):
+    with pytest.raises(ValueError):
+        train(q_learning, tmp_path, map_grid, resume=True)
+
+
+def test_resume_rejects_other_algorithm(tmp_path, map_grid):
+    def fail(event):
+        if event['episode'] >= FAIL_AT:
+            raise RuntimeError('中斷')
+
+    with pytest.raises(RuntimeError):
+        train(q_learning, tmp_path, map_grid, checkpoint_every=100, progress=fail)
+    with pytest.raises(ValueError):
+        train(sarsa, tmp_path, map_grid, resume=True)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import dyna_q
+import q_learning
+import sarsa
+
+LOG_LAST = 20
+
+
+def train(module, output_dir, map_grid, **kwargs):
+    return module.main(None, 2000, 0.1, 0.95, 1.0, str(output_dir), seed=7, map_grid=map_grid,
+                       log_level='last_m', log_last=LOG_LAST, stop_policy=True, stop_patience=50, **kwargs)
+
+
+@pytest.mark.parametrize('module, kwargs', [
+    (q_learning, {}),
+    (sarsa, {}),
+    (q_learning, {'num_envs': 8}),
+    (q_learning, {'engine': 'jit'}),
+])
+def test_last_m_logs_final_episodes_after_early_stop(tmp_path, map_grid, monkeypatch, module, kwargs):
+    """提前停止時 last_m 記錄的是實際結束前的最後 m 回合"""
+    # 未安裝 numba 時也走編譯核心的批次路徑（核心以純 Python 執行）
+    monkeypatch.setattr(module, 'resolve_engine', lambda engine: engine)
+    result = train(module, tmp_path, map_grid, **kwargs)
+    stop = result['stop_episode']
+    assert result['stop_reason'] == 'policy_stable'
+    assert stop < 2000 - LOG_LAST
+    log = pd.read_csv(tmp_path / 'log.csv')
+    assert sorted(log['episode'].unique()) == list(range(stop - LOG_LAST + 1, stop + 1))
+    with np.load(tmp_path / 'log.npz') as npz:
+        assert np.array_equal(npz['episode'], log['episode'].to_numpy())
+
+
+def test_last_m_resume_after_early_stop(tmp_path, map_grid):
+    """checkpoint 保存尚未寫出的最後 m 回合，續跑後與不中斷的訓練相同"""
+    reference = train(dyna_q, tmp_path / 'reference', map_grid)
+    fail_at = reference['stop_episode'] - 30
+
+    def fail(event):
+        if event['episode'] >= fail_at:
+            raise RuntimeError('中斷')
+
+    with pytest.raises(RuntimeError):
+        train(dyna_q, tmp_path / 'resumed', map_grid, checkpoint_every=40, progress=fail)
+    train(dyna_q, tmp_path / 'resumed', map_grid, resume=True)
+    for name in ('log.csv', 'q_table.csv'):
+        assert (tmp_path / 'resumed' / name).read_bytes() == (tmp_path / 'reference' / name).read_bytes()
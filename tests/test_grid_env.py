@@ -0,0 +1,146 @@
+import copy
+from collections import deque
+
+import numpy as np
+import pytest
+
+from grid_env import GridEnv, ACTIONS, DEFAULT_RULE, START, GOAL, REWARD, TRAP, OBSTACLE, EMPTY, \
+    KIND_GOAL, KIND_TRAP, is_terminal_kind
+from map_gen import generate_grid
+
+# 原始訓練程式逐格處理地圖的做法（move / get_reward / get_valid_actions），作為 GridEnv 的對照
+
+
+def ref_valid_actions(map_grid, pos):
+    actions = []
+    rows, cols = len(map_grid), len(map_grid[0])
+    i, j = pos
+    for idx, (di, dj) in enumerate([(-1, 0), (1, 0), (0, -1), (0, 1)]):
+        ni, nj = i + di, j + dj
+        if 0 <= ni < rows and 0 <= nj < cols:
+            if map_grid[ni][nj] != OBSTACLE:
+                actions.append(ACTIONS[idx])
+    return actions
+
+
+def ref_move(map_grid, pos, action):
+    i, j = pos
+    ni, nj = {'up': (i - 1, j), 'down': (i + 1, j), 'left': (i, j - 1), 'right': (i, j + 1)}[action]
+    rows, cols = len(map_grid), len(map_grid[0])
+    if 0 <= ni < rows and 0 <= nj < cols and map_grid[ni][nj] != OBSTACLE:
+        return (ni, nj)
+    return pos  # 撞牆或障礙物不動
+
+
+def ref_reward(cell, rule_data):
+    if cell == GOAL:
+        return rule_data['goalReward']
+    elif cell == REWARD:
+        return rule_data['bonusReward']
+    elif cell == TRAP:
+        return 0
+    else:
+        return rule_data['stepPenalty']
+
+
+def ref_reachable(map_grid, start):
+    """逐格 BFS：從起點可到達的格子（目標與陷阱可進入但不再往外走）"""
+    seen = {start}
+    frontier = deque([start])
+    while frontier:
+        pos = frontier.popleft()
+        if map_grid[pos[0]][pos[1]] in (GOAL, TRAP):
+            continue
+        for action in ACTIONS:
+            nxt = ref_move(map_grid, pos, action)
+            if nxt not in seen:
+                seen.add(nxt)
+                frontier.append(nxt)
+    return seen
+
+
+def maps():
+    """專案附帶的範例地圖與數張隨機生成的地圖（含障礙、獎勵格與陷阱）"""
+    yield 'sample', None
+    for seed in range(4):
+        grid, _, _ = generate_grid(9, 11, obstacle_density=0.3, bonuses=6, traps=4, seed=seed)
+        yield f'gen{seed}', grid.tolist()
+
+
+@pytest.fixture(params=[name for name, _ in maps()])
+def grid(request, map_grid):
+    found = dict(maps())[request.param]
+    return found if found is not None else np.asarray(map_grid).tolist()
+
+
+def find_start(map_grid):
+    return next((i, j) for i, row in enumerate(map_grid) for j, cell in enumerate(row) if cell == START)
+
+
+def test_states_cover_only_reachable_cells(grid):
+    env = GridEnv(grid, DEFAULT_RULE)
+    reachable = ref_reachable(grid, find_start(grid))
+    assert sorted(reachable) == [tuple(cell) for cell in env.state_cells.tolist()]  # 列優先編號
+    for i, row in enumerate(grid):
+        for j in range(len(row)):
+            expected = sorted(reachable).index((i, j)) if (i, j) in reachable else -1
+            assert env.cell_state[i, j] == expected
+    assert tuple(env.state_cells[env.start]) == find_start(grid)
+
+
+def test_transitions_and_valid_mask_match_per_cell_logic(grid):
+    env = GridEnv(grid, DEFAULT_RULE)
+    for state, (i, j) in enumerate(env.state_cells.tolist()):
+        assert env.terminal[state] == (grid[i][j] in (GOAL, TRAP))
+        if env.terminal[state]:
+            continue  # 終止格之後不再移動
+        valid = ref_valid_actions(grid, (i, j))
+        assert [ACTIONS[a] for a in env.valid_actions[state]] == valid
+        assert env.valid_mask[state].tolist() == [action in valid for action in ACTIONS]
+        for a, action in enumerate(ACTIONS):
+            assert tuple(env.state_cells[env.next_state[state, a]]) == ref_move(grid, (i, j), action)
+
+
+@pytest.mark.parametrize('rule', [
+    DEFAULT_RULE,
+    dict(DEFAULT_RULE, stepDecay=0.9, goalReward=250, bonusReward=35, stepPenalty=-3, maxSteps=60),
+    dict(DEFAULT_RULE, stepDecay=0.97, bonusReward=7, stepPenalty=0, maxSteps=40),
+])
+def test_reward_table_matches_decayed_rewards(rule):
+    env = GridEnv([['S', '0', 'G']], rule)
+    for kind, cell in enumerate([EMPTY, REWARD, GOAL, TRAP]):
+        for step in range(rule['maxSteps'] + 1):
+            assert env.reward_table[kind, step] == round(ref_reward(cell, rule) * (rule['stepDecay'] ** step))
+            assert env.step_decay[step] == rule['stepDecay'] ** step
+
+
+@pytest.mark.parametrize('rule', [
+    DEFAULT_RULE,
+    dict(DEFAULT_RULE, stepDecay=0.9, bonusReward=35, stepPenalty=-2, maxSteps=80),
+])
+def test_random_rollouts_match_per_cell_logic(grid, rule):
+    """隨機動作的回合：位置、獎勵（含獎勵格只能取用一次與步數衰減）與終止都與逐格處理相同"""
+    env = GridEnv(grid, rule)
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        current_map = copy.deepcopy(grid)
+        pos = find_start(grid)
+        state = env.start
+        consumed = env.new_consumed()
+        for step in range(1, rule['maxSteps'] + 1):
+            action = int(rng.integers(len(ACTIONS)))  # 包含撞牆的動作
+            next_pos = ref_move(current_map, pos, ACTIONS[action])
+            cell = current_map[next_pos[0]][next_pos[1]]
+            reward = ref_reward(cell, rule)
+            if cell == REWARD:
+                current_map[next_pos[0]][next_pos[1]] = EMPTY
+            reward = round(reward * (rule['stepDecay'] ** step))
+
+            state, env_reward, kind = env.step(state, action, step, consumed)
+            assert tuple(env.state_cells[state]) == next_pos
+            assert env_reward == reward
+            assert is_terminal_kind(kind) == (cell in (GOAL, TRAP))
+            assert (kind == KIND_GOAL) == (cell == GOAL) and (kind == KIND_TRAP) == (cell == TRAP)
+            if cell in (GOAL, TRAP):
+                break
+            pos = next_pos
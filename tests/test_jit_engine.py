@@ -0,0 +1,54 @@
+import json
+
+import pandas as pd
+import pytest
+
+import jit_engine
+import q_learning
+import sarsa
+
+OUTPUTS = ('log.csv', 'q_table.csv')
+
+
+def train(module, output_dir, map_grid, **kwargs):
+    return module.main(None, 300, 0.1, 0.95, 1.0, str(output_dir), seed=11, map_grid=map_grid, **kwargs)
+
+
+@pytest.fixture
+def force_jit(monkeypatch):
+    """未安裝 numba 時核心以純 Python 執行，仍可驗證與 NumPy 引擎相同的結果"""
+    monkeypatch.setattr(q_learning, 'resolve_engine', lambda engine: engine)
+    monkeypatch.setattr(sarsa, 'resolve_engine', lambda engine: engine)
+
+
+@pytest.mark.parametrize('module, kwargs', [
+    (q_learning, {}),
+    (sarsa, {}),
+    (sarsa, {'trace_mode': 'replacing'}),
+    (sarsa, {'trace_cutoff': 1e-3}),
+    (q_learning, {'log_level': 'every_k', 'log_every': 7}),
+])
+def test_jit_matches_numpy(tmp_path, map_grid, force_jit, module, kwargs):
+    assert train(module, tmp_path / 'numpy', map_grid, engine='numpy', **kwargs)['engine'] == 'numpy'
+    assert train(module, tmp_path / 'jit', map_grid, engine='jit', **kwargs)['engine'] == 'jit'
+    for name in OUTPUTS:
+        assert (tmp_path / 'jit' / name).read_bytes() == (tmp_path / 'numpy' / name).read_bytes(), name
+    expected = pd.read_csv(tmp_path / 'numpy' / 'episodes.csv').drop(columns='elapsed')
+    actual = pd.read_csv(tmp_path / 'jit' / 'episodes.csv').drop(columns='elapsed')
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_missing_numba_falls_back_to_numpy(monkeypatch):
+    monkeypatch.setattr(jit_engine, 'HAS_NUMBA', False)
+    assert jit_engine.resolve_engine('jit') == 'numpy'
+    with pytest.raises(ValueError):
+        jit_engine.resolve_engine('gpu')
+
+
+def test_result_reports_resolved_engine(tmp_path, map_grid, monkeypatch):
+    # 要求 jit 但未安裝 numba 時，result.json 記錄實際使用的 numpy；多環境批次訓練記錄 vectorized
+    monkeypatch.setattr(jit_engine, 'HAS_NUMBA', False)
+    monkeypatch.setattr(q_learning, 'resolve_engine', jit_engine.resolve_engine)
+    assert train(q_learning, tmp_path / 'fallback', map_grid, engine='jit')['engine'] == 'numpy'
+    assert json.loads((tmp_path / 'fallback' / 'result.json').read_text(encoding='utf-8'))['engine'] == 'numpy'
+    assert train(sarsa, tmp_path / 'vec', map_grid, engine='jit', num_envs=4)['engine'] == 'vectorized'
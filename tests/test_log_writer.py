@@ -0,0 +1,122 @@
+import threading
+
+import numpy as np
+import pytest
+
+import q_learning
+from artifacts import NpzLogSink
+from log_writer import StepLogWriter, TailLogWriter, LogPolicy, STEP_COLUMNS
+
+
+class MemorySink:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.rows = []
+        self.closed = self.aborted = False
+
+    def write(self, columns):
+        if self.fail:
+            raise OSError('磁碟已滿')
+        self.rows.extend(zip(columns['episode'].tolist(), columns['step'].tolist()))
+
+    def state(self):
+        return len(self.rows)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def row(episode, step):
+    return episode, step, 0, 0, -1, 1, False, 0.5, False
+
+
+def writer_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'log-writer']
+
+
+def test_sink_error_is_raised_on_close():
+    writer = StepLogWriter([MemorySink(fail=True)], chunk_rows=4)
+    for step in range(10):
+        writer.append(*row(1, step))
+    with pytest.raises(ValueError):
+        writer.close()
+    assert not writer._thread.is_alive()
+
+
+def test_abort_discards_unwritten_rows():
+    sink = MemorySink()
+    writer = StepLogWriter([sink], chunk_rows=4)
+    for step in range(6):
+        writer.append(*row(1, step))
+    writer.abort()
+    assert not writer._thread.is_alive()
+    assert sink.aborted and not sink.closed
+    assert len(sink.rows) <= 4  # 只有寫滿的第一個區塊可能已寫出
+    writer.close()  # abort 之後 close 不再寫出
+    assert not sink.closed
+
+
+def test_npz_sink_abort_keeps_parts_for_resume(tmp_path):
+    path = str(tmp_path / 'log.npz')
+    sink = NpzLogSink(path, np.zeros((1, 2), dtype=np.int32))
+    writer = StepLogWriter([sink], chunk_rows=4)
+    for step in range(8):
+        writer.append(*row(1, step))
+    state = writer.sync()[0]
+    writer.append(*row(2, 0))
+    writer.abort()
+    assert not (tmp_path / 'log.npz').exists()
+    assert (tmp_path / 'log.npz.parts').is_dir()
+    # 續跑時截斷到 checkpoint 的位置
+    writer = StepLogWriter([NpzLogSink(path, np.zeros((1, 2), dtype=np.int32), resume=state)])
+    writer.close()
+    with np.load(path) as data:
+        assert data['step'].tolist() == list(range(8))
+
+
+def test_tail_writer_keeps_last_episodes():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        last = int(rng.integers(1, 5))
+        sink = MemorySink()
+        writer = StepLogWriter([sink])
+        tail = TailLogWriter(writer, last, chunk_rows=int(rng.integers(1, 6)))
+        rows, episode = [], 1
+        for _ in range(int(rng.integers(1, 15))):
+            batch = []
+            for _ in range(int(rng.integers(1, 5))):
+                batch += [row(episode, step) for step in range(int(rng.integers(1, 5)))]
+                episode += 1
+            rows += batch
+            if rng.random() < 0.5:
+                for values in batch:
+                    tail.append(*values)
+            else:
+                tail.append_columns({name: np.array([values[i] for values in batch], dtype=dtype)
+                                     for i, (name, dtype) in enumerate(STEP_COLUMNS)})
+        tail.close()
+        kept = set(range(episode - last, episode))
+        assert sink.rows == [(values[0], values[1]) for values in rows if values[0] in kept]
+
+
+def test_last_m_policy_without_early_stop():
+    policy = LogPolicy('last_m', episodes=100, last=10)
+    assert not policy.tail
+    assert not policy.logs_steps(90) and policy.logs_steps(91)
+    assert LogPolicy('last_m', episodes=100, last=10, open_end=True).logs_steps(1)
+
+
+def test_failed_training_stops_writer_thread(tmp_path, map_grid):
+    before = len(writer_threads())
+
+    def fail(event):
+        if event['episode'] >= 200:
+            raise RuntimeError('中斷')
+
+    with pytest.raises(RuntimeError):
+        q_learning.main(None, 500, 0.1, 0.95, 1.0, str(tmp_path), seed=1, map_grid=map_grid, progress=fail)
+    assert len(writer_threads()) == before
+    assert not (tmp_path / 'log.npz').exists()
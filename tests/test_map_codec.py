@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+import pytest
+
+from map_codec import encode_grid, decode_grid, load_map_grid, compact_map, expand_map, CELL_CODES
+from map_gen import generate_map
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 7), (64, 33)])
+def test_encode_decode_round_trip(shape):
+    rng = np.random.default_rng(0)
+    grid = rng.choice(list(CELL_CODES), size=shape)
+    packed = encode_grid(grid)
+    json.dumps(packed)  # 可直接寫入 map.json
+    decoded = decode_grid(packed)
+    assert decoded.dtype == np.dtype('<U1')
+    assert np.array_equal(decoded, grid)
+
+
+def test_compact_and_expand_round_trip(map_grid):
+    data = generate_map(20, obstacle_density=0.3, bonuses=3, traps=2, seed=5)
+    compact = compact_map(data)
+    assert 'map' not in compact and 'obstacles' not in compact
+    assert np.array_equal(load_map_grid(compact), load_map_grid(data))
+    expanded = expand_map(compact)
+    assert expanded['map'] == data['map']
+    assert expanded['obstacles'] == data['obstacles']
+    # 已是精簡格式時沿用原本的 grid
+    assert compact_map(compact)['grid'] is compact['grid']
+    # 專案附帶的舊格式地圖
+    assert np.array_equal(decode_grid(encode_grid(map_grid)), map_grid)
+
+
+def test_invalid_grids_are_rejected():
+    with pytest.raises(ValueError):
+        encode_grid([['S', 'X']])
+    packed = encode_grid([['S', 'G']])
+    with pytest.raises(ValueError):
+        decode_grid({**packed, 'shape': [2, 2]})
+    with pytest.raises(ValueError):
+        decode_grid({**packed, 'encoding': 'raw'})
@@ -0,0 +1,70 @@
+from collections import deque
+
+import numpy as np
+import pytest
+
+from grid_env import GridEnv, DEFAULT_RULE, START, GOAL, REWARD, TRAP, OBSTACLE
+from map_codec import load_map_grid
+from map_gen import generate_grid, generate_map
+
+
+def goal_reachable(grid, start, goal):
+    """逐格 BFS：不穿越障礙、陷阱與目標，判斷能否從起點走到目標"""
+    rows, cols = grid.shape
+    seen = {start}
+    frontier = deque([start])
+    while frontier:
+        i, j = frontier.popleft()
+        if (i, j) == goal:
+            return True
+        if grid[i, j] in (TRAP, GOAL):
+            continue
+        for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            cell = (i + di, j + dj)
+            if 0 <= cell[0] < rows and 0 <= cell[1] < cols and grid[cell] != OBSTACLE and cell not in seen:
+                seen.add(cell)
+                frontier.append(cell)
+    return False
+
+
+@pytest.mark.parametrize('rows, cols, density, bonuses, traps', [
+    (2, 2, 0.0, 0, 0),
+    (12, 12, 0.3, 5, 5),
+    (9, 31, 0.6, 10, 10),
+    (40, 25, 0.8, 3, 20),
+])
+def test_generated_grids_are_solvable(rows, cols, density, bonuses, traps):
+    for seed in range(40):
+        grid, start, goal = generate_grid(rows, cols, density, bonuses, traps, seed)
+        assert grid.shape == (rows, cols)
+        assert [tuple(cell) for cell in np.argwhere(grid == START).tolist()] == [start]
+        assert [tuple(cell) for cell in np.argwhere(grid == GOAL).tolist()] == [goal]
+        assert np.count_nonzero(grid == REWARD) == bonuses
+        assert np.count_nonzero(grid == TRAP) == traps
+        assert np.count_nonzero(grid == OBSTACLE) <= round(density * rows * cols)
+        assert goal_reachable(grid, start, goal), (seed, rows, cols)
+
+
+def test_same_seed_gives_same_map():
+    first = generate_map(30, 20, obstacle_density=0.4, bonuses=4, traps=4, seed=9)
+    assert generate_map(30, 20, obstacle_density=0.4, bonuses=4, traps=4, seed=9) == first
+    assert generate_map(30, 20, obstacle_density=0.4, bonuses=4, traps=4, seed=10) != first
+
+
+def test_generated_map_loads_for_training():
+    for compact in (False, True):
+        data = generate_map(25, obstacle_density=0.3, bonuses=3, traps=3, seed=1, compact=compact)
+        env = GridEnv(load_map_grid(data), DEFAULT_RULE)
+        goal = env.cell_state[tuple(data['goal'])]
+        assert goal >= 0 and env.terminal[goal]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'rows': 1, 'cols': 5},
+    {'rows': 5, 'cols': 5, 'obstacle_density': 1.0},
+    {'rows': 5, 'cols': 5, 'bonuses': -1},
+    {'rows': 3, 'cols': 3, 'traps': 20},
+])
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        generate_grid(**kwargs)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from grid_env import GridEnv, DEFAULT_RULE, KIND_GOAL, is_terminal_kind
+from planner import plan, greedy_rollout
+
+# 小地圖：含獎勵格、陷阱與障礙，步數上限短到可以窮舉所有動作序列
+GRID = [
+    ['S', '0', 'R', '0'],
+    ['0', '1', 'T', '0'],
+    ['R', '0', '0', 'G'],
+]
+MAX_STEPS = 7
+
+
+def brute_force(env, require_goal):
+    """窮舉所有合法動作序列，回傳最佳總獎勵（require_goal 時只計入抵達目標的序列）"""
+    best = -np.inf
+
+    def search(state, step, consumed, total):
+        nonlocal best
+        for action in env.valid_actions[state]:
+            taken = list(consumed)
+            next_state, reward, kind = env.step(state, action, step, taken)
+            value = total + reward
+            if is_terminal_kind(kind) or step == env.max_steps:
+                if kind == KIND_GOAL or not require_goal:
+                    best = max(best, value)
+            else:
+                search(next_state, step + 1, taken, value)
+
+    search(env.start, 1, env.new_consumed(), 0)
+    return best
+
+
+@pytest.mark.parametrize('step_decay', [1.0, 0.9])
+@pytest.mark.parametrize('require_goal', [True, False])
+def test_plan_matches_brute_force(step_decay, require_goal):
+    env = GridEnv(np.array(GRID), dict(DEFAULT_RULE, maxSteps=MAX_STEPS, stepDecay=step_decay))
+    result = plan(env, require_goal)
+    assert result.value == brute_force(env, require_goal)
+    if require_goal:
+        rollout = result.rollout()
+        assert rollout['success']
+        assert rollout['value'] == result.value
+
+
+def test_unreachable_goal_has_no_plan():
+    """步數不足以抵達目標時，require_goal 的最佳值為 -inf，rollout 不回傳路徑"""
+    env = GridEnv(np.array(GRID), dict(DEFAULT_RULE, maxSteps=3))
+    result = plan(env)
+    assert result.value == -np.inf
+    assert result.rollout()['path'] == []
+
+
+def test_greedy_rollout_follows_planned_policy():
+    """以最佳策略的動作作為 Q 值時，greedy_rollout 走出相同的獎勵"""
+    env = GridEnv(np.array(GRID), dict(DEFAULT_RULE, maxSteps=MAX_STEPS))
+    result = plan(env)
+    q_values = np.zeros((env.n_states, 4))
+    rollout = result.rollout()
+    state, mask = env.start, 0
+    for step in range(1, rollout['steps'] + 1):
+        action = result.action(step, state, mask)
+        q_values[state, action] = 1.0
+        state = int(env.next_state[state, action])
+        if env.bonus_id[state] >= 0:
+            mask |= 1 << int(env.bonus_id[state])
+    greedy = greedy_rollout(env, q_values)
+    assert greedy['success']
+    assert greedy['value'] == rollout['value']
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import q_learning
+from artifacts import PolicyIndex, load_policy_index, QTABLE_CSV, QTABLE_NPZ, PATH_MAX_STEPS
+from grid_env import ACTIONS, START, OBSTACLE
+from map_gen import generate_grid
+
+
+def reference_path(df, grid, start):
+    """原本的路徑擷取：每步以 DataFrame 篩選該格的 Q 值並取 idxmax"""
+    state = start
+    path = [state]
+    visited = set()
+    moves = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+    for _ in range(PATH_MAX_STEPS):
+        visited.add(state)
+        q_vals = df[df['state'] == f"{state[0]},{state[1]}"]
+        if q_vals.empty:
+            break
+        action = q_vals.loc[q_vals['value'].idxmax()]['action']
+        ni, nj = state[0] + moves[action][0], state[1] + moves[action][1]
+        if not (0 <= ni < len(grid) and 0 <= nj < len(grid[0])) or grid[ni][nj] == '1':
+            break
+        state = (ni, nj)
+        path.append(state)
+        if grid[ni][nj] == 'G' or state in visited:
+            break
+    return path
+
+
+def find_start(grid):
+    return tuple(int(x) for x in np.argwhere(np.asarray(grid) == START)[0])
+
+
+def test_trained_policy_matches_reference(tmp_path, map_grid):
+    q_learning.main(None, 300, 0.1, 0.95, 1.0, str(tmp_path), seed=3, map_grid=map_grid)
+    grid = np.asarray(map_grid).tolist()
+    start = find_start(grid)
+    expected = reference_path(pd.read_csv(tmp_path / QTABLE_CSV), grid, start)
+    assert len(expected) > 1
+    assert PolicyIndex.from_npz(str(tmp_path / QTABLE_NPZ)).greedy_path(grid, start) == expected
+    assert PolicyIndex.from_csv(str(tmp_path / QTABLE_CSV)).greedy_path(grid, start) == expected
+
+
+def test_random_tables_with_ties_and_gaps():
+    """整數 Q 值製造平手，部分格子沒有 Q 值；從每個非障礙格出發的路徑都與原本的做法相同"""
+    rng = np.random.default_rng(0)
+    for seed in range(5):
+        grid, _, _ = generate_grid(12, 15, obstacle_density=0.3, bonuses=3, traps=3, seed=seed)
+        grid = grid.tolist()
+        rows = [(f'{i},{j}', action, float(rng.integers(-3, 3)))
+                for i, row in enumerate(grid) for j, cell in enumerate(row)
+                if cell != OBSTACLE and rng.random() < 0.9 for action in ACTIONS if rng.random() < 0.8]
+        df = pd.DataFrame(rows, columns=['state', 'action', 'value'])
+        index = PolicyIndex.from_frame(df)
+        for i, row in enumerate(grid):
+            for j, cell in enumerate(row):
+                if cell != OBSTACLE:
+                    assert index.greedy_path(grid, (i, j)) == reference_path(df, grid, (i, j)), (seed, i, j)
+
+
+def test_policy_index_cache_follows_source_file(tmp_path):
+    job_dir = str(tmp_path)
+    assert load_policy_index(job_dir) is None
+    path = os.path.join(job_dir, QTABLE_CSV)
+    pd.DataFrame({'state': ['0,0', '0,0'], 'action': ['down', 'right'], 'value': [1.0, 2.0]}).to_csv(path, index=False)
+    first = load_policy_index(job_dir)
+    assert first.greedy[0, 0] == ACTIONS.index('right')
+    assert load_policy_index(job_dir) is first
+    pd.DataFrame({'state': ['0,0', '0,0'], 'action': ['down', 'right'], 'value': [3.0, 2.0]}).to_csv(path, index=False)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert load_policy_index(job_dir).greedy[0, 0] == ACTIONS.index('down')
@@ -0,0 +1,41 @@
+import json
+import sys
+import tracemalloc
+
+import pytest
+
+import q_learning
+import sarsa
+from profiler import PROFILE_JSON, PROFILE_DUMP
+
+
+def train(module, output_dir, map_grid, **kwargs):
+    return module.main(None, 200, 0.1, 0.95, 1.0, str(output_dir), seed=1, map_grid=map_grid,
+                       profile=True, profile_memory=True, profile_dump=True, **kwargs)
+
+
+@pytest.mark.parametrize('module', [q_learning, sarsa])
+def test_profile_report(tmp_path, map_grid, module):
+    train(module, tmp_path, map_grid)
+    with open(tmp_path / PROFILE_JSON, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    assert {'setup', 'select', 'env_step', 'logging', 'output'} <= set(report['phases'])
+    assert report['episodes'] == 200
+    assert report['tracemalloc_peak_bytes'] > 0
+    assert 'process_peak_rss_mb' in report
+    assert (tmp_path / PROFILE_DUMP).exists()
+    assert not tracemalloc.is_tracing()
+    assert sys.getprofile() is None
+
+
+def test_failed_training_stops_profiler(tmp_path, map_grid):
+    """訓練失敗時也停止 tracemalloc 與 cProfile，不留在常駐訓練行程中"""
+    def fail(event):
+        if event['episode'] >= 100:
+            raise RuntimeError('中斷')
+
+    with pytest.raises(RuntimeError):
+        train(q_learning, tmp_path, map_grid, progress=fail)
+    assert not tracemalloc.is_tracing()
+    assert sys.getprofile() is None
+    assert not (tmp_path / PROFILE_JSON).exists()
@@ -0,0 +1,50 @@
+import numpy as np
+
+from artifacts import replicate_curves, EPISODE_DTYPES, EPISODES_NPZ, REPLICATES_DIR
+
+
+def write_summary(run_dir, total_reward, success):
+    run_dir.mkdir(parents=True, exist_ok=True)
+    n = len(total_reward)
+    columns = {name: np.zeros(n, dtype=dtype) for name, dtype in EPISODE_DTYPES.items()}
+    columns['episode'][:] = np.arange(1, n + 1)
+    columns['total_reward'][:] = total_reward
+    columns['success'][:] = success
+    np.savez(run_dir / EPISODES_NPZ, **columns)
+
+
+def test_single_run_has_no_curves(tmp_path):
+    write_summary(tmp_path, [1, 2, 3], [True, False, True])
+    assert replicate_curves(str(tmp_path)) is None
+
+
+def test_curves_on_known_inputs(tmp_path):
+    # 5 份、每份 4 回合：第 k 份的總獎勵為 10k + 回合編號，第 k 份只在 k 為偶數的回合成功
+    for k in range(5):
+        run_dir = tmp_path if k == 0 else tmp_path / REPLICATES_DIR / str(k)
+        write_summary(run_dir, [10 * k + episode for episode in range(1, 5)], [k % 2 == 0] * 4)
+    curves = replicate_curves(str(tmp_path), percentiles=(5, 50, 95), window=2)
+    assert curves['replicates'] == 5
+    assert curves['episodes'] == [1, 2, 3, 4]
+    # 各回合跨份的值為 {0, 10, 20, 30, 40} + 回合編號；線性內插的百分位數
+    base = np.arange(1, 5)
+    np.testing.assert_allclose(curves['reward']['mean'], 20 + base)
+    np.testing.assert_allclose(curves['reward']['p50'], 20 + base)
+    np.testing.assert_allclose(curves['reward']['p5'], 2 + base)
+    np.testing.assert_allclose(curves['reward']['p95'], 38 + base)
+    # 3 份全部成功、2 份全部失敗：每回合成功率平均 0.6，中位數 1
+    np.testing.assert_allclose(curves['success']['mean'], [0.6] * 4)
+    np.testing.assert_allclose(curves['success']['p50'], [1.0] * 4)
+    np.testing.assert_allclose(curves['success']['p5'], [0.0] * 4)
+
+
+def test_rolling_success_and_unequal_lengths(tmp_path):
+    # 第 0 份 4 回合（成功、失敗、成功、成功），第 1 份提前停止只有 2 回合（失敗、成功）
+    write_summary(tmp_path, [0, 0, 0, 0], [True, False, True, True])
+    write_summary(tmp_path / REPLICATES_DIR / '1', [4, 8], [False, True])
+    curves = replicate_curves(str(tmp_path), percentiles=(50,), window=2)
+    assert curves['episodes'] == [1, 2, 3, 4]
+    # 移動視窗 2：第 0 份 [1, 0.5, 0.5, 1]，第 1 份 [0, 0.5]，之後的回合只由第 0 份計算
+    np.testing.assert_allclose(curves['success']['mean'], [0.5, 0.5, 0.5, 1.0])
+    np.testing.assert_allclose(curves['reward']['mean'], [2, 4, 0, 0])
+    np.testing.assert_allclose(curves['reward']['p50'], [2, 4, 0, 0])
@@ -0,0 +1,22 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from artifacts import training_result
+from sweep import rank_key
+
+
+def test_final_success_rate_uses_last_100_episodes():
+    success = np.arange(300) >= 200  # 前 200 回合失敗，最後 100 回合全部成功
+    episode_log = SimpleNamespace(columns={'success': success}, size=300, start=time.perf_counter())
+    result = training_result('q_learning', [0] * 300, episode_log)
+    assert result['success_rate'] == 1 / 3
+    assert result['final_success_rate'] == 1.0
+
+
+def test_leaderboard_ranks_on_final_success_rate():
+    slow = {'run': 0, 'success_rate': 0.4, 'final_success_rate': 1.0, 'final_avg_reward': 80.0}
+    fast = {'run': 1, 'success_rate': 0.8, 'final_success_rate': 0.9, 'final_avg_reward': 90.0}
+    tied = {'run': 2, 'success_rate': 0.5, 'final_success_rate': 1.0, 'final_avg_reward': 85.0}
+    assert [entry['run'] for entry in sorted([fast, slow, tied], key=rank_key)] == [2, 0, 1]
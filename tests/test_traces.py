@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sarsa
+from traces import make_traces, trace_window, PRUNE_EVERY, TRACE_CUTOFF
+
+SHAPE = (30, 4)
+DECAY = 0.95 * 0.9
+
+
+def random_episodes(seed, episodes=5, steps=400):
+    """隨機產生每回合的 (扁平索引, 步長) 序列；索引範圍小，會反覆走回相同配對"""
+    rng = np.random.default_rng(seed)
+    return [list(zip(rng.integers(0, SHAPE[0] * SHAPE[1], steps).tolist(), rng.normal(0, 0.5, steps).tolist()))
+            for _ in range(episodes)]
+
+
+def reference_q(episodes, replacing):
+    """原始的逐項更新：資格跡存在 dict，每步走訪所有項目更新 Q 並衰減"""
+    q = np.zeros(SHAPE).reshape(-1)
+    for episode in episodes:
+        traces = {}
+        for key, step_size in episode:
+            traces[key] = 1.0 if replacing else traces.get(key, 0.0) + 1.0
+            for k, trace in traces.items():
+                if trace > 0:
+                    q[k] = q[k] + step_size * trace
+                    traces[k] = DECAY * trace
+    return q
+
+
+def traced_q(episodes, engine, mode, cutoff=TRACE_CUTOFF):
+    q = np.zeros(SHAPE).reshape(-1)
+    traces = make_traces(engine, SHAPE, DECAY, mode, cutoff)
+    for episode in episodes:
+        traces.reset()
+        for key, step_size in episode:
+            traces.visit(key)
+            traces.apply(q, step_size)
+    return q
+
+
+@pytest.mark.parametrize('mode', ['accumulating', 'replacing'])
+def test_traces_match_per_entry_loop(mode):
+    episodes = random_episodes(3)
+    expected = reference_q(episodes, mode == 'replacing')
+    # 不剪枝時稀疏與稠密資格跡都與逐項更新逐位元相同
+    assert np.array_equal(traced_q(episodes, 'dense', mode), expected)
+    assert np.array_equal(traced_q(episodes, 'sparse', mode, cutoff=0.0), expected)
+    # 預設門檻接近機器精度，移除的項目只影響捨入誤差
+    np.testing.assert_allclose(traced_q(episodes, 'sparse', mode), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_sparse_active_set_stays_bounded():
+    traces = make_traces('sparse', (5000, 4), DECAY)
+    for key in range(5000):
+        traces.visit(key * 4)
+        traces.apply(np.zeros(5000 * 4), 0.1)
+    assert traces.size <= trace_window(DECAY, TRACE_CUTOFF) + PRUNE_EVERY
+    # 活躍集合之外的格位索引都已清除
+    assert np.count_nonzero(traces.slot >= 0) == traces.size
+    traces.reset()
+    assert traces.size == 0 and not (traces.slot >= 0).any()
+
+
+def test_sparse_training_matches_dense(tmp_path, map_grid):
+    for engine in ('sparse', 'dense'):
+        sarsa.main(None, 200, 0.1, 0.95, 1.0, str(tmp_path / engine), seed=5, map_grid=map_grid, trace_engine=engine)
+    sparse = np.load(tmp_path / 'sparse' / 'q_table.npz')['values']
+    dense = np.load(tmp_path / 'dense' / 'q_table.npz')['values']
+    np.testing.assert_allclose(sparse, dense, rtol=1e-12, atol=1e-12)
+    expected = pd.read_csv(tmp_path / 'dense' / 'episodes.csv').drop(columns='elapsed')
+    actual = pd.read_csv(tmp_path / 'sparse' / 'episodes.csv').drop(columns='elapsed')
+    pd.testing.assert_frame_equal(actual, expected)
@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import train_api
+from job_scheduler import EventChannel
+
+
+class FakeScheduler:
+    def __init__(self, channels):
+        self.channels = channels
+
+    def channel(self, job_id):
+        return self.channels.get(job_id)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_api, 'JOBS_DIR', str(tmp_path))
+    monkeypatch.setattr(train_api, 'EVENT_POLL_INTERVAL', 0.01)
+    return TestClient(train_api.app)
+
+
+def make_job(tmp_path, job_id, status='running'):
+    (tmp_path / job_id).mkdir()
+    (tmp_path / job_id / 'status.json').write_text(json.dumps({'status': status}), encoding='utf-8')
+
+
+def read_events(response):
+    """解析 SSE 訊息為 (id, event, data) 串列"""
+    events = []
+    for block in response.text.split('\n\n'):
+        if not block:
+            continue
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_stream_forwards_events_until_job_finishes(tmp_path, client, monkeypatch):
+    make_job(tmp_path, 'job')
+    channel = EventChannel()
+    channel.publish('status', {'status': 'running'})
+    monkeypatch.setattr(train_api, 'get_scheduler', lambda: FakeScheduler({'job': channel}))
+
+    def train():
+        # 串流開始後才發布的進度與結束狀態也會送出
+        time.sleep(0.1)
+        for episode in (50, 100):
+            channel.publish('progress', {'episode': episode})
+        channel.publish('status', {'status': 'completed'})
+        channel.closed = True
+
+    thread = threading.Thread(target=train)
+    thread.start()
+    response = client.get('/train/job/events')
+    thread.join()
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert read_events(response) == [
+        (1, 'status', {'status': 'running'}),
+        (2, 'progress', {'episode': 50}),
+        (3, 'progress', {'episode': 100}),
+        (4, 'status', {'status': 'completed'}),
+    ]
+
+    # 斷線重連時依 Last-Event-ID 只送出之後的事件
+    response = client.get('/train/job/events', headers={'Last-Event-ID': '2'})
+    assert [event[0] for event in read_events(response)] == [3, 4]
+
+
+def test_stream_without_channel_sends_current_status(tmp_path, client, monkeypatch):
+    make_job(tmp_path, 'old', status='completed')
+    monkeypatch.setattr(train_api, 'get_scheduler', lambda: FakeScheduler({}))
+    assert read_events(client.get('/train/old/events')) == [(0, 'status', {'status': 'completed'})]
+    assert client.get('/train/missing/events').status_code == 404
+
+
+def test_channel_keeps_only_recent_events():
+    channel = EventChannel(maxlen=3)
+    for episode in range(1, 6):
+        channel.publish('progress', {'episode': episode})
+    assert [seq for seq, _, _ in channel.since(0)] == [3, 4, 5]
+    assert [seq for seq, _, _ in channel.since(4)] == [5]
+    assert channel.since(5) == []
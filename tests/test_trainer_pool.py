@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from trainer_pool import TrainerPool, TrainingError, TrainingCancelled
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = TrainerPool(1)
+    yield pool
+    pool.close()
+
+
+def train_kwargs(output_dir, map_grid, episodes=100):
+    return {'map_path': None, 'episodes': episodes, 'learning_rate': 0.1, 'discount_factor': 0.95,
+            'epsilon_start': 1.0, 'output_dir': str(output_dir), 'seed': 1, 'map_grid': map_grid}
+
+
+def worker_pid(pool):
+    return pool._idle.queue[0][0].pid
+
+
+def test_workers_stay_warm_between_jobs(pool, tmp_path, map_grid):
+    pid = worker_pid(pool)
+    events = []
+    result = pool.run('q_learning', train_kwargs(tmp_path / 'a', map_grid), 'a', events.append)
+    assert result['episodes'] == 100
+    assert events and events[-1]['episode'] == 100
+    assert (tmp_path / 'a' / 'train.log').exists()  # 訓練輸出導向工作目錄
+    pool.run('sarsa', train_kwargs(tmp_path / 'b', map_grid), 'b')
+    assert worker_pid(pool) == pid
+
+
+def test_failed_job_keeps_worker(pool, tmp_path, map_grid):
+    pid = worker_pid(pool)
+    with pytest.raises(TrainingError, match='ValueError'):  # 沒有起點的地圖，附帶工作行程中的 traceback
+        pool.run('q_learning', train_kwargs(tmp_path, [['0', 'G']]), 'bad')
+    assert worker_pid(pool) == pid
+
+
+def test_cancel_running_and_pending_jobs(pool, tmp_path, map_grid):
+    started = threading.Event()
+    outcome = []
+
+    def run():
+        try:
+            pool.run('q_learning', train_kwargs(tmp_path / 'long', map_grid, episodes=10 ** 6), 'long',
+                     lambda event: started.set())
+        except TrainingCancelled:
+            outcome.append('cancelled')
+
+    pid = worker_pid(pool)
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(30)
+    pool.cancel('long')
+    thread.join(30)
+    assert outcome == ['cancelled']
+    assert worker_pid(pool) != pid  # 被終止的行程換成新的
+
+    # 尚未開始就取消的工作不會執行
+    pool.cancel('pending')
+    with pytest.raises(TrainingCancelled):
+        pool.run('q_learning', train_kwargs(tmp_path / 'pending', map_grid), 'pending')
+    assert not (tmp_path / 'pending').exists()
+    result = pool.run('q_learning', train_kwargs(tmp_path / 'after', map_grid), 'after')
+    assert result['episodes'] == 100
@@ -0,0 +1,258 @@
+"""訓練效能基準測試
+
+    python tools/benchmark.py run [--maps sample,50,100] [--algorithms q_learning,sarsa] [--repeat 3] [--output benchmark.json]
+    python tools/benchmark.py compare baseline.json benchmark.json [--threshold 0.1]
+
+run 以固定種子與回合數在固定的地圖組（6×6 範例地圖到 500×500 的生成地圖）上執行各訓練器，
+每個案例在獨立行程中執行以量測峰值記憶體，重複 repeat 次取計時指標的中位數，結果寫入 JSON；compare 將結果與基準比較，
+任一指標退步超過門檻時以非零狀態碼結束。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+SAMPLE_MAP = os.path.join(ROOT, 'maps', '3cca661b-6fd1-4bce-9d36-e6941304498a.json')
+SEED = 7
+MAP_SEED = 2024  # 生成地圖用的固定種子
+# 地圖組：名稱 -> (邊長，None 為範例地圖), 回合數, maxSteps
+BENCH_MAPS = {
+    'sample': (None, 2000, 100),
+    '50': (50, 200, 400),
+    '100': (100, 100, 800),
+    '250': (250, 40, 2000),
+    '500': (500, 20, 4000),
+}
+ALGORITHMS = ['q_learning', 'sarsa']
+TRAINERS = ['q_learning', 'sarsa', 'dyna_q']
+REGRESSION_THRESHOLD = 0.1  # 預設容許 10% 的退步
+REPEAT = 3
+TIMED_FIELDS = ('wall_time', 'train_time', 'steps_per_sec', 'episodes_per_sec', 'time_to_first_success')  # 取中位數的欄位
+# 指標 -> 是否越大越好
+METRICS = {
+    'steps_per_sec': True,
+    'episodes_per_sec': True,
+    'peak_rss_mb': False,
+    'output_bytes': False,
+    'time_to_first_success': False,
+}
+
+
+def bench_map(size, seed=MAP_SEED):
+    """以固定種子生成 size × size 的地圖：約 10% 障礙、少量獎勵格與陷阱，起點在左上、目標在右下
+
+    地圖須與既有的基準結果一致，因此不改用 map_gen，而是以 BFS 確認目標可到達，不可到達時直接報錯。
+    """
+    from grid_env import reachable_mask
+    rng = np.random.default_rng(seed + size)
+    roll = rng.random((size, size))
+    grid = np.full((size, size), '0', dtype='<U1')
+    grid[roll < 0.10] = '1'
+    grid[(roll >= 0.10) & (roll < 0.105)] = 'R'
+    grid[(roll >= 0.105) & (roll < 0.11)] = 'T'
+    grid[:2, :2] = '0'
+    grid[-2:, -2:] = '0'
+    grid[0, 0] = 'S'
+    grid[-1, -1] = 'G'
+    passable = grid != '1'
+    if not reachable_mask(passable, (0, 0), passable & (grid != 'T') & (grid != 'G'))[-1, -1]:
+        raise RuntimeError(f'基準地圖 {size}×{size} 無法從起點到達目標')
+    return grid
+
+
+def load_bench_map(name):
+    size = BENCH_MAPS[name][0]
+    if size is None:
+        from map_codec import load_map_grid
+        with open(SAMPLE_MAP, 'r', encoding='utf-8') as f:
+            return load_map_grid(json.load(f))
+    return bench_map(size)
+
+
+def dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def run_case(algorithm, map_name, conn):
+    """在獨立行程中執行一個案例，經 Pipe 回傳各項指標"""
+    from contextlib import redirect_stdout
+    from profiler import peak_rss_mb
+    from grid_env import DEFAULT_RULE
+    import q_learning
+    import sarsa
+    import dyna_q
+    trainers = {'q_learning': q_learning.main, 'sarsa': sarsa.main, 'dyna_q': dyna_q.main}
+    _, episodes, max_steps = BENCH_MAPS[map_name]
+    map_grid = load_bench_map(map_name)
+    rule_data = dict(DEFAULT_RULE, maxSteps=max_steps)
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = trainers[algorithm](None, episodes, 0.1, 0.95, 1.0, output_dir, seed=SEED, rule_data=rule_data,
+                                         map_grid=map_grid, checkpoint_every=0)
+        wall = time.perf_counter() - start
+        with np.load(os.path.join(output_dir, 'episodes.npz')) as summary:
+            steps = summary['steps']
+            success = summary['success']
+            elapsed = summary['elapsed']
+        output_bytes = dir_bytes(output_dir)
+    first = int(np.argmax(success)) if success.any() else None
+    train_time = max(result['elapsed'], 1e-9)
+    conn.send({
+        'algorithm': algorithm,
+        'map': map_name,
+        'size': list(map_grid.shape),
+        'episodes': len(steps),
+        'steps': int(steps.sum()),
+        'wall_time': round(wall, 3),
+        'train_time': round(train_time, 3),
+        'steps_per_sec': round(float(steps.sum()) / train_time, 1),
+        'episodes_per_sec': round(len(steps) / train_time, 2),
+        'peak_rss_mb': peak_rss_mb(),
+        'output_bytes': output_bytes,
+        'first_success_episode': None if first is None else first + 1,
+        'time_to_first_success': None if first is None else round(float(elapsed[first]), 4),
+        'success_rate': round(float(success.mean()), 4),
+    })
+    conn.close()
+
+
+def spawn_case(ctx, algorithm, map_name):
+    """在新行程中執行一次案例；行程異常結束時回傳錯誤"""
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=run_case, args=(algorithm, map_name, child))
+    process.start()
+    child.close()
+    try:
+        metrics = parent.recv()
+    except EOFError:
+        metrics = {'algorithm': algorithm, 'map': map_name, 'error': f'exit code {process.exitcode}'}
+    process.join()
+    return metrics
+
+
+def median_metrics(runs):
+    """合併重複執行的結果：計時欄位取中位數，其餘欄位（固定種子下不變）取第一次"""
+    metrics = dict(runs[0], repeat=len(runs))
+    for name in TIMED_FIELDS:
+        values = [run[name] for run in runs if run[name] is not None]
+        metrics[name] = float(np.median(values)) if len(values) == len(runs) else None
+    return metrics
+
+
+def run(map_names, algorithms, output, repeat=REPEAT):
+    ctx = multiprocessing.get_context('spawn')
+    cases = {}
+    for map_name in map_names:
+        for algorithm in algorithms:
+            case = f'{algorithm}/{map_name}'
+            print(f'執行 {case} ...', end=' ', flush=True)
+            runs = [spawn_case(ctx, algorithm, map_name) for _ in range(max(1, repeat))]
+            failed = next((metrics for metrics in runs if 'error' in metrics), None)
+            if failed is not None:
+                print(f"失敗（{failed['error']}）")
+                cases[case] = failed
+                continue
+            metrics = cases[case] = median_metrics(runs)
+            print(f"{metrics['steps_per_sec']:.0f} 步/秒, {metrics['episodes_per_sec']:.1f} 回合/秒, "
+                  f"{metrics['peak_rss_mb']} MB, 首次成功 {metrics['time_to_first_success']}")
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'seed': SEED,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'cases': cases,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'結果已寫入 {output}')
+    return report
+
+
+def compare_metric(name, baseline, current, threshold):
+    """回傳相對變化（正值為進步）與是否退步；任一方缺值時回傳 None"""
+    if baseline is None or current is None:
+        # 原本成功、現在不再成功視為退步
+        if name == 'time_to_first_success' and baseline is not None:
+            return None, True
+        return None, False
+    if baseline == 0:
+        return None, False
+    change = (current - baseline) / baseline
+    if not METRICS[name]:
+        change = -change
+    return change, change < -threshold
+
+
+def compare(baseline_path, current_path, threshold=REGRESSION_THRESHOLD):
+    """比較兩份結果，列出各案例的指標變化，回傳退步的 (案例, 指標) 串列"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['cases']
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)['cases']
+    regressions = []
+    for case in sorted(set(baseline) & set(current)):
+        old, new = baseline[case], current[case]
+        if 'error' in old or 'error' in new:
+            print(f'{case}: 無法比較（{new.get("error") or old.get("error")}）')
+            if 'error' in new and 'error' not in old:
+                regressions.append((case, 'error'))
+            continue
+        print(case)
+        for name in METRICS:
+            change, regressed = compare_metric(name, old.get(name), new.get(name), threshold)
+            delta = '—' if change is None else f'{change:+.1%}'
+            mark = '  ← 退步' if regressed else ''
+            print(f'  {name:<22} {old.get(name)!s:>12} → {new.get(name)!s:<12} {delta}{mark}')
+            if regressed:
+                regressions.append((case, name))
+    for case in sorted(set(baseline) - set(current)):
+        print(f'{case}: 本次未執行')
+    for case in sorted(set(current) - set(baseline)):
+        print(f'{case}: 基準中沒有此案例')
+    if regressions:
+        print(f'\n{len(regressions)} 項指標退步超過 {threshold:.0%}')
+    else:
+        print(f'\n沒有指標退步超過 {threshold:.0%}')
+    return regressions
+
+
+def parse_list(value, choices, name):
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    unknown = [item for item in items if item not in choices]
+    if unknown:
+        raise SystemExit(f'未知的{name}: {unknown}（可用：{list(choices)}）')
+    return items
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='訓練效能基準測試')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='執行基準測試並寫入 JSON')
+    run_parser.add_argument('--maps', type=str, default=','.join(BENCH_MAPS), help='地圖組（以逗號分隔）')
+    run_parser.add_argument('--algorithms', type=str, default=','.join(ALGORITHMS), help='訓練器（以逗號分隔）')
+    run_parser.add_argument('--repeat', type=int, default=REPEAT, help='每個案例的重複次數（計時指標取中位數）')
+    run_parser.add_argument('--output', type=str, default='benchmark.json', help='結果檔路徑')
+    compare_parser = commands.add_parser('compare', help='與基準結果比較')
+    compare_parser.add_argument('baseline', type=str, help='基準結果檔')
+    compare_parser.add_argument('current', type=str, help='本次結果檔')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='容許的退步比例')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(parse_list(args.maps, BENCH_MAPS, '地圖'), parse_list(args.algorithms, TRAINERS, '訓練器'), args.output, args.repeat)
+    else:
+        sys.exit(1 if compare(args.baseline, args.current, args.threshold) else 0)
@@ -0,0 +1,120 @@
+import math
+import numpy as np
+
+TRACE_ENGINES = ['sparse', 'dense']
+TRACE_MODES = ['accumulating', 'replacing']
+TRACE_CUTOFF = float(np.finfo(np.float64).eps)  # 稀疏資格跡權重低於此值即移出活躍集合；接近機器精度，對 Q 值的影響可忽略
+WINDOW_CUTOFF = 1e-4  # 多環境批次訓練的資格跡視窗門檻（批次訓練本身即為近似）
+PRUNE_EVERY = 32  # 稀疏資格跡每隔多少步才檢查並移除低於 cutoff 的項目（攤銷壓實成本）
+
+
+def trace_window(decay, cutoff=WINDOW_CUTOFF):
+    """資格跡從 1 衰減到 cutoff 以下前需要保留的步數"""
+    if decay <= 0:
+        return 1
+    if decay >= 1 or cutoff <= 0:
+        return math.inf
+    return 1 + int(math.log(cutoff) / math.log(decay))
+
+
+class DenseTraces:
+    """稠密資格跡：與 Q-Table 同形狀的陣列，每步一次向量化乘加
+
+    每步成本與狀態數成正比，不會因回合變長而增加。
+    """
+
+    def __init__(self, shape, decay, replacing=False):
+        self.values = np.zeros(shape)
+        self.flat = self.values.reshape(-1)
+        self.decay = decay
+        self.replacing = replacing
+
+    def reset(self):
+        """回合開始時清空資格跡"""
+        self.values.fill(0.0)
+
+    def visit(self, key):
+        """記錄目前的 (狀態, 動作) 扁平索引"""
+        if self.replacing:
+            self.flat[key] = 1.0
+        else:
+            self.flat[key] += 1.0
+
+    def apply(self, flat_q, step_size):
+        """Q += step_size × 資格跡，接著整體衰減"""
+        flat_q += step_size * self.flat
+        self.flat *= self.decay
+
+
+class SparseTraces:
+    """稀疏資格跡：只保留權重不低於 cutoff 的活躍項目
+
+    每步成本與活躍項目數成正比。預設 cutoff 接近機器精度，只保留約 log(cutoff) / log(γλ) 步內
+    走過的配對，長回合的活躍集合不會隨回合長度增加；被移除項目對 Q 值的貢獻小於浮點捨入誤差。
+    cutoff 為 0 時不剪枝，結果與稠密資格跡逐位元相同。
+
+    活躍項目存於預先配置的 keys / values 陣列前 size 格，slot 記錄每個扁平索引所在的格位
+    （-1 表示不在活躍集合），visit 為常數時間查找；剪枝每 PRUNE_EVERY 步做一次。
+    """
+
+    def __init__(self, shape, decay, replacing=False, cutoff=TRACE_CUTOFF):
+        self.decay = decay
+        self.replacing = replacing
+        self.cutoff = cutoff
+        self.slot = np.full(int(np.prod(shape)), -1, dtype=np.int64)
+        self.keys = np.empty(64, dtype=np.int64)
+        self.values = np.empty(64)
+        self.size = 0
+        self.steps = 0
+
+    def reset(self):
+        """回合開始時清空資格跡"""
+        self.slot[self.keys[:self.size]] = -1
+        self.size = 0
+        self.steps = 0
+
+    def visit(self, key):
+        """記錄目前的 (狀態, 動作) 扁平索引"""
+        index = self.slot[key]
+        if index >= 0:
+            self.values[index] = 1.0 if self.replacing else self.values[index] + 1.0
+            return
+        if self.size == self.keys.size:
+            # 容量不足時加倍，攤銷後每次新增為常數時間
+            self.keys = np.concatenate([self.keys, np.empty_like(self.keys)])
+            self.values = np.concatenate([self.values, np.empty_like(self.values)])
+        self.keys[self.size] = key
+        self.values[self.size] = 1.0
+        self.slot[key] = self.size
+        self.size += 1
+
+    def apply(self, flat_q, step_size):
+        """Q += step_size × 資格跡，接著衰減並移除低於 cutoff 的項目"""
+        keys = self.keys[:self.size]
+        values = self.values[:self.size]
+        flat_q[keys] += step_size * values
+        values *= self.decay
+        self.steps += 1
+        if self.steps % PRUNE_EVERY:
+            return
+        keep = values > self.cutoff
+        if not keep.all():
+            # 壓實活躍項目（保持原本順序）並更新格位索引
+            self.slot[keys[~keep]] = -1
+            size = int(np.count_nonzero(keep))
+            keys[:size] = keys[keep]
+            values[:size] = values[keep]
+            self.slot[keys[:size]] = np.arange(size)
+            self.size = size
+
+
+def make_traces(engine, shape, decay, mode='accumulating', cutoff=TRACE_CUTOFF):
+    """依設定建立資格跡引擎"""
+    if engine not in TRACE_ENGINES:
+        raise ValueError(f'不支援的資格跡引擎: {engine}')
+    if mode not in TRACE_MODES:
+        raise ValueError(f'不支援的資格跡模式: {mode}')
+    replacing = mode == 'replacing'
+    if engine == 'dense':
+        return DenseTraces(shape, decay, replacing)
+    return SparseTraces(shape, decay, replacing, cutoff)
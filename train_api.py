@@ -1,21 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
 import json
 import uuid
+import asyncio
 import shutil
-from typing import Optional, List
-import subprocess
+from typing import Optional, List, Dict, Any, Literal
+from pydantic import ValidationError
+from job_scheduler import get_scheduler
+from checkpoint import CHECKPOINT_NPZ
+from grid_env import load_env_rule
+from artifacts import replicate_dir, replicate_dirs
+from map_codec import load_map_grid
+from sweep import expand_sweep, split_params, start_sweep, get_sweep, LEADERBOARD_JSON, SWEEP_JSON
 from datetime import datetime
 
 app = FastAPI()
 JOBS_DIR = 'jobs'
 MAPS_DIR = 'maps'
+EVENT_POLL_INTERVAL = 0.2  # 事件串流檢查新事件的間隔（秒）
 os.makedirs(JOBS_DIR, exist_ok=True)
+Algorithm = Literal['q_learning', 'sarsa', 'dyna_q']  # 其他名稱在驗證時即回應 422
+TraceEngine = Literal['sparse', 'dense']
+TraceMode = Literal['accumulating', 'replacing']
+LogLevel = Literal['full', 'episode', 'every_k', 'last_m']
+Engine = Literal['numpy', 'jit']
 
 class TrainRequest(BaseModel):
     map_id: str
-    algorithm: str  # 'q_learning' or 'sarsa'
+    algorithm: Algorithm
     episodes: int = 500
     learning_rate: float = 0.1
     discount_factor: float = 0.95
@@ -25,18 +39,119 @@ class TrainRequest(BaseModel):
     optimistic: bool = False  # 新增樂觀初始化參數
     lambda_param: Optional[float] = None  # 新增 SARSA(λ) 的 λ 參數
     rule_id: Optional[str] = None # 新增規則 ID 參數
+    num_envs: int = 1  # 同步執行的環境數（大於 1 時使用批次訓練）
+    trace_engine: Optional[TraceEngine] = None  # SARSA(λ) 資格跡引擎：'sparse'（預設）或 'dense'；num_envs > 1 時不適用
+    trace_mode: TraceMode = 'accumulating'  # SARSA(λ) 資格跡模式：'accumulating' 或 'replacing'
+    log_level: LogLevel = 'full'  # 訓練記錄粒度：'full'、'episode'、'every_k' 或 'last_m'
+    log_every: int = 10  # every_k 層級：每第 k 回合記錄逐步資料
+    log_last: int = 100  # last_m 層級：只記錄最後 m 回合的逐步資料
+    checkpoint_every: int = 1000  # 每多少回合寫一次 checkpoint（0 表示不寫）
+    replicates: int = 1  # 重複實驗份數：以同一種子衍生 K 個獨立亂數串流平行訓練
+    stop_delta_q: Optional[float] = None  # 提前停止：連續 stop_patience 回合 max|ΔQ| 低於此值
+    stop_policy: bool = False  # 提前停止：貪婪策略連續 stop_patience 回合未改變
+    stop_success: Optional[float] = None  # 提前停止：相鄰兩個視窗的成功率相差不超過此值
+    stop_patience: int = 100  # 提前停止條件需持續成立的回合數
+    stop_min_episodes: int = 0  # 至少訓練多少回合才允許提前停止
+    engine: Engine = 'numpy'  # 逐回合訓練引擎：'numpy' 或 'jit'（需安裝 numba，否則改用 numpy）
+    planning_steps: int = 10  # Dyna-Q：每個真實步驟後的規劃更新次數
+    priority_threshold: float = 1e-4  # Dyna-Q：|TD 誤差| 超過此值才放入優先權佇列
+    profile: bool = False  # 記錄各階段累計時間與行程 RSS 峰值至 profile.json
+    profile_memory: bool = False  # profile 時另以 tracemalloc 量測記憶體峰值（計時會明顯變慢）
+    profile_dump: bool = False  # profile 時另存 cProfile 結果至 profile.prof
 
 class JobInfo(BaseModel):
     job_id: str
     job_name: str
     created_at: str
 
-@app.post('/train')
-def start_train(req: TrainRequest):
-    # 檢查地圖是否存在
-    map_path = os.path.join(MAPS_DIR, f'{req.map_id}.json')
-    if not os.path.exists(map_path):
-        raise HTTPException(status_code=404, detail='Map not found')
+class ContinueRequest(BaseModel):
+    episodes: int = 500  # 追加訓練的回合數
+    job_name: Optional[str] = None  # 預設為原工作名稱加上「(續)」
+    seed: Optional[int] = None
+
+class SweepRequest(BaseModel):
+    map_id: str
+    algorithm: Algorithm
+    name: str = ''
+    base: Dict[str, Any] = {}  # 各組共用的 TrainRequest 欄位（如 episodes、seed）
+    grid: Dict[str, List[Any]] = {}  # 網格搜尋：欄位 -> 候選值；規則欄位寫成 'rule.stepDecay'
+    random: Dict[str, Any] = {}  # 隨機搜尋：欄位 -> {'low', 'high', 'log', 'int'} 或候選值串列
+    samples: Optional[int] = None  # 隨機搜尋的組數（未指定時為網格搜尋）
+    search_seed: Optional[int] = None  # 隨機搜尋抽樣用的種子
+    rule_id: Optional[str] = None  # 基礎規則（規則欄位覆寫於其上）
+    workers: Optional[int] = None  # 同時執行的組合數（預設與訓練行程池相同，不超過 TRAIN_WORKERS）
+
+SWEEP_FIXED_FIELDS = ('map_id', 'algorithm', 'job_name', 'rule_id', 'replicates')  # 不可作為搜尋欄位
+SWEEP_LOG_LEVEL = 'episode'  # 搜尋只需要每回合摘要，預設不寫逐步資料
+
+def build_train_kwargs(req, job_dir, rule=None):
+    """由訓練設定組成 q_learning.main / sarsa.main / dyna_q.main 的參數（地圖內容直接傳入，工作行程依雜湊快取編譯結果）
+
+    rule 為環境規則內容（見 grid_env.load_env_rule），未指定時訓練器使用預設規則。
+    """
+    map_path = os.path.join(job_dir, 'map.json')
+    with open(map_path, 'r', encoding='utf-8') as f:
+        map_grid = load_map_grid(json.load(f))
+    kwargs = {
+        'map_path': map_path,
+        'episodes': req.episodes,
+        'learning_rate': req.learning_rate,
+        'discount_factor': req.discount_factor,
+        'epsilon_start': req.epsilon,
+        'output_dir': job_dir,
+        'seed': req.seed,
+        'optimistic': req.optimistic,
+        'num_envs': req.num_envs,
+        'log_level': req.log_level,
+        'log_every': req.log_every,
+        'log_last': req.log_last,
+        'checkpoint_every': req.checkpoint_every,
+        'stop_delta_q': req.stop_delta_q,
+        'stop_policy': req.stop_policy,
+        'stop_success': req.stop_success,
+        'stop_patience': req.stop_patience,
+        'stop_min_episodes': req.stop_min_episodes,
+        'engine': req.engine,
+        'profile': req.profile,
+        'profile_memory': req.profile_memory,
+        'profile_dump': req.profile_dump,
+        'map_grid': map_grid,
+    }
+    if rule is not None:
+        kwargs['rule_data'] = rule
+    
+    # SARSA(λ) 的 λ 參數與資格跡引擎設定
+    if req.algorithm == 'sarsa':
+        kwargs.update(lambda_param=req.lambda_param, trace_engine=req.trace_engine, trace_mode=req.trace_mode)
+    # Dyna-Q 只有逐回合訓練，改傳規劃設定
+    if req.algorithm == 'dyna_q':
+        del kwargs['num_envs'], kwargs['engine']
+        kwargs.update(planning_steps=req.planning_steps, priority_threshold=req.priority_threshold)
+    return kwargs
+
+def replicate_kwargs(req, kwargs, job_dir):
+    """重複實驗時展開為各份的訓練參數（第 0 份寫在工作目錄，其餘寫在 replicates/NN）"""
+    if req.replicates <= 1:
+        return kwargs
+    return [{**kwargs, 'output_dir': replicate_dir(job_dir, i), 'replicate': i} for i in range(req.replicates)]
+
+def load_job_config(job_id):
+    config_path = os.path.join(JOBS_DIR, job_id, 'config.json')
+    if not os.path.exists(config_path):
+        raise HTTPException(status_code=404, detail='Job not found')
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def create_job(req, map_path, init_job_id=None, rule=None):
+    """建立工作目錄並交給排程器；init_job_id 指定時以該工作的 Q-Table 暖啟動
+
+    訓練使用的環境規則（rule，未指定時依 rule_id 讀取）記錄在 config.json 的 rule 欄位，供分析時重建環境。
+    """
+    if rule is None:
+        try:
+            rule = load_env_rule(req.rule_id)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail='Rule not found')
     job_id = str(uuid.uuid4())
     job_dir = os.path.join(JOBS_DIR, job_id)
     os.makedirs(job_dir, exist_ok=True)
@@ -44,6 +159,9 @@ def start_train(req: TrainRequest):
     config = req.dict()
     config['job_id'] = job_id
     config['created_at'] = datetime.now().isoformat()
+    config['rule'] = rule
+    if init_job_id:
+        config['init_job_id'] = init_job_id
     config_path = os.path.join(job_dir, 'config.json')
     with open(config_path, 'w', encoding='utf-8') as f:
         json.dump(config, f, ensure_ascii=False, indent=2)
@@ -55,41 +173,137 @@ def start_train(req: TrainRequest):
         rule_dst = os.path.join(job_dir, 'rule.json')
         if os.path.exists(rule_src):
             shutil.copyfile(rule_src, rule_dst)
-    # 啟動訓練腳本
-    algo_script = 'q_learning.py' if req.algorithm == 'q_learning' else 'sarsa.py'
-    cmd = [
-        'python', algo_script,
-        '--map', os.path.join(job_dir, 'map.json'),
-        '--episodes', str(req.episodes),
-        '--learning_rate', str(req.learning_rate),
-        '--discount_factor', str(req.discount_factor),
-        '--epsilon', str(req.epsilon),
-        '--output', job_dir
-    ]
-    
-    # 新增隨機種子參數
-    if req.seed is not None:
-        cmd.extend(['--seed', str(req.seed)])
-    
-    # 新增樂觀初始化參數
-    if req.optimistic:
-        cmd.append('--optimistic')
-    
-    # 新增 SARSA(λ) 的 λ 參數
-    if req.lambda_param is not None:
-        cmd.extend(['--lambda_param', str(req.lambda_param)])
+    kwargs = build_train_kwargs(req, job_dir, rule)
+    if init_job_id:
+        kwargs['init_q'] = os.path.join(JOBS_DIR, init_job_id)
+    kwargs = replicate_kwargs(req, kwargs, job_dir)
     
+    # 交給排程器，立即回傳（狀態：queued → running → completed / failed / cancelled）
+    status = get_scheduler().submit(job_id, job_dir, req.algorithm, kwargs)
+    return {'job_id': job_id, 'status': status}
+
+@app.post('/train')
+def start_train(req: TrainRequest):
+    # 檢查地圖是否存在
+    map_path = os.path.join(MAPS_DIR, f'{req.map_id}.json')
+    if not os.path.exists(map_path):
+        raise HTTPException(status_code=404, detail='Map not found')
+    if req.replicates < 1:
+        raise HTTPException(status_code=400, detail='replicates must be at least 1')
+    return create_job(req, map_path)
+
+@app.post('/train/sweep')
+def start_train_sweep(req: SweepRequest):
+    # 超參數搜尋：展開所有組合後以行程池平行訓練，排行榜隨每組完成更新
+    map_path = os.path.join(MAPS_DIR, f'{req.map_id}.json')
+    if not os.path.exists(map_path):
+        raise HTTPException(status_code=404, detail='Map not found')
+    try:
+        base_rule = load_env_rule(req.rule_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail='Rule not found')
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        status = 'completed'
-    except Exception as e:
-        status = 'failed'
-        with open(os.path.join(job_dir, 'error.log'), 'w', encoding='utf-8') as f:
-            f.write(str(e))
-    with open(os.path.join(job_dir, 'status.json'), 'w', encoding='utf-8') as f:
-        json.dump({'status': status}, f)
+        combos = expand_sweep(req.grid, req.random, req.samples, req.search_seed)
+        split = [split_params(params) for params in combos]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fields = set(req.base).union(*(train for train, _ in split))
+    invalid = sorted(fields.intersection(SWEEP_FIXED_FIELDS) | (fields - set(TrainRequest.model_fields)))
+    if invalid:
+        raise HTTPException(status_code=400, detail=f'Invalid sweep fields: {invalid}')
+
+    sweep_id = str(uuid.uuid4())
+    sweep_dir = os.path.join(JOBS_DIR, sweep_id)
+    os.makedirs(os.path.join(sweep_dir, 'runs'), exist_ok=True)
+    shutil.copy(map_path, os.path.join(sweep_dir, 'map.json'))
+    base = {'log_level': SWEEP_LOG_LEVEL, **req.base, 'checkpoint_every': 0}
+    runs = []
+    for i, (params, (train, rule)) in enumerate(zip(combos, split)):
+        try:
+            run_req = TrainRequest(map_id=req.map_id, algorithm=req.algorithm, job_name=f'{req.name} #{i}', **{**base, **train})
+        except ValidationError as e:
+            shutil.rmtree(sweep_dir, ignore_errors=True)
+            raise HTTPException(status_code=400, detail=f'Run {i}: {e.errors()[0]["msg"]}')
+        kwargs = build_train_kwargs(run_req, sweep_dir, {**base_rule, **rule})
+        kwargs['output_dir'] = os.path.join(sweep_dir, 'runs', f'{i:03d}')
+        # 各組的訓練設定與規則另存於其輸出目錄，分析時與一般工作相同
+        os.makedirs(kwargs['output_dir'], exist_ok=True)
+        with open(os.path.join(kwargs['output_dir'], 'config.json'), 'w', encoding='utf-8') as f:
+            json.dump({**run_req.dict(), 'sweep_id': sweep_id, 'run': i, 'rule': kwargs['rule_data']}, f, ensure_ascii=False, indent=2)
+        runs.append((params, run_req.algorithm, kwargs))
+    config = {**req.dict(), 'sweep_id': sweep_id, 'runs': combos, 'created_at': datetime.now().isoformat()}
+    with open(os.path.join(sweep_dir, SWEEP_JSON), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    sweep = start_sweep(sweep_id, sweep_dir, runs, req.workers)
+    return {'sweep_id': sweep_id, 'total': sweep.total, 'workers': sweep.workers}
+
+@app.get('/train/sweep/{sweep_id}')
+def get_train_sweep(sweep_id: str):
+    # 目前的排行榜；伺服器重啟前的搜尋改讀 leaderboard.json
+    sweep = get_sweep(sweep_id)
+    if sweep is not None:
+        return sweep.snapshot()
+    sweep_dir = os.path.join(JOBS_DIR, sweep_id)
+    leaderboard_path = os.path.join(sweep_dir, LEADERBOARD_JSON)
+    if not os.path.exists(leaderboard_path):
+        raise HTTPException(status_code=404, detail='Sweep not found')
+    with open(leaderboard_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    with open(os.path.join(sweep_dir, 'status.json'), 'r', encoding='utf-8') as f:
+        data['status'] = json.load(f)['status']
+    return data
+
+@app.delete('/train/sweep/{sweep_id}')
+def cancel_train_sweep(sweep_id: str):
+    sweep = get_sweep(sweep_id)
+    if sweep is None:
+        raise HTTPException(status_code=404, detail='Sweep not found')
+    if not sweep.cancel():
+        raise HTTPException(status_code=409, detail='Sweep already finished')
+    return {'sweep_id': sweep_id, 'status': 'cancelled'}
+
+@app.post('/train/{job_id}/continue')
+def continue_train(job_id: str, req: ContinueRequest):
+    # 以既有工作的 Q-Table 暖啟動新工作，沿用原本的地圖與參數
+    config = load_job_config(job_id)
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    if not any(os.path.exists(os.path.join(job_dir, name)) for name in ('q_table.npz', 'q_table.csv')):
+        raise HTTPException(status_code=409, detail='Q-Table not found')
+    updates = {'episodes': req.episodes, 'seed': req.seed, 'job_name': req.job_name or f"{config.get('job_name', '')} (續)"}
+    return create_job(TrainRequest(**{**config, **updates}), os.path.join(job_dir, 'map.json'), init_job_id=job_id, rule=config.get('rule'))
+
+@app.post('/train/{job_id}/resume')
+def resume_train(job_id: str):
+    # 從 checkpoint 續跑失敗、取消或因伺服器重啟而中斷的工作
+    config = load_job_config(job_id)
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    if get_scheduler().state(job_id) is not None:
+        raise HTTPException(status_code=409, detail='Job is still queued or running')
+    # 重複實驗只續跑留有 checkpoint 的各份，其餘依原本的種子重新訓練
+    has_checkpoint = [os.path.exists(os.path.join(path, CHECKPOINT_NPZ)) for path in replicate_dirs(job_dir)]
+    if not any(has_checkpoint):
+        raise HTTPException(status_code=409, detail='No checkpoint to resume from')
+    req = TrainRequest(**config)
+    # 沒有 rule 欄位的舊工作以預設規則訓練
+    kwargs = replicate_kwargs(req, build_train_kwargs(req, job_dir, config.get('rule')), job_dir)
+    if isinstance(kwargs, dict):
+        kwargs['resume'] = True
+    else:
+        for run_kwargs in kwargs:
+            run_kwargs['resume'] = os.path.exists(os.path.join(run_kwargs['output_dir'], CHECKPOINT_NPZ))
+    status = get_scheduler().submit(job_id, job_dir, req.algorithm, kwargs)
     return {'job_id': job_id, 'status': status}
 
+@app.delete('/train/{job_id}')
+def cancel_train(job_id: str):
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    status_path = os.path.join(job_dir, 'status.json')
+    if not os.path.exists(status_path):
+        raise HTTPException(status_code=404, detail='Job not found')
+    if not get_scheduler().cancel(job_id, job_dir):
+        raise HTTPException(status_code=409, detail='Job already finished')
+    return {'job_id': job_id, 'status': 'cancelled'}
+
 @app.get('/train/{job_id}/status')
 def get_train_status(job_id: str):
     job_dir = os.path.join(JOBS_DIR, job_id)
@@ -99,6 +313,40 @@ def get_train_status(job_id: str):
     with open(status_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def format_event(seq, kind, data):
+    """組成一筆 Server-Sent Events 訊息"""
+    return f"id: {seq}\nevent: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get('/train/{job_id}/events')
+async def train_events(job_id: str, request: Request):
+    # 以 SSE 推送狀態變化與每 k 回合的訓練進度（資料來自排程器的記憶體事件緩衝）
+    status_path = os.path.join(JOBS_DIR, job_id, 'status.json')
+    if not os.path.exists(status_path):
+        raise HTTPException(status_code=404, detail='Job not found')
+    channel = get_scheduler().channel(job_id)
+    try:
+        last_seq = int(request.headers.get('last-event-id', 0))
+    except ValueError:
+        last_seq = 0
+
+    async def stream():
+        if channel is None:
+            # 沒有事件緩衝的舊工作：只送出目前狀態
+            with open(status_path, 'r', encoding='utf-8') as f:
+                yield format_event(0, 'status', json.load(f))
+            return
+        seq = last_seq
+        while True:
+            closed = channel.closed
+            for seq, kind, data in channel.since(seq):
+                yield format_event(seq, kind, data)
+            if closed or await request.is_disconnected():
+                return
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(stream(), media_type='text/event-stream', headers=headers)
+
 @app.get('/train/{job_id}/result')
 def get_train_result(job_id: str):
     job_dir = os.path.join(JOBS_DIR, job_id)
@@ -0,0 +1,187 @@
+import os
+import numpy as np
+
+from qtable import QTable
+from random_streams import EpisodeStreams
+from log_writer import StepLogWriter, TailLogWriter, CsvLogSink, LogPolicy, LOG_EVERY, LOG_LAST
+from artifacts import NpzLogSink, EpisodeLog, save_qtable_npz, load_qtable_frame, training_result, save_result, LOG_NPZ, QTABLE_NPZ
+from early_stop import EarlyStopper, stops_early, STOP_PATIENCE, STOP_REASONS
+from profiler import Profiler
+from checkpoint import Checkpointer, load_checkpoint, restore_streams, CHECKPOINT_EVERY
+
+# 結束訊息中的演算法名稱
+ALGORITHM_NAMES = {'q_learning': 'Q-Learning', 'sarsa': 'SARSA(λ)', 'dyna_q': 'Dyna-Q'}
+
+
+class TrainSession:
+    """各訓練器共用的準備與收尾
+
+    setup 處理 checkpoint 續跑、亂數串流、Q-Table（含暖啟動）、訓練記錄、提前停止與 checkpoint；
+    finish 寫出 Q-Table、記錄檔與 result.json。訓練器只負責各自的訓練迴圈。
+    以 with 使用：訓練失敗時放棄尚未寫出的記錄並停止背景寫入執行緒，也一律停止 profiler，
+    常駐的訓練行程不會留下上一個工作的寫入器、tracemalloc 或 cProfile（續跑時由 checkpoint 的位置接著寫）。
+    """
+
+    def __init__(self, algorithm, output_dir, episodes, seed=None, strict_goal_reward_zero=True, q_dtype='float64', initial_value=0.0, log_level='full', log_every=LOG_EVERY, log_last=LOG_LAST, progress=None, checkpoint_every=CHECKPOINT_EVERY, resume=False, init_q=None, replicate=None, stop_delta_q=None, stop_policy=False, stop_success=None, stop_patience=STOP_PATIENCE, stop_min_episodes=0, profile=False, profile_memory=False, profile_dump=False):
+        # 各階段計時（未啟用時為 None，訓練迴圈不受影響）
+        self.profiler = Profiler(profile_memory, profile_dump) if profile else None
+        self.algorithm = algorithm
+        self.output_dir = output_dir
+        self.episodes = episodes
+        self.seed = seed
+        self.strict_goal_reward_zero = strict_goal_reward_zero
+        self.q_dtype = q_dtype
+        self.initial_value = initial_value
+        self.log_level = log_level
+        self.log_every = log_every
+        self.log_last = log_last
+        self.progress = progress
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
+        self.init_q = init_q
+        self.replicate = replicate
+        self.stop_args = (stop_delta_q, stop_policy, stop_success, stop_patience, stop_min_episodes)
+        self.log_writer = None
+        # 設定隨機種子以提高可重現性（經 SeedSequence 衍生每回合獨立的亂數串流）
+        if seed is not None:
+            print(f"隨機種子設定為: {seed}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and self.log_writer is not None:
+            self.log_writer.abort()
+        if self.profiler is not None:
+            self.profiler.stop()
+        return False
+
+    def setup(self, env, lambda_value=None, extra=None):
+        """建立訓練所需的物件；extra 為演算法額外的狀態（具 state / restore 方法，隨 checkpoint 保存）"""
+        self.env = env
+        output_dir = self.output_dir
+
+        # 從 checkpoint 續跑時沿用原本的總回合數（探索率排程）與亂數串流
+        checkpoint = load_checkpoint(output_dir, self.algorithm) if self.resume else None
+        if self.resume and checkpoint is None:
+            raise ValueError(f'找不到可續跑的 checkpoint: {output_dir}')
+        if checkpoint is not None:
+            self.episodes = checkpoint['episodes']
+            self.streams = restore_streams(checkpoint, env.max_steps)
+            print(f"從 checkpoint 續跑：第 {checkpoint['episode'] + 1} 回合起")
+        else:
+            self.streams = EpisodeStreams(self.seed, env.max_steps)
+            if self.replicate is not None:
+                # 重複實驗：各份使用同一種子衍生的獨立子串流
+                self.streams = self.streams.child(self.replicate)
+                print(f"重複實驗第 {self.replicate} 份")
+
+        # 初始化 Q-Table（只涵蓋可到達狀態的連續陣列）
+        self.q_table = QTable(env, self.initial_value, self.q_dtype)
+        if checkpoint is not None:
+            self.q_table.values[...] = checkpoint['values']
+            if extra is not None:
+                extra.restore(checkpoint['extra'])
+        elif self.init_q is not None:
+            # 以既有訓練的 Q-Table 暖啟動
+            init_frame = load_qtable_frame(self.init_q)
+            if init_frame is None:
+                raise ValueError(f'找不到暖啟動用的 Q-Table: {self.init_q}')
+            print(f"以 {self.init_q} 的 Q-Table 暖啟動（{self.q_table.load_frame(init_frame)} 個配對）")
+
+        # 訓練記錄以串流方式分塊寫入 log.csv 與欄式二進位的 log.npz（依記錄層級取捨）
+        self.log_policy = LogPolicy(self.log_level, self.episodes, self.log_every, self.log_last, open_end=stops_early(*self.stop_args[:3]))
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+        except PermissionError:
+            raise ValueError(f'沒有權限寫入目錄: {output_dir}')
+        sink_states = checkpoint['log_sinks'] if checkpoint is not None else [None, None]
+        self.log_writer = StepLogWriter([CsvLogSink(os.path.join(output_dir, 'log.csv'), env.state_labels, lambda_value, resume=sink_states[0]),
+                                         NpzLogSink(os.path.join(output_dir, LOG_NPZ), env.state_cells, lambda_value, self.log_policy.to_dict(), resume=sink_states[1])])
+        if self.log_policy.tail:
+            # 可能提前停止：保留最近 log_last 個回合，結束時才寫出
+            self.log_writer = TailLogWriter(self.log_writer, self.log_last)
+            if checkpoint is not None:
+                self.log_writer.restore(checkpoint['log_tail'])
+        self.episode_log = EpisodeLog(output_dir, env, self.episodes, progress=self.progress)  # 每回合摘要（episodes.csv / episodes.npz），並送出進度事件
+        self.episode_rewards = []  # 記錄每回合的總獎勵
+        self.start_episode = 1
+        if checkpoint is not None:
+            self.episode_log.restore(checkpoint['episode_log'], checkpoint['summary'])
+            self.episode_rewards = checkpoint['episode_rewards']
+            self.start_episode = checkpoint['episode'] + 1
+        # 提前停止條件（未指定時不做任何判斷）
+        self.stopper = EarlyStopper(self.q_table, self.episode_log, *self.stop_args, self.start_episode)
+        if checkpoint is not None:
+            self.stopper.restore(checkpoint.get('early_stop'))
+        self.checkpointer = Checkpointer(output_dir, self.algorithm, self.checkpoint_every, self.episodes, self.q_table, self.streams,
+                                         self.log_writer, self.episode_log, self.episode_rewards, self.start_episode - 1, self.stopper, extra)
+        return self.q_table
+
+    def instrument(self, env, traces=None, model=None):
+        """啟用計時時包裝訓練迴圈用到的方法並結束 setup 階段，回傳訓練應使用的環境"""
+        if self.profiler is None:
+            return env
+        env = self.profiler.instrument(env, self.q_table, self.log_writer, self.episode_log, traces, model)
+        self.profiler.wrap(self, 'on_batch_end', 'checkpoint')
+        self.profiler.mark('setup')
+        return env
+
+    def on_batch_end(self, episode):
+        """批次（或回合）結束：先判斷是否提前停止，未停止才寫 checkpoint；應停止時回傳 True"""
+        if self.stopper.update(episode):
+            return True
+        self.checkpointer.maybe_save(episode)
+        return False
+
+    def end_episode(self, episode, steps, action, total_reward, terminal_state, done, epsilon, success):
+        """逐回合訓練的回合收尾（摘要列、獎勵歸零判斷、每回合摘要與進度），應停止時回傳 True"""
+        if self.log_policy.summary:
+            self.log_writer.append(episode, steps, self.env.start, action, total_reward, terminal_state, done, epsilon, success)
+        # 最終 reward 歸零判斷
+        reward = 0 if self.strict_goal_reward_zero and not success else total_reward
+        self.episode_rewards.append(reward)
+        self.episode_log.append(episode, total_reward, reward, steps, success, terminal_state, epsilon)
+
+        # 每 50 回合顯示進度
+        if episode % 50 == 0:
+            avg_reward = np.mean(self.episode_rewards[-50:])
+            print(f"回合 {episode}/{self.episodes}, 平均獎勵: {avg_reward:.2f}, 探索率: {epsilon:.3f}")
+        return self.on_batch_end(episode)
+
+    def finish(self, **extra_result):
+        """寫出剩餘的訓練記錄、Q-Table 與 result.json，回傳訓練結果摘要"""
+        if self.profiler is not None:
+            self.profiler.mark('train_loop')
+        output_dir = self.output_dir
+        qtable_output = os.path.join(output_dir, 'q_table.csv')
+        self.log_writer.close()
+        self.episode_log.close()
+        try:
+            self.q_table.to_frame().to_csv(qtable_output, index=False)
+            save_qtable_npz(os.path.join(output_dir, QTABLE_NPZ), self.q_table, self.env)
+        except PermissionError:
+            raise ValueError(f'沒有權限寫入目錄: {output_dir}')
+        self.checkpointer.remove()
+
+        # 輸出訓練統計
+        episode_rewards = self.episode_rewards
+        final_avg_reward = np.mean(episode_rewards[-100:]) if len(episode_rewards) >= 100 else np.mean(episode_rewards)
+        print(f"\n{ALGORITHM_NAMES[self.algorithm]} 訓練完成！")
+        print(f"Q-Table 已儲存至: {qtable_output}")
+        print(f"訓練記錄已儲存至: {os.path.join(output_dir, 'log.csv')}")
+        print(f"最終 100 回合平均獎勵: {final_avg_reward:.2f}")
+        print(f"總回合數: {len(episode_rewards)}")
+        stopper = self.stopper
+        if stopper.reason is not None:
+            print(f"第 {stopper.episode} 回合提前停止：{STOP_REASONS[stopper.reason]}")
+
+        result = training_result(self.algorithm, episode_rewards, self.episode_log)
+        result.update(stopper.summary())
+        result.update(extra_result)
+        save_result(output_dir, result)
+        if self.profiler is not None:
+            self.profiler.mark('output')
+            self.profiler.finish(output_dir, algorithm=self.algorithm, episodes=len(episode_rewards),
+                                 steps=int(self.episode_log.columns['steps'][:self.episode_log.size].sum()))
+        return result
@@ -0,0 +1,161 @@
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+from contextlib import redirect_stdout
+
+MAX_DEFAULT_WORKERS = 8  # 未設定 TRAIN_WORKERS 時的行程數上限
+# 常駐訓練行程數（同時執行的訓練上限），預設為 CPU 數減一、保留一顆給 API
+POOL_SIZE = int(os.environ.get('TRAIN_WORKERS', min(MAX_DEFAULT_WORKERS, max(1, (os.cpu_count() or 2) - 1))))
+TRAIN_LOG = 'train.log'  # 訓練過程輸出（原本 print 到終端機的內容）
+
+
+class TrainingError(RuntimeError):
+    """訓練失敗（附帶工作行程中的 traceback）"""
+
+
+class TrainingCancelled(TrainingError):
+    """訓練被取消（工作行程已被終止）"""
+
+
+def _worker(conn):
+    """工作行程：啟動時先載入 NumPy、pandas 與訓練模組，之後逐一執行父行程送來的訓練"""
+    import q_learning
+    import sarsa
+    import dyna_q
+    trainers = {'q_learning': q_learning.main, 'sarsa': sarsa.main, 'dyna_q': dyna_q.main}
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        algorithm, kwargs = message
+        kwargs['progress'] = lambda event: conn.send(('event', event))  # 進度事件經 Pipe 即時回傳
+        try:
+            os.makedirs(kwargs['output_dir'], exist_ok=True)
+            with open(os.path.join(kwargs['output_dir'], TRAIN_LOG), 'w', encoding='utf-8') as log, redirect_stdout(log):
+                result = trainers[algorithm](**kwargs)
+            conn.send(('result', result))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+
+class TrainerPool:
+    """預熱的訓練行程池
+
+    每個工作行程以 Pipe 與父行程溝通，訓練結束後留著等待下一個工作，
+    不必每次重新啟動直譯器與匯入套件；已編譯的地圖也快取在行程內（見 grid_env.compile_env）。
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self._ctx = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = {}  # job_id -> 執行中的工作行程
+        self._cancel_requests = set()  # 尚未開始就被取消的工作
+        self.size = max(1, size)
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker, args=(child,), name='trainer', daemon=True)
+        process.start()
+        child.close()
+        return process, parent
+
+    def _discard(self, worker):
+        process, conn = worker
+        conn.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    def run(self, algorithm, kwargs, job_id=None, on_event=None):
+        """在閒置的工作行程中執行 q_learning.main / sarsa.main / dyna_q.main，回傳訓練結果摘要
+
+        訓練中的進度事件會依序傳給 on_event。
+        """
+        worker = self._idle.get()
+        with self._lock:
+            cancelled = job_id in self._cancel_requests
+            if cancelled:
+                self._cancel_requests.discard(job_id)
+            else:
+                self._running[job_id] = worker
+        if cancelled:
+            self._idle.put(worker)
+            raise TrainingCancelled(job_id)
+        try:
+            worker[1].send((algorithm, kwargs))
+            kind, payload = worker[1].recv()
+            while kind == 'event':
+                if on_event is not None:
+                    on_event(payload)
+                kind, payload = worker[1].recv()
+        except (EOFError, OSError) as e:
+            # 工作行程被取消或異常結束時換一個新的行程
+            self._discard(worker)
+            worker = self._spawn()
+            if job_id in self._cancel_requests:
+                raise TrainingCancelled(job_id)
+            raise TrainingError(f'訓練行程異常結束: {e}')
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+                self._cancel_requests.discard(job_id)
+            self._idle.put(worker)
+        if kind == 'error':
+            raise TrainingError(payload)
+        return payload
+
+    def cancel(self, job_id):
+        """取消工作：執行中則終止其行程（run 會拋出 TrainingCancelled），尚未開始則標記為取消"""
+        with self._lock:
+            self._cancel_requests.add(job_id)
+            worker = self._running.get(job_id)
+            if worker is not None:
+                worker[0].terminate()
+
+    def forget(self, job_ids):
+        """清除已結束工作殘留的取消標記（取消請求晚於工作結束時）"""
+        with self._lock:
+            self._cancel_requests.difference_update(job_ids)
+
+    def close(self):
+        """通知所有閒置的工作行程結束"""
+        while True:
+            try:
+                process, conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(timeout=5)
+            self._discard((process, conn))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """取得（必要時建立）全域訓練行程池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = TrainerPool()
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
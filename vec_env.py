@@ -0,0 +1,205 @@
+import numpy as np
+
+from grid_env import ACTIONS, KIND_EMPTY, KIND_GOAL, KIND_TRAP
+from qtable import pick_among
+from traces import trace_window, WINDOW_CUTOFF
+from log_writer import LogPolicy
+
+
+class VecGridEnv:
+    """N 個同地圖環境以 NumPy 陣列同步執行
+
+    每個環境只保留位置與獎勵格取用遮罩（N × 獎勵格數），
+    取代每回合 deepcopy 整張地圖。
+    """
+
+    def __init__(self, env, num_envs):
+        self.env = env
+        self.num_envs = num_envs
+        self.states = np.full(num_envs, env.start, dtype=np.int64)
+        self.consumed = np.zeros((num_envs, env.n_bonuses), dtype=bool)
+
+    def reset(self):
+        """所有環境回到起點並重置獎勵格"""
+        self.states[:] = self.env.start
+        self.consumed[:] = False
+
+    def step(self, idx, actions, step):
+        """對 idx 指定的環境執行動作，回傳 (下一狀態, 衰減後獎勵, 下一格種類)"""
+        env = self.env
+        next_states = env.next_state[self.states[idx], actions]
+        kinds = env.kind[next_states].astype(np.int64)
+        bonus = env.bonus_id[next_states]
+        on_bonus = np.flatnonzero(bonus >= 0)
+        if on_bonus.size:
+            envs, bonus = idx[on_bonus], bonus[on_bonus]
+            taken = self.consumed[envs, bonus]
+            kinds[on_bonus[taken]] = KIND_EMPTY  # 已取得的獎勵格視為空格
+            self.consumed[envs[~taken], bonus[~taken]] = True
+        self.states[idx] = next_states
+        return next_states, env.reward_table[kinds, step], kinds
+
+
+def train_vectorized(env, q_table, streams, log_writer, episodes, num_envs, learning_rate, discount_factor,
+                     get_epsilon, strict_goal_reward_zero=True, lambda_value=None,
+                     trace_mode='accumulating', trace_cutoff=WINDOW_CUTOFF, log_policy=None, episode_log=None,
+                     start_episode=1, episode_rewards=None, on_batch_end=None):
+    """以 num_envs 個環境同步跑回合的批次訓練
+
+    lambda_value 為 None 時做 Q-Learning，否則做 SARSA(λ)：資格跡以每個環境最近的步數視窗實作，
+    權重衰減到 trace_cutoff 以下的步數即截斷；取代式資格跡只保留同一配對最近一次的權重。
+    同一批中多個環境更新到同一個 (狀態, 動作) 時取平均，避免學習率被放大。
+    因此 SARSA(λ) 的結果是逐回合訓練的近似，也不使用 traces 的資格跡引擎（trace_engine）。
+    每個回合使用 streams 中該回合的預抽亂數，與逐回合訓練相同。
+    每個環境的步數、最後一步與總獎勵以陣列追蹤；只有 log_policy 需要逐步記錄的回合才收集逐步欄位，
+    每批結束時依 (回合, 步數) 排序後寫入 log_writer（'episode' 層級直接寫入追蹤到的摘要列），
+    每回合摘要寫入 episode_log，並以該批最後的回合編號呼叫 on_batch_end（checkpoint 與提前停止用，
+    回傳 True 時停止訓練）。
+    從 checkpoint 續跑時由 start_episode 開始，並接在既有的 episode_rewards 之後；
+    回傳每回合（歸零判斷後）的總獎勵。
+    逐步記錄的排序與寫出成本與記錄的步數成正比，log_level='full' 時加速有限，
+    需搭配 'episode' 等較粗的記錄層級才能明顯提高每秒回合數。
+    """
+    sarsa = lambda_value is not None
+    if log_policy is None:
+        log_policy = LogPolicy(episodes=episodes)
+    max_steps = env.max_steps
+    q_values = q_table.values
+    flat_q = q_values.reshape(-1)
+    n_actions = len(ACTIONS)
+    decay = lambda_value * discount_factor if sarsa else 0.0
+    window = min(max_steps, trace_window(decay, trace_cutoff))
+    replacing = sarsa and trace_mode == 'replacing'
+    weights = decay ** np.arange(window)[::-1] if sarsa else np.ones(1)
+    vec = VecGridEnv(env, num_envs)
+
+    def select(idx, states, epsilon, randoms):
+        # 批次 ε-greedy：第 0 欄亂數決定是否探索，第 1 欄用於挑動作（隨機或平手）
+        explore = randoms[:, 0] < epsilon[idx]
+        u = randoms[:, 1]
+        return np.where(explore, pick_among(env.valid_mask[states], u), q_table.greedy_batch(states, u))
+
+    if episode_rewards is None:
+        episode_rewards = []
+    for first in range(start_episode, episodes + 1, num_envs):
+        n = min(num_envs, episodes - first + 1)
+        episode_ids = np.arange(first, first + n)
+        epsilon = np.array([get_epsilon(episode, episodes) for episode in episode_ids])
+        randoms = streams.episode_blocks(episode_ids)  # (環境數, max_steps + 1, 2)
+        vec.reset()
+        active = np.arange(n)
+        totals = np.zeros(n, dtype=np.int64)
+        last_kind = np.full(n, -1, dtype=np.int64)
+        steps = np.zeros(n, dtype=np.int64)
+        last_action = np.zeros(n, dtype=np.int64)
+        last_state = np.zeros(n, dtype=np.int64)
+        history = np.zeros((n, max_steps), dtype=np.int64)  # 每步的 (狀態, 動作) 扁平索引
+        logs_steps = np.array([log_policy.logs_steps(int(episode)) for episode in episode_ids], dtype=bool)
+        log_all = logs_steps.all()
+        log_columns = []
+        actions = select(active, vec.states[active], epsilon, randoms[active, 0]) if sarsa else None
+
+        for step in range(1, max_steps + 1):
+            states = vec.states[active].copy()
+            if not sarsa:
+                actions = select(active, states, epsilon, randoms[active, step - 1])
+            next_states, rewards, kinds = vec.step(active, actions, step)
+            totals[active] += rewards
+            last_kind[active] = kinds
+            steps[active] = step
+            last_action[active] = actions
+            last_state[active] = next_states
+
+            keys = states * n_actions + actions
+            if sarsa:
+                next_actions = select(active, next_states, epsilon, randoms[active, step])
+                next_q = q_values[next_states, next_actions]
+            else:
+                next_q = q_values[next_states].max(axis=1)
+            td_errors = rewards + discount_factor * next_q - flat_q[keys]
+
+            # 批次更新：視窗內歷史 (狀態, 動作) 依衰減權重分攤 TD 誤差，同一鍵依環境數取平均
+            history[active, step - 1] = keys
+            lo = max(0, step - window)
+            hist_keys = history[active, lo:step]
+            updates = learning_rate * td_errors[:, None] * weights[window - (step - lo):]
+            # 依鍵穩定排序：同一環境內重複的鍵相鄰、且較晚的步數在後
+            order = np.argsort(hist_keys, axis=1, kind='stable')
+            sorted_keys = np.take_along_axis(hist_keys, order, axis=1)
+            last = np.ones(sorted_keys.shape, dtype=bool)
+            last[:, :-1] = sorted_keys[:, :-1] != sorted_keys[:, 1:]
+            if replacing:
+                # 取代式：同一配對只保留最近一次造訪的權重
+                keep = np.zeros(hist_keys.shape, dtype=bool)
+                np.put_along_axis(keep, order, last, axis=1)
+                updates = updates * keep
+            sums = np.bincount(hist_keys.ravel(), weights=updates.ravel(), minlength=flat_q.size)
+            counts = np.bincount(sorted_keys[last], minlength=flat_q.size)
+            touched = np.flatnonzero(counts)
+            flat_q[touched] += sums[touched] / counts[touched]
+
+            done = (kinds == KIND_GOAL) | (kinds == KIND_TRAP)
+            if log_all or logs_steps[active].any():
+                rows = slice(None) if log_all else logs_steps[active]
+                log_columns.append({
+                    'episode': episode_ids[active][rows],
+                    'step': np.full(len(active), step)[rows],
+                    'state': states[rows],
+                    'action': actions[rows],
+                    'reward': rewards[rows],
+                    'next_state': next_states[rows],
+                    'done': done[rows],
+                    'epsilon': epsilon[active][rows],
+                    'success': (kinds == KIND_GOAL)[rows]
+                })
+
+            keep = ~done
+            active = active[keep]
+            if sarsa:
+                actions = next_actions[keep]
+            if not active.size:
+                break
+
+        success = last_kind == KIND_GOAL
+        if log_columns:
+            log_writer.append_columns(sort_log_columns(log_columns))
+        elif log_policy.summary:
+            # 與 summarize_episodes 相同的摘要列：state 為起點，其餘欄位取回合最後一步
+            log_writer.append_columns({
+                'episode': episode_ids,
+                'step': steps,
+                'state': np.full(n, env.start, dtype=np.int64),
+                'action': last_action,
+                'reward': totals.copy(),
+                'next_state': last_state,
+                'done': success | (last_kind == KIND_TRAP),
+                'epsilon': epsilon,
+                'success': success,
+            })
+        if episode_log is not None:
+            episode_log.append_columns({
+                'episode': episode_ids,
+                'total_reward': totals.copy(),
+                'reward': np.where(success, totals, 0) if strict_goal_reward_zero else totals,
+                'steps': steps,
+                'success': success,
+                'terminal_state': last_state,
+                'epsilon': epsilon,
+            })
+        if strict_goal_reward_zero:
+            totals[~success] = 0
+        episode_rewards.extend(totals.tolist())
+        for episode in range(first + (-first) % 50, first + n, 50):
+            avg_reward = np.mean(episode_rewards[episode - 50:episode])
+            print(f"回合 {episode}/{episodes}, 平均獎勵: {avg_reward:.2f}, 探索率: {epsilon[episode - first]:.3f}")
+        if on_batch_end is not None and on_batch_end(int(episode_ids[-1])):
+            break
+
+    return episode_rewards
+
+
+def sort_log_columns(log_columns):
+    """合併一批的逐步記錄欄位，並依 (回合, 步數) 排序以符合逐回合訓練的記錄順序"""
+    columns = {name: np.concatenate([chunk[name] for chunk in log_columns]) for name in log_columns[0]}
+    order = np.lexsort((columns['step'], columns['episode']))
+    return {name: values[order] for name, values in columns.items()}